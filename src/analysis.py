@@ -3,10 +3,13 @@
 from enum import IntEnum
 from math import log2
 from collections import Counter
-from sys import stderr
+from sys import stderr, version_info
+from typing import NamedTuple
+from histograms import np, sectors_view, uniform_rows, byte_histograms, bit_group_histograms, group_histograms, \
+    first_positions, merge_first_positions
 
 try:
-    from scipy.stats import chi2, kstest, uniform
+    from scipy.stats import chi2, kstwobign
 except ImportError:
     print('the scipy library is not installed. \n'
           'Use `pip install scipy` to install it', file=stderr)
@@ -21,9 +24,127 @@ class ResultFlag(IntEnum):
     RANDOMNESS_SUSPICIOUSLY_HIGH = 4
 
 
-class ShannonsEntropy:
-    def __init__(self, sector_size, rand_lim=None, sus_rand_lim=None):
+class SectorResults(NamedTuple):
+    """Results of a run of consecutive sectors, one array element per sector"""
+    randomness: np.ndarray  # float64 (float32 when read from a results file)
+    flag: np.ndarray  # uint8 values of ResultFlag
+    pattern: np.ndarray  # uint8, only meaningful where flag is SINGLE_BYTE_PATTERN
+
+    @staticmethod
+    def empty(count):
+        return SectorResults(
+            np.zeros(count, dtype=np.float64),
+            np.zeros(count, dtype=np.uint8),
+            np.zeros(count, dtype=np.uint8)
+        )
+
+    def rows(self):
+        """Yields the results of each sector in the same form as calc() returns them"""
+        for randomness, flag, pattern in zip(self.randomness.tolist(), self.flag.tolist(), self.pattern.tolist()):
+            if flag == ResultFlag.SINGLE_BYTE_PATTERN:
+                yield randomness, ResultFlag.SINGLE_BYTE_PATTERN, pattern
+            else:
+                yield randomness, ResultFlag(flag), None
+
+
+class AnalysisMethodBase:
+    CLASSIFIES_RANDOMNESS = True  # whether random looking sectors are flagged RANDOM or RANDOMNESS_SUSPICIOUSLY_HIGH
+
+    def __init__(self, sector_size, rand_lim=0.9999, sus_rand_lim=0.0001):
         self.sector_size = sector_size
+        self._uniform_results = None
+
+    def calc(self, buf):
+        raise NotImplementedError(
+            f'Class {self.__class__.__name__} needs to implement the calc() method'
+        )
+
+    def calc_batch(self, block):
+        """Calculates the results of every sector of a block of consecutive sectors
+        and returns them as SectorResults"""
+        count = len(block) // self.sector_size
+        results = SectorResults.empty(count)
+        block = memoryview(block)
+        for i in range(count):
+            randomness, flag, pattern = self.calc(block[i * self.sector_size:(i + 1) * self.sector_size])
+            results.randomness[i] = randomness
+            results.flag[i] = flag
+            if pattern is not None:
+                results.pattern[i] = pattern
+        return results
+
+    def uniform_results(self, values):
+        """Returns the results of sectors consisting only of the byte values of the argument"""
+        if self._uniform_results is None:
+            # calculate the results of each of the 256 uniform sectors once,
+            # a few values at a time to keep the memory use bounded for large sectors
+            step = max((1 << 20) // self.sector_size, 1)
+            table = [self.calc_batch(np.repeat(np.arange(start, min(start + step, 256), dtype=np.uint8),
+                                               self.sector_size))
+                     for start in range(0, 256, step)]
+            self._uniform_results = SectorResults(*(np.concatenate(column) for column in zip(*table)))
+        return SectorResults(*(column[values] for column in self._uniform_results))
+
+
+class HistogramAnalysisMethodBase(AnalysisMethodBase):
+    """Base of the methods which only depend on the byte histogram of the sector"""
+    NEEDS_FIRST_POSITIONS = False  # whether calc_histograms() needs the first positions of the byte values
+
+    def calc_batch(self, block):
+        sectors = sectors_view(block, self.sector_size)
+        return self.calc_histograms(byte_histograms(sectors),
+                                    first_positions(sectors) if self.NEEDS_FIRST_POSITIONS else None)
+
+    def calc_histograms(self, counts, positions=None):
+        """Calculates the results from a (sectors, 256) array of byte counts and, if NEEDS_FIRST_POSITIONS,
+        a (sectors, 256) array of the positions of the first occurrences of the byte values"""
+        raise NotImplementedError(
+            f'Class {self.__class__.__name__} needs to implement the calc_histograms() method'
+        )
+
+    def _single_byte_patterns(self, counts, results):
+        """Marks the sectors consisting of a single byte value and returns their mask"""
+        mask = counts.max(axis=1) == self.sector_size
+        results.randomness[mask] = 0.0
+        results.flag[mask] = ResultFlag.SINGLE_BYTE_PATTERN
+        results.pattern[mask] = counts[mask].argmax(axis=1)
+        return mask
+
+
+class ChiSquareBase(AnalysisMethodBase):
+    def _classify(self, chis):
+        """Returns the randomness and result flags for an array of chi square values"""
+        randomness = 1 - chis / self.max_chis
+        flag = np.full(len(chis), ResultFlag.NOT_RANDOM, dtype=np.uint8)
+        flag[chis <= self.random_limit] = ResultFlag.RANDOM
+        flag[chis < self.sus_random_limit] = ResultFlag.RANDOMNESS_SUSPICIOUSLY_HIGH
+        return randomness, flag
+
+
+def _builtin_sums(terms):
+    """Returns the sums of the rows of the (rows, terms) array, the same as sum() of each row"""
+    totals = np.zeros(len(terms))
+    if version_info < (3, 12):
+        for column in terms.T:
+            totals += column
+        return totals
+
+    compensation = np.zeros(len(terms))
+    for column in terms.T:
+        t = totals + column
+        compensation += np.where(np.abs(totals) >= np.abs(column), (totals - t) + column, (column - t) + totals)
+        totals = t
+    return totals + compensation
+
+
+class ShannonsEntropy(HistogramAnalysisMethodBase):
+    NEEDS_FIRST_POSITIONS = True
+    CLASSIFIES_RANDOMNESS = False  # only the single byte pattern is flagged
+
+    def __init__(self, sector_size, rand_lim=None, sus_rand_lim=None):
+        super().__init__(sector_size)
+        # f * log2(f) for every possible byte count f
+        self._terms = np.array([0.0] + [f * log2(f) for f in range(1, sector_size + 1)])
 
     def calc(self, buf):
         """ Calculates and returns sample entropy on byte level for
@@ -42,9 +163,22 @@ class ShannonsEntropy:
 
         return normalized_entropy, ResultFlag.NONE, None
 
+    def calc_histograms(self, counts, positions=None):
+        # calc() sums the terms in the order of the first occurrences of the byte values (the order of the Counter),
+        # the zero terms of the values not present are added last
+        order = np.argsort(positions, axis=1, kind='stable')[:, :np.count_nonzero(counts, axis=1).max(initial=0)]
+        terms = self._terms[np.take_along_axis(counts, order, axis=1)]
+        entropy = _builtin_sums(terms) / self.sector_size - log2(self.sector_size)
+        results = SectorResults(np.abs(entropy) / 8,
+                                np.full(len(counts), ResultFlag.NONE, dtype=np.uint8),
+                                np.zeros(len(counts), dtype=np.uint8))
+        self._single_byte_patterns(counts, results)
+        return results
+
 
-class ChiSquare8:
+class ChiSquare8(ChiSquareBase, HistogramAnalysisMethodBase):
     def __init__(self, sector_size, rand_lim=0.9999, sus_rand_lim=0.0001):
+        super().__init__(sector_size)
         self.expected = sector_size / 256
         if self.expected < 5:
             print('warn: the sector size seems to be too small to use with this calculation method.', file=stderr)
@@ -65,9 +199,16 @@ class ChiSquare8:
             return randomness, ResultFlag.RANDOM, None
         return randomness, ResultFlag.NOT_RANDOM, None
 
+    def calc_histograms(self, counts, positions=None):
+        results = SectorResults(*self._classify(((counts - self.expected) ** 2).sum(axis=1)),
+                                np.zeros(len(counts), dtype=np.uint8))
+        self._single_byte_patterns(counts, results)
+        return results
+
 
-class ChiSquare4:
+class ChiSquare4(ChiSquareBase, HistogramAnalysisMethodBase):
     def __init__(self, sector_size, rand_lim=0.9999, sus_rand_lim=0.0001):
+        super().__init__(sector_size)
         self.expected = sector_size / 8
         if self.expected < 5:
             print('warn: the sector size seems to be too small to use with this calculation method.', file=stderr)
@@ -92,11 +233,22 @@ class ChiSquare4:
             return randomness, ResultFlag.RANDOM, None
         return randomness, ResultFlag.NOT_RANDOM, None
 
+    def calc_histograms(self, counts, positions=None):
+        # byte value b = 16 * high + low, so the nibble counts are the sums over the other nibble
+        by_nibbles = counts.reshape(-1, 16, 16)
+        vals = by_nibbles.sum(axis=1) + by_nibbles.sum(axis=2)
+        results = SectorResults(*self._classify(((vals - self.expected) ** 2).sum(axis=1)),
+                                np.zeros(len(counts), dtype=np.uint8))
+        self._single_byte_patterns(counts, results)
+        return results
 
-class ChiSquare3:
-    N = 3
+
+class ChiSquareN(ChiSquareBase):
+    """Chi square test of the distribution of the non-overlapping groups of N consecutive bits"""
+    N = None
 
     def __init__(self, sector_size, rand_lim=0.9999, sus_rand_lim=0.0001):
+        super().__init__(sector_size)
         self.single_byte_pattern_count = (sector_size * 8) // self.N
         self.expected = ((sector_size * 8) // self.N) / (2 ** self.N)
         if self.expected < 5:
@@ -106,75 +258,170 @@ class ChiSquare3:
         self.max_chis = (sector_size - self.expected) ** 2 + 255 * self.expected ** 2
 
     def calc(self, buf):
-        vals = [0] * (2 ** self.N)
-        rem = 0
-        bits = 0
-        for byte in buf:
-            for offset in range(8):
-                rem = (rem << 1) | ((byte >> (7 - offset)) & 1)
-                bits += 1
-                if bits == self.N:
-                    vals[rem] += 1
-                    bits = 0
-                    rem = 0
-        if vals[0] == self.single_byte_pattern_count:
-            return 0.0, ResultFlag.SINGLE_BYTE_PATTERN, 0
-        if vals[-1] == self.single_byte_pattern_count:
-            return 0.0, ResultFlag.SINGLE_BYTE_PATTERN, 255
-        chis = sum((i - self.expected) ** 2 for i in vals)
-        randomness = 1 - chis / self.max_chis
-        if chis < self.sus_random_limit:
-            return randomness, ResultFlag.RANDOMNESS_SUSPICIOUSLY_HIGH, None
-        if chis <= self.random_limit:
-            return randomness, ResultFlag.RANDOM, None
-        return randomness, ResultFlag.NOT_RANDOM, None
+        return next(self.calc_batch(buf).rows())
 
+    def calc_batch(self, block):
+        return self._calc_group_counts(bit_group_histograms(sectors_view(block, self.sector_size), self.N))
 
-class ChiSquare1:
-    def __init__(self, sector_size, rand_lim=0.9999, sus_rand_lim=0.0001):
-        self.single_byte_pattern_count = sector_size * 8
-        self.expected = sector_size * 4
-        if self.expected < 5:
-            print('warn: the sector size seems to be too small to use with this calculation method.', file=stderr)
-        self.random_limit = chi2.ppf(rand_lim, 1) * self.expected
-        self.sus_random_limit = chi2.ppf(sus_rand_lim, 1) * self.expected
-        self.max_chis = (sector_size - self.expected) ** 2 + 255 * self.expected ** 2
+    def _calc_group_counts(self, vals):
+        results = SectorResults(*self._classify(((vals - self.expected) ** 2).sum(axis=1)),
+                                np.zeros(len(vals), dtype=np.uint8))
+        zeros = vals[:, 0] == self.single_byte_pattern_count
+        ones = vals[:, -1] == self.single_byte_pattern_count
+        results.randomness[zeros | ones] = 0.0
+        results.flag[zeros | ones] = ResultFlag.SINGLE_BYTE_PATTERN
+        results.pattern[ones] = 255
+        return results
+
+
+class ByteAlignedChiSquareN(ChiSquareN, HistogramAnalysisMethodBase):
+    """ChiSquareN for the group widths dividing 8, which can be calculated from byte histograms"""
+
+    def calc_histograms(self, counts, positions=None):
+        return self._calc_group_counts(group_histograms(counts, self.N))
+
+
+class ChiSquare7(ChiSquareN):
+    N = 7
+
+
+class ChiSquare6(ChiSquareN):
+    N = 6
+
+
+class ChiSquare5(ChiSquareN):
+    N = 5
+
+
+class ChiSquare3(ChiSquareN):
+    N = 3
 
-    def calc(self, buf):
-        set_bits = sum(map(int.bit_count, buf))
-        if set_bits == 0:
-            return 0.0, ResultFlag.SINGLE_BYTE_PATTERN, 0
-        if set_bits == self.single_byte_pattern_count:
-            return 0.0, ResultFlag.SINGLE_BYTE_PATTERN, 255
-        chis = 2 * (set_bits - self.expected) ** 2
-        randomness = 1 - chis / self.max_chis
-        if chis < self.sus_random_limit:
-            return randomness, ResultFlag.RANDOMNESS_SUSPICIOUSLY_HIGH, None
-        if chis <= self.random_limit:
-            return randomness, ResultFlag.RANDOM, None
-        return randomness, ResultFlag.NOT_RANDOM, None
 
+class ChiSquare2(ByteAlignedChiSquareN):
+    N = 2
 
-class KSTest:
+
+class ChiSquare1(ByteAlignedChiSquareN):
+    N = 1
+
+
+class KSTest(HistogramAnalysisMethodBase):
     def __init__(self, sector_size, rand_lim=0.9999, sus_rand_lim=0.0001):
+        super().__init__(sector_size)
         self.p_rand_lim = 1 - rand_lim
         self.p_sus_rand_lim = 1 - sus_rand_lim
-        self.dist = uniform(0, 255).cdf
+        # the cdf of uniform(0, 255) at every byte value
+        self.dist = np.arange(256) / 255
 
     def calc(self, buf):
-        _, p = kstest(bytearray(buf), self.dist, mode='asymp')
-        if p > self.p_sus_rand_lim:
-            return 0.0, ResultFlag.RANDOMNESS_SUSPICIOUSLY_HIGH, None
-        if p < self.p_rand_lim:
-            return 0.5, ResultFlag.NOT_RANDOM, None
-        return 1.0, ResultFlag.RANDOM, None
+        return next(self.calc_batch(buf).rows())
+
+    def calc_histograms(self, counts, positions=None):
+        """The same as scipy.stats.kstest(buf, uniform(0, 255).cdf, mode='asymp') of each sector"""
+        cumulative = np.cumsum(counts, axis=1)
+        present = counts > 0
+        d_plus = np.where(present, cumulative / self.sector_size - self.dist, -np.inf).max(axis=1)
+        d_minus = np.where(present, self.dist - (cumulative - counts) / self.sector_size, -np.inf).max(axis=1)
+        p = np.clip(kstwobign.sf(np.maximum(d_plus, d_minus) * np.sqrt(self.sector_size)), 0, 1)
+
+        results = SectorResults.empty(len(counts))
+        results.randomness[:] = 1.0
+        results.flag[:] = ResultFlag.RANDOM
+        not_random = p < self.p_rand_lim
+        results.randomness[not_random] = 0.5
+        results.flag[not_random] = ResultFlag.NOT_RANDOM
+        too_random = p > self.p_sus_rand_lim
+        results.randomness[too_random] = 0.0
+        results.flag[too_random] = ResultFlag.RANDOMNESS_SUSPICIOUSLY_HIGH
+        return results
+
+
+class MultiAnalysis:
+    """Runs several analysis methods on the same sectors, building the byte histogram
+    shared by the histogram based methods only once per sector"""
+
+    def __init__(self, methods):
+        self.methods = methods
+        self.sector_size = methods[0].sector_size
+
+    def calc_batch(self, block):
+        """Returns a list of SectorResults, one for each of the methods"""
+        sectors = sectors_view(block, self.sector_size)
+        uniform = uniform_rows(sectors)
+        if not uniform.any():
+            return self._calc_sectors(sectors)
+
+        results = self.uniform_results(sectors[:, 0])
+        if uniform.all():
+            return results
+        for method_results, calculated in zip(results, self._calc_sectors(sectors[~uniform])):
+            for column, calculated_column in zip(method_results, calculated):
+                column[~uniform] = calculated_column
+        return results
+
+    def uniform_results(self, values):
+        """Returns a list of SectorResults of sectors consisting only of the given byte values"""
+        return [method.uniform_results(values) for method in self.methods]
+
+    def _calc_sectors(self, sectors):
+        counts = None
+        positions = None
+        results = []
+        for method in self.methods:
+            if isinstance(method, HistogramAnalysisMethodBase):
+                if counts is None:
+                    counts = byte_histograms(sectors)
+                if method.NEEDS_FIRST_POSITIONS and positions is None:
+                    positions = first_positions(sectors)
+                results.append(method.calc_histograms(counts, positions))
+            else:
+                results.append(method.calc_batch(sectors.ravel()))
+        return results
+
+
+class LevelsAnalysis:
+    """Runs the histogram based methods of each level on the sectors of 2**level times the sector size"""
+
+    def __init__(self, methods):
+        self.level_methods = methods
+        self.methods = methods[0]
+        self.sector_size = self.methods[0].sector_size
+
+    def calc_batch(self, block):
+        sectors = sectors_view(block, self.sector_size)
+        return self._calc_levels(byte_histograms(sectors),
+                                 first_positions(sectors) if self._needs_first_positions() else None)
+
+    def uniform_results(self, values):
+        counts = np.zeros((len(values), 256), dtype=np.int64)
+        counts[np.arange(len(values)), values] = self.sector_size
+        return self._calc_levels(counts, np.where(counts > 0, 0, self.sector_size))
+
+    def _needs_first_positions(self):
+        return any(method.NEEDS_FIRST_POSITIONS for methods in self.level_methods for method in methods)
+
+    def _calc_levels(self, counts, positions):
+        results = []
+        sector_size = self.sector_size
+        for level, methods in enumerate(self.level_methods):
+            if level > 0:
+                counts = counts[:len(counts) // 2 * 2].reshape(-1, 2, 256).sum(axis=1)
+                if positions is not None:
+                    positions = merge_first_positions(positions, sector_size)
+                sector_size *= 2
+            results.extend(method.calc_histograms(counts, positions) for method in methods)
+        return results
 
 
 analysis_methods = {
     'shannon': ShannonsEntropy,
     'chi2-8': ChiSquare8,
+    'chi2-7': ChiSquare7,
+    'chi2-6': ChiSquare6,
+    'chi2-5': ChiSquare5,
     'chi2-4': ChiSquare4,
     'chi2-3': ChiSquare3,
+    'chi2-2': ChiSquare2,
     'chi2-1': ChiSquare1,
     'kstest': KSTest
 }
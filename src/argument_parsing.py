@@ -1,8 +1,10 @@
 # SPDX-License-Identifier: MIT
 
 import argparse
+import os
+from sys import stdout
 from output_methods import output_methods
-from analysis import analysis_methods
+from analysis import analysis_methods, HistogramAnalysisMethodBase
 from re import sub, MULTILINE
 
 DEFAULT_SECTOR_SIZE = 512
@@ -11,6 +13,13 @@ DEFAULT_ANALYSIS_METHOD = 'chi2-4'
 DEFAULT_SIGNIFICANCE_LEVEL = 0.0002
 DEFAULT_RAND_LIMIT = 1 - DEFAULT_SIGNIFICANCE_LEVEL / 2
 DEFAULT_SUS_RAND_LIMIT = DEFAULT_SIGNIFICANCE_LEVEL / 2
+DEFAULT_CHECKPOINT_INTERVAL = 60
+DEFAULT_CACHE_SIZE = 1024  # MiB
+DEFAULT_SAMPLE_REGIONS = 100
+DEFAULT_BATCH_SIZE = 1024  # KiB
+DEFAULT_QUEUE_DEPTH = 4
+DEFAULT_CONFIDENCE = 0.95
+DEFAULT_BOUNDARY_STEP = 256  # sectors
 
 
 def sector_size_type(x):
@@ -31,11 +40,93 @@ def output_method_type(x):
 
 
 def analysis_method_type(x):
-    if x not in analysis_methods:
+    names = [name.strip() for name in x.split(',')]
+    for name in names:
+        if name not in analysis_methods:
+            raise argparse.ArgumentTypeError(
+                f'{name} is not a valid analysis method'
+            )
+        if names.count(name) > 1:
+            raise argparse.ArgumentTypeError(
+                f'{name} is listed more than once'
+            )
+    return names
+
+
+def jobs_type(x):
+    val = int(x)
+    if val < 1:
+        raise argparse.ArgumentTypeError(
+            f'{x} is not a valid number of jobs'
+        )
+    return val
+
+
+def batch_size_type(x):
+    val = int(x)
+    if val < 1:
+        raise argparse.ArgumentTypeError(
+            f'{x} is not a valid batch size'
+        )
+    return val << 10
+
+
+def interval_type(x):
+    val = float(x)
+    if val < 0:
+        raise argparse.ArgumentTypeError(
+            f'{x} is not a valid interval'
+        )
+    return val
+
+
+def positive_int_type(x):
+    val = int(x)
+    if val < 1:
+        raise argparse.ArgumentTypeError(
+            f'{x} is not a positive number'
+        )
+    return val
+
+
+def byte_count_type(x):
+    val = int(x)
+    if val < 0:
+        raise argparse.ArgumentTypeError(
+            f'{x} is not a valid number of bytes'
+        )
+    return val
+
+
+def partition_list_type(x):
+    try:
+        numbers = [int(number) for number in x.split(',')]
+    except ValueError:
+        numbers = [0]
+    for number in numbers:
+        if number < 1:
+            raise argparse.ArgumentTypeError(
+                f'{x} is not a valid list of partition numbers'
+            )
+    return numbers
+
+
+def confidence_type(x):
+    val = float(x)
+    if not (0 < val < 1):
+        raise argparse.ArgumentTypeError(
+            f'{x} is not a valid confidence level'
+        )
+    return val
+
+
+def cache_size_type(x):
+    val = int(x)
+    if val < 0:
         raise argparse.ArgumentTypeError(
-            f'{x} is not a valid analysis method'
+            f'{x} is not a valid cache size'
         )
-    return analysis_methods[x]
+    return val << 20
 
 
 def significance_type(x):
@@ -83,6 +174,114 @@ def check_and_set_sig_levels(args, parser):
         args.sus_rand_lim = DEFAULT_SUS_RAND_LIMIT
 
 
+def check_checkpoint_args(args, parser):
+    if args.checkpoint is None:
+        if args.resume:
+            parser.error('--resume needs the --checkpoint to resume from')
+        return
+    if args.resume and not os.path.exists(args.checkpoint):
+        parser.error(f'the checkpoint {args.checkpoint} does not exist')
+    if not args.resume and os.path.exists(args.checkpoint):
+        parser.error(f'the checkpoint {args.checkpoint} already exists, use --resume to continue the scan')
+
+
+def check_progressive_args(args, parser):
+    if not args.progressive:
+        return
+    if not args.output_method.PROGRESSIVE:
+        parser.error('the output method does not support --progressive')
+    if args.jobs > 1:
+        parser.error('--progressive cannot be used with multiple jobs')
+    if args.checkpoint is not None:
+        parser.error('--progressive cannot be used with --checkpoint')
+
+
+def check_stream_args(args, output_args, parser):
+    if getattr(output_args, 'stream', False) and args.progressive:
+        parser.error('--progressive cannot be used with --stream')
+
+
+def check_max_pixels_args(args, output_args, parser):
+    if getattr(output_args, 'max_pixels', ...) is not Ellipsis and args.progressive:
+        parser.error('--progressive cannot be used with --max-pixels')
+
+
+def check_sample_args(args, parser):
+    if args.sample is None:
+        return
+    for option, used in (('--progressive', args.progressive), ('--checkpoint', args.checkpoint is not None),
+                         ('--cache', args.cache is not None), ('multiple jobs', args.jobs > 1)):
+        if used:
+            parser.error(f'--sample cannot be used with {option}')
+
+
+def check_boundaries_args(args, parser):
+    if not args.boundaries:
+        return
+    for option, used in (('--progressive', args.progressive), ('--checkpoint', args.checkpoint is not None),
+                         ('--cache', args.cache is not None), ('multiple jobs', args.jobs > 1),
+                         ('--sample', args.sample is not None), ('--pipeline', args.pipeline),
+                         ('--each-partition', args.each_partition)):
+        if used:
+            parser.error(f'--boundaries cannot be used with {option}')
+    if not analysis_methods[args.analysis_methods[0]].CLASSIFIES_RANDOMNESS:
+        parser.error(f'--boundaries needs an analysis method classifying the sectors as random,'
+                     f' which {args.analysis_methods[0]} does not')
+
+
+def check_levels_args(args, parser):
+    if args.levels == 1:
+        return
+    for name in args.analysis_methods:
+        if not issubclass(analysis_methods[name], HistogramAnalysisMethodBase):
+            parser.error(f'--levels needs analysis methods based on byte histograms, which {name} is not')
+    if not args.output_method.LEVELS:
+        parser.error('the output method does not support --levels')
+    for option, used in (('--progressive', args.progressive), ('--checkpoint', args.checkpoint is not None),
+                         ('--cache', args.cache is not None), ('--sample', args.sample is not None),
+                         ('--boundaries', args.boundaries), ('--offset', args.offset is not None),
+                         ('--length', args.length is not None), ('--partition', args.partition is not None),
+                         ('--each-partition', args.each_partition)):
+        if used:
+            parser.error(f'--levels cannot be used with {option}')
+
+
+def check_range_args(args, parser):
+    if args.partition is not None:
+        for option, used in (('--offset', args.offset is not None), ('--length', args.length is not None)):
+            if used:
+                parser.error(f'--partition cannot be used with {option}')
+    if args.each_partition and (args.offset is not None or args.length is not None):
+        parser.error('--each-partition cannot be used with --offset or --length')
+    if args.partition is None and args.offset is None and args.length is None and not args.each_partition:
+        return
+    for option, used in (('--progressive', args.progressive), ('--sample', args.sample is not None),
+                         ('--checkpoint', args.checkpoint is not None)):
+        if used:
+            parser.error(f'the whole image needs to be scanned to use {option}')
+
+
+def check_each_partition_args(args, output_args, parser):
+    if not args.each_partition:
+        return
+    if 'output_file' not in args.output_method.default_parameters or output_args.output_file in (None, stdout):
+        parser.error('--each-partition needs an output file to name the output file of each partition after')
+
+
+def check_pipeline_args(args, parser):
+    if not args.pipeline:
+        return
+    if args.jobs > 1:
+        parser.error('--pipeline cannot be used with multiple jobs')
+    if args.progressive:
+        parser.error('--pipeline cannot be used with --progressive')
+
+
+def prints_report(args):
+    """Whether a text report is printed instead of using the output method"""
+    return args.sample is not None or args.boundaries or args.list_partitions
+
+
 def check_invalid_output_method_args(output_method, output_args, parser):
     err = output_method.check_args(**vars(output_args))
     if err is not None:
@@ -109,8 +308,19 @@ def get_methods_help():
 
 def parse_arguments():
     main_parser = argparse.ArgumentParser(
-        usage='%(prog)s [-h] [-s SIZE] [-m OUTPUT_METHOD] [-a ANALYSIS_METHOD] [-l SIG_LEVEL | [--rand-lim RAND_LIM'
-              ' --sus-rand-lim SUS_RAND_LIM]] [output method arguments] DISK_IMAGE',
+        usage='%(prog)s [-h] [-s SIZE]\n'
+              '                 [-j JOBS | --pipeline [--analysis-threads THREADS] [--read-queue BATCHES]'
+              ' [--output-queue BATCHES]]\n'
+              '                 [--levels LEVELS] [--batch-size KIB] [-m OUTPUT_METHOD]'
+              ' [-a ANALYSIS_METHOD[,ANALYSIS_METHOD...]]\n'
+              '                 [-l SIG_LEVEL | [--rand-lim RAND_LIM --sus-rand-lim SUS_RAND_LIM]]\n'
+              '                 [--checkpoint CHECKPOINT [--checkpoint-interval SECONDS] [--resume]]\n'
+              '                 [--offset BYTES] [--length BYTES] [--partition N[,N...]] [--each-partition]'
+              ' [--list-partitions]\n'
+              '                 [--raw] [--progressive]\n'
+              '                 [--sample N [--seed SEED] [--sample-regions REGIONS] [--confidence CONFIDENCE]]\n'
+              '                 [--boundaries [--boundary-step SECTORS]] [--cache CACHE [--cache-size MIB]]\n'
+              '                 [output method arguments] DISK_IMAGE',
         epilog=get_methods_help(),
         formatter_class=argparse.RawDescriptionHelpFormatter
     )
@@ -120,6 +330,54 @@ def parse_arguments():
         type=sector_size_type,
         default=DEFAULT_SECTOR_SIZE
     )
+    main_parser.add_argument(
+        '-j', '--jobs',
+        help='number of processes analyzing the image in parallel (default: 1)',
+        type=jobs_type,
+        default=1
+    )
+    main_parser.add_argument(
+        '--levels',
+        help='also calculate the results of the sectors of 2, 4, ... 2**(LEVELS - 1) times the sector size'
+             ' from the byte histograms of the sectors, storing all of them to the results file'
+             ' of the binary output method (default: 1)',
+        type=positive_int_type,
+        default=1
+    )
+    main_parser.add_argument(
+        '--batch-size',
+        help=f'number of KiB of sectors analyzed at once (default: {DEFAULT_BATCH_SIZE})',
+        type=batch_size_type,
+        default=DEFAULT_BATCH_SIZE << 10,
+        metavar='KIB'
+    )
+    main_parser.add_argument(
+        '--pipeline',
+        help='read, analyze and output the batches in separate threads connected by queues,'
+             ' and print the time each stage was busy and waited for the others',
+        action='store_true'
+    )
+    main_parser.add_argument(
+        '--analysis-threads',
+        help='number of threads analyzing the batches in the pipeline (default: 1)',
+        type=positive_int_type,
+        default=1,
+        metavar='THREADS'
+    )
+    main_parser.add_argument(
+        '--read-queue',
+        help=f'number of batches read ahead of the analysis in the pipeline (default: {DEFAULT_QUEUE_DEPTH})',
+        type=positive_int_type,
+        default=DEFAULT_QUEUE_DEPTH,
+        metavar='BATCHES'
+    )
+    main_parser.add_argument(
+        '--output-queue',
+        help=f'number of analyzed batches waiting for the output in the pipeline (default: {DEFAULT_QUEUE_DEPTH})',
+        type=positive_int_type,
+        default=DEFAULT_QUEUE_DEPTH,
+        metavar='BATCHES'
+    )
     main_parser.add_argument(
         '-m', '--method',
         help=f'set the output method (available: {", ".join(output_methods.keys())})'
@@ -130,11 +388,12 @@ def parse_arguments():
     )
     main_parser.add_argument(
         '-a', '--analysis',
-        help=f'set the analysis method (available: {", ".join(analysis_methods.keys())})'
+        help=f'set the analysis method, or a comma separated list of methods to run at once'
+             f' (available: {", ".join(analysis_methods.keys())})'
              f' (default: {DEFAULT_ANALYSIS_METHOD})',
         type=analysis_method_type,
         default=DEFAULT_ANALYSIS_METHOD,
-        dest='analysis_method'
+        dest='analysis_methods'
     )
     main_parser.add_argument(
         '-l', '--significance-level',
@@ -156,9 +415,131 @@ def parse_arguments():
         dest='sus_rand_lim'
     )
 
+    main_parser.add_argument(
+        '--checkpoint',
+        help='periodically store the progress and the results so far to this file,'
+             ' the file is removed once the scan finishes'
+    )
+    main_parser.add_argument(
+        '--checkpoint-interval',
+        help=f'seconds between checkpoints (default: {DEFAULT_CHECKPOINT_INTERVAL})',
+        type=interval_type,
+        default=DEFAULT_CHECKPOINT_INTERVAL,
+        metavar='SECONDS'
+    )
+    main_parser.add_argument(
+        '--resume',
+        help='continue the scan from the last checkpoint',
+        action='store_true'
+    )
+
+    main_parser.add_argument(
+        '--raw',
+        help='analyze the disk image file as it is, even if it looks like a qcow2 image'
+             ' or a gzip, xz or bzip2 compressed one',
+        action='store_true'
+    )
+    main_parser.add_argument(
+        '--progressive',
+        help='analyze every 4096th sector first, then every 1024th and so on down to every sector,'
+             ' writing the image of each level to the output file (only supported by the image output methods)',
+        action='store_true'
+    )
+    main_parser.add_argument(
+        '--sample',
+        help='instead of the output method, analyze a stratified random sample of this many sectors and print'
+             ' the estimated proportion of each result flag with confidence intervals',
+        type=positive_int_type,
+        metavar='N'
+    )
+    main_parser.add_argument(
+        '--seed',
+        help='seed of the sample, printed in the report (default: random)',
+        type=int
+    )
+    main_parser.add_argument(
+        '--sample-regions',
+        help=f'number of equally sized regions of the image to also report the proportions of'
+             f' (default: {DEFAULT_SAMPLE_REGIONS})',
+        type=positive_int_type,
+        default=DEFAULT_SAMPLE_REGIONS,
+        metavar='REGIONS'
+    )
+    main_parser.add_argument(
+        '--confidence',
+        help=f'confidence level of the intervals of the sample report (default: {DEFAULT_CONFIDENCE})',
+        type=confidence_type,
+        default=DEFAULT_CONFIDENCE
+    )
+    main_parser.add_argument(
+        '--boundaries',
+        help='instead of the output method, print the byte offsets at which the data looking random'
+             ' (according to the first analysis method) starts and ends, with their confidence',
+        action='store_true'
+    )
+    main_parser.add_argument(
+        '--boundary-step',
+        help=f'number of sectors between the sectors classified first by --boundaries, shorter regions may be'
+             f' missed (default: {DEFAULT_BOUNDARY_STEP})',
+        type=positive_int_type,
+        default=DEFAULT_BOUNDARY_STEP,
+        metavar='SECTORS'
+    )
+    main_parser.add_argument(
+        '--cache',
+        help='reuse the results of regions whose content did not change since an earlier scan'
+             ' with the same parameters, storing the results in this file'
+    )
+    main_parser.add_argument(
+        '--cache-size',
+        help=f'size limit of the results stored in the cache in MiB,'
+             f' the least recently used results are evicted (default: {DEFAULT_CACHE_SIZE})',
+        type=cache_size_type,
+        default=DEFAULT_CACHE_SIZE << 20,
+        metavar='MIB'
+    )
+
+    main_parser.add_argument(
+        '--offset',
+        help='analyze only the whole sectors starting at this byte offset of the image'
+             ' (the sector numbers are still those of the whole image)',
+        type=byte_count_type,
+        metavar='BYTES'
+    )
+    main_parser.add_argument(
+        '--length',
+        help='analyze only the whole sectors within this many bytes (from --offset)',
+        type=byte_count_type,
+        metavar='BYTES'
+    )
+    main_parser.add_argument(
+        '--partition',
+        help='analyze only these partitions of the MBR or GPT partition table of the image',
+        type=partition_list_type,
+        metavar='N[,N...]'
+    )
+    main_parser.add_argument(
+        '--each-partition',
+        help='analyze each partition (or each one selected by --partition) separately, writing the results'
+             ' of partition N to the output file with -pN appended to its name',
+        action='store_true'
+    )
+    main_parser.add_argument(
+        '--list-partitions',
+        help='print the partitions of the MBR or GPT partition table of the image and exit',
+        action='store_true'
+    )
+
     main_args, rest = main_parser.parse_known_args()
 
     check_and_set_sig_levels(main_args, main_parser)
+    check_checkpoint_args(main_args, main_parser)
+    check_progressive_args(main_args, main_parser)
+    check_sample_args(main_args, main_parser)
+    check_pipeline_args(main_args, main_parser)
+    check_range_args(main_args, main_parser)
+    check_boundaries_args(main_args, main_parser)
+    check_levels_args(main_args, main_parser)
 
     second_parser = argparse.ArgumentParser()
 
@@ -172,12 +553,21 @@ def parse_arguments():
         help='disk image to analyze',
     )
 
-    add_output_method_arguments(second_parser, main_args.output_method)
+    if not prints_report(main_args):
+        add_output_method_arguments(second_parser, main_args.output_method)
 
     output_args = second_parser.parse_args(rest)
     main_args.disk_image = output_args.disk_image
     delattr(output_args, 'disk_image')
+    if prints_report(main_args):
+        return main_args, output_args
 
     check_invalid_output_method_args(main_args.output_method, output_args, second_parser)
+    check_each_partition_args(main_args, output_args, second_parser)
+    check_stream_args(main_args, output_args, second_parser)
+    check_max_pixels_args(main_args, output_args, second_parser)
+
+    if main_args.jobs > 1 and main_args.disk_image.name == '<stdin>':
+        second_parser.error('the disk image needs to be a file to be analyzed by multiple jobs')
 
     return main_args, output_args
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: MIT
+
+import argparse
+from os import urandom
+from time import perf_counter
+from histograms import np, sectors_view, bit_group_histograms
+from analysis import KSTest, ResultFlag, MultiAnalysis, analysis_methods
+from hilbert import d2xy, coordinate_table, block_table
+
+
+def _reference_bit_groups(buf, n):
+    """The per-bit loop the chi2-3 analysis used before the bit group engine"""
+    vals = [0] * (2 ** n)
+    rem = 0
+    bits = 0
+    for byte in buf:
+        for offset in range(8):
+            rem = (rem << 1) | ((byte >> (7 - offset)) & 1)
+            bits += 1
+            if bits == n:
+                vals[rem] += 1
+                bits = 0
+                rem = 0
+    return vals
+
+
+def _throughput(size, seconds):
+    return f'{size / seconds / 2 ** 20:10.2f} MiB/s'
+
+
+def bench_bit_groups(args):
+    reference_data = urandom(args.size * args.reference_sectors)
+    data = urandom(args.size * args.sectors)
+    print(f'{"n":>2} {"per-bit loop":>16} {"bit group engine":>16} {"speedup":>9}')
+    for n in range(1, 9):
+        start = perf_counter()
+        expected = [_reference_bit_groups(reference_data[i:i + args.size], n)
+                    for i in range(0, len(reference_data), args.size)]
+        reference_time = perf_counter() - start
+
+        counts = bit_group_histograms(sectors_view(reference_data, args.size), n)
+        if not np.array_equal(counts, expected):
+            raise AssertionError(f'bit group counts for n={n} do not match the per-bit loop')
+
+        start = perf_counter()
+        bit_group_histograms(sectors_view(data, args.size), n)
+        engine_time = perf_counter() - start
+
+        print(f'{n:>2} {_throughput(len(reference_data), reference_time):>16}'
+              f' {_throughput(len(data), engine_time):>16}'
+              f' {(len(data) / engine_time) / (len(reference_data) / reference_time):8.1f}x')
+
+
+def _reference_kstest(buf, p_rand_lim, p_sus_rand_lim):
+    """The per-sector scipy call the kstest analysis used before the histogram based test"""
+    from scipy.stats import kstest, uniform
+    _, p = kstest(bytearray(buf), uniform(0, 255).cdf, mode='asymp')
+    if p > p_sus_rand_lim:
+        return ResultFlag.RANDOMNESS_SUSPICIOUSLY_HIGH
+    if p < p_rand_lim:
+        return ResultFlag.NOT_RANDOM
+    return ResultFlag.RANDOM
+
+
+def _mixed_corpus(size, sectors):
+    """Random sectors, sectors of random bytes from a smaller range of values
+    and sectors of printable text, in equal parts"""
+    rng = np.random.default_rng(0)
+    kinds = rng.integers(0, 3, sectors)
+    data = rng.integers(0, 256, (sectors, size), dtype=np.uint8)
+    narrow = kinds == 1
+    data[narrow] = rng.integers(0, rng.integers(192, 256), (narrow.sum(), size), dtype=np.uint8)
+    text = kinds == 2
+    data[text] = rng.integers(32, 127, (text.sum(), size), dtype=np.uint8)
+    return data.tobytes()
+
+
+def bench_kstest(args):
+    method = KSTest(args.size)
+    reference_data = _mixed_corpus(args.size, args.reference_sectors)
+    data = _mixed_corpus(args.size, args.sectors)
+
+    start = perf_counter()
+    expected = [_reference_kstest(reference_data[i:i + args.size], method.p_rand_lim, method.p_sus_rand_lim)
+                for i in range(0, len(reference_data), args.size)]
+    reference_time = perf_counter() - start
+
+    if not np.array_equal(method.calc_batch(reference_data).flag, expected):
+        raise AssertionError('the histogram based kstest does not classify the sectors the same way')
+
+    start = perf_counter()
+    method.calc_batch(data)
+    batch_time = perf_counter() - start
+
+    print(f'{"scipy kstest":>16} {"histogram kstest":>16} {"speedup":>9}')
+    print(f'{_throughput(len(reference_data), reference_time):>16}'
+          f' {_throughput(len(data), batch_time):>16}'
+          f' {(len(data) / batch_time) / (len(reference_data) / reference_time):8.1f}x')
+
+
+def _mostly_zero_image(size, sectors, zero_fraction=0.95):
+    """Runs of zeroed sectors interleaved with runs of random ones"""
+    rng = np.random.default_rng(0)
+    data = np.zeros((sectors, size), dtype=np.uint8)
+    position = 0
+    while position < sectors:
+        run = int(rng.integers(1, 512))
+        if rng.random() >= zero_fraction:
+            data[position:position + run] = rng.integers(0, 256, (len(data[position:position + run]), size))
+        position += run
+    return data.tobytes()
+
+
+def bench_uniform(args):
+    total_sectors = args.sectors * 16
+    data = _mostly_zero_image(args.size, total_sectors)
+    batch = args.size * args.sectors
+    print(f'{"method":>8} {"histogram all":>16} {"uniform check":>16} {"speedup":>9}')
+    for name in ('shannon', 'chi2-8', 'chi2-4', 'chi2-1', 'kstest'):
+        method = analysis_methods[name](args.size)
+        multi = MultiAnalysis([method])
+        for block in range(0, len(data), batch):
+            if not np.array_equal(method.calc_batch(data[block:block + batch]).flag,
+                                  multi.calc_batch(data[block:block + batch])[0].flag):
+                raise AssertionError(f'the uniform sector check changes the results of {name}')
+
+        start = perf_counter()
+        for block in range(0, len(data), batch):
+            method.calc_batch(data[block:block + batch])
+        histogram_time = perf_counter() - start
+
+        start = perf_counter()
+        for block in range(0, len(data), batch):
+            multi.calc_batch(data[block:block + batch])
+        uniform_time = perf_counter() - start
+
+        print(f'{name:>8} {_throughput(len(data), histogram_time):>16} {_throughput(len(data), uniform_time):>16}'
+              f' {histogram_time / uniform_time:8.1f}x')
+
+
+def _reference_d2xy(n, d):
+    """HilbertCurve._d2xy() of the hilbert-curve output before the coordinate tables, mapping a single distance"""
+    x = y = 0
+    s = 1
+    while s < n:
+        ry = 1 & (d >> 1)
+        rx = 1 & (d ^ ry)
+
+        # rotate accordingly
+        if rx == 0 and ry == 1:
+            x, y = s - 1 - y, s - 1 - x
+        elif rx == 0:
+            x, y = y, x
+
+        x += s * rx
+        y += s * ry
+        d >>= 2
+        s <<= 1
+    return x, y
+
+
+def bench_hilbert(args):
+    rng = np.random.default_rng(0)
+    reference_distances = rng.integers(0, 4 ** 16, args.reference_sectors * 512)
+    distances = rng.integers(0, 4 ** 16, args.sectors * 512)
+    print(f'{"order":>5} {"scalar _d2xy":>16} {"coordinate table":>16} {"speedup":>9}')
+    for order in range(4, 17, 2):
+        reference_d = (reference_distances % 4 ** order).tolist()
+        start = perf_counter()
+        expected = np.array([_reference_d2xy(1 << order, distance) for distance in reference_d]).T
+        reference_time = perf_counter() - start
+
+        coordinate_table.cache_clear()
+        block_table.cache_clear()
+        start = perf_counter()
+        coordinates = d2xy(order, reference_d)
+        cold_time = perf_counter() - start
+        if not (np.array_equal(coordinates[0], expected[0]) and np.array_equal(coordinates[1], expected[1])):
+            raise AssertionError(f'the coordinate tables of order {order} do not match the scalar _d2xy')
+
+        d = distances % 4 ** order
+        start = perf_counter()
+        d2xy(order, d)
+        table_time = perf_counter() - start
+
+        reference_rate, table_rate = len(reference_d) / reference_time, len(d) / table_time
+        print(f'{order:>5} {reference_rate / 1e6:>9.2f} Mpx/s {table_rate / 1e6:>9.2f} Mpx/s'
+              f' {table_rate / reference_rate:8.1f}x (building the table {cold_time:.3f} s)')
+
+
+benchmarks = {
+    'bit-groups': bench_bit_groups,
+    'kstest': bench_kstest,
+    'uniform': bench_uniform,
+    'hilbert': bench_hilbert
+}
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Measures the throughput of the analysis building blocks')
+    parser.add_argument(
+        'benchmark',
+        help=f'benchmark to run (available: {", ".join(benchmarks.keys())})',
+        choices=benchmarks.keys(),
+        metavar='BENCHMARK'
+    )
+    parser.add_argument(
+        '-s', '--size',
+        help='sector size (default: 512)',
+        type=int,
+        default=512
+    )
+    parser.add_argument(
+        '--sectors',
+        help='number of sectors to analyze at once (default: 2048)',
+        type=int,
+        default=2048
+    )
+    parser.add_argument(
+        '--reference-sectors',
+        help='number of sectors to analyze with the slow reference implementations (default: 64)',
+        type=int,
+        default=64
+    )
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    arguments = parse_arguments()
+    benchmarks[arguments.benchmark](arguments)
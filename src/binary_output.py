@@ -0,0 +1,92 @@
+# SPDX-License-Identifier: MIT
+
+from argparse import FileType
+from sys import stderr
+from output_common import OutputMethodBase, Parameter, print_check_closed_pipe
+from analysis import SectorResults
+from results_file import ResultsWriter
+from histograms import np
+
+
+# binary
+class BinaryOutput(OutputMethodBase):
+    default_parameters = {
+        'output_file': Parameter(FileType('wb'), None, 'output file (needs to be seekable)'),
+        'err_file': Parameter(FileType('w'), stderr, 'error output file', 'stderr')
+    }
+    ORDERED = False
+    NEEDS_SIZE = True
+    LEVELS = True
+    BUFFERED_SECTORS = 1 << 16  # sectors passed to output() one by one written at once
+
+    def __init__(self, input_size, **kwargs):
+        super().__init__(input_size, **kwargs)
+        self._writer = ResultsWriter(
+            self.output_file,
+            input_size,
+            self._scan_info.sector_size,
+            self._scan_info.analysis_names,
+            self._scan_info.rand_lim,
+            self._scan_info.sus_rand_lim,
+            levels=self._scan_info.levels
+        )
+        self._buffer_start = None
+        self._buffer = []
+        self._complete_sectors = 0  # the sectors up to which all results were written
+        self._done = {}  # first sector -> end sector of the batches written after the complete ones
+        self._succeeded = True
+
+    def output(self, sector_number, sector_offset, *results):
+        if self._buffer and sector_number != self._buffer_start + len(self._buffer):
+            self._flush()
+        if not self._buffer:
+            self._buffer_start = sector_number
+        self._buffer.append(results)
+        if len(self._buffer) >= self.BUFFERED_SECTORS:
+            self._flush()
+        return True
+
+    def _flush(self):
+        columns = list(zip(*self._buffer))
+        self._write(self._buffer_start, *(
+            SectorResults(
+                np.array(columns[i], dtype=np.float64),
+                np.array(columns[i + 1], dtype=np.uint8),
+                np.array([0 if p is None else p for p in columns[i + 2]], dtype=np.uint8)
+            )
+            for i in range(0, len(columns), 3)
+        ))
+        self._buffer = []
+
+    def output_batch(self, first_sector, sector_size, *results):
+        if self._buffer:
+            self._flush()
+        self._write(first_sector, *results)
+        return True
+
+    def _write(self, first_sector, *results):
+        self._writer.write(first_sector, *results)
+        self._done[first_sector] = first_sector + len(results[0].flag)
+        while self._complete_sectors in self._done:
+            self._complete_sectors = self._done.pop(self._complete_sectors)
+
+    @staticmethod
+    def check_args(**kwargs):
+        if 'output_file' in kwargs and not kwargs['output_file'].seekable():
+            return 'the output file of the binary output method needs to be seekable'
+        return None
+
+    def error(self, message):
+        return print_check_closed_pipe(message, file=self.err_file)
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        # the results of an interrupted scan are only complete up to the first sector not written
+        self._succeeded = exc_type is None
+        super().__exit__(exc_type, exc_value, exc_traceback)
+
+    def exit(self):
+        if self._buffer:
+            self._flush()
+        self._writer.set_complete_sectors(self._input_size if self._succeeded else self._complete_sectors)
+        self._writer.close()
+        self.err_file.close()
@@ -0,0 +1,94 @@
+# SPDX-License-Identifier: MIT
+
+from math import log
+from sys import stderr
+from histograms import np
+from analysis import ResultFlag
+
+try:
+    from scipy.special import gammaln, logsumexp
+except ImportError:
+    print('the scipy library is not installed. \n'
+          'Use `pip install scipy` to install it', file=stderr)
+    exit(1)
+
+_PRIOR = 0.5  # Dirichlet prior of the byte distribution of the data which does not look random
+_RANDOM_FLAGS = (ResultFlag.RANDOM, ResultFlag.RANDOMNESS_SUSPICIOUSLY_HIGH)
+
+
+def is_random(flags):
+    return np.isin(flags, _RANDOM_FLAGS)
+
+
+def probe_sectors(ranges, step):
+    """Returns the numbers of every step-th sector and of the last sector of each (first_sector, end_sector) range,
+    and the index of the range of each of them"""
+    probes, range_indexes = [], []
+    for index, (first_sector, end_sector) in enumerate(ranges):
+        if first_sector >= end_sector:
+            continue
+        numbers = np.arange(first_sector, end_sector, step, dtype=np.int64)
+        if numbers[-1] != end_sector - 1:
+            numbers = np.append(numbers, end_sector - 1)
+        probes.append(numbers)
+        range_indexes.append(np.full(len(numbers), index))
+    if not probes:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(probes), np.concatenate(range_indexes)
+
+
+def find_transitions(classify, ranges, step):
+    """Returns the (last_sector, random_after) pairs of the sectors after which the class of the sectors changes,
+    random_after telling whether the following sectors are the random ones. classify returns a mask of the random
+    sectors of an array of sector numbers. Every step-th sector is classified first, then the sectors
+    between each two classified ones of different classes are bisected, all of them at once.
+    A region shorter than step sectors may be missed, and of several transitions between two classified
+    sectors only one is found."""
+    probes, range_indexes = probe_sectors(ranges, step)
+    random = classify(probes)
+    changes = np.flatnonzero((random[1:] != random[:-1]) & (range_indexes[1:] == range_indexes[:-1]))
+    low, high = probes[changes], probes[changes + 1]  # the sectors of the first and of the second class
+    random_after = random[changes + 1]
+    while True:
+        open_intervals = np.flatnonzero(high - low > 1)
+        if len(open_intervals) == 0:
+            return list(zip(low.tolist(), random_after.tolist()))
+        middle = (low[open_intervals] + high[open_intervals]) // 2
+        after = classify(middle) == random_after[open_intervals]
+        high[open_intervals[after]] = middle[after]
+        low[open_intervals[~after]] = middle[~after]
+
+
+def refine_boundary(data, search_start, search_end, random_after):
+    """Returns the byte offset within data at which the random bytes start (or end if random_after is False)
+    and the posterior probability of that offset, searching the offsets from search_start to search_end.
+
+    The random bytes are modelled as uniformly distributed and the other ones by a Dirichlet-multinomial
+    distribution, so the likelihood of every offset is found from cumulative byte histograms
+    of the window at once, instead of by analyzing the bytes on both sides of every offset."""
+    values = np.frombuffer(data, dtype=np.uint8)
+    if not random_after:  # so that the bytes not looking random are always the leading ones
+        values = values[::-1]
+        search_start, search_end = len(values) - search_end, len(values) - search_start
+    offsets = np.arange(search_start, search_end + 1)
+
+    one_hot = np.zeros((len(values) + 1, 256), dtype=np.int32)
+    one_hot[np.arange(1, len(values) + 1), values] = 1
+    counts = np.cumsum(one_hot, axis=0)[offsets]  # the byte histogram of the leading bytes at every offset
+    leading = (gammaln(256 * _PRIOR) - gammaln(256 * _PRIOR + offsets)
+               + (gammaln(counts + _PRIOR) - gammaln(_PRIOR)).sum(axis=1))
+    log_likelihood = leading - (len(values) - offsets) * log(256)
+    posterior = np.exp(log_likelihood - logsumexp(log_likelihood))
+
+    best = int(posterior.argmax())
+    offset = int(offsets[best])
+    return (offset if random_after else len(values) - offset), float(posterior[best])
+
+
+def boundary_report(boundaries, method_name, sector_count, step, sectors_read):
+    """Yields the lines of the list of (byte_offset, random_after, confidence) boundaries"""
+    yield (f'# {len(boundaries)} boundaries found by {method_name} classifying every {step}th of'
+           f' {sector_count} sectors, {sectors_read} sectors read')
+    yield f'{"BYTE_OFFSET":>16} {"BOUNDARY":<12} {"CONFIDENCE":>10}'
+    for byte_offset, random_after, confidence in boundaries:
+        yield f'{byte_offset:>16} {"random start" if random_after else "random end":<12} {confidence:>10.4f}'
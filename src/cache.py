@@ -0,0 +1,163 @@
+# SPDX-License-Identifier: MIT
+
+import sqlite3
+from hashlib import sha256
+from threading import Lock
+from time import time
+from histograms import np
+from analysis import SectorResults
+
+CACHE_FORMAT_VERSION = 1
+DEFAULT_CACHE_SIZE = 1 << 30  # bytes of stored results
+_RESULT_BYTES = 8 + 1 + 1  # float64 randomness, flag and pattern of a sector
+
+
+def cache_key(scan_info):
+    """Identifies the results of a scan with the given parameters,
+    results stored under a different key are never reused"""
+    return (f'{CACHE_FORMAT_VERSION}:{scan_info.sector_size}:{",".join(scan_info.analysis_names)}'
+            f':{scan_info.rand_lim!r}:{scan_info.sus_rand_lim!r}')
+
+
+class ResultsCache:
+    """Stores the per-sector results of analyzed regions in an sqlite database,
+    addressed by the scan parameters and a fingerprint of the content of the region.
+    Once the stored results exceed the size limit, the least recently used ones are evicted.
+    The analysis threads of a pipelined scan share the connection, a lock serializes the access to it."""
+
+    def __init__(self, path, key, size_limit=DEFAULT_CACHE_SIZE):
+        self.path = path
+        self.key = key
+        self.size_limit = size_limit
+        self._db = None
+        self._lock = Lock()
+        self._stored_size = 0  # bytes of results in the cache, as of the last eviction plus those put since
+
+    def __getstate__(self):
+        # every process of a parallel scan opens its own connection
+        state = self.__dict__.copy()
+        state['_db'] = None
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = Lock()
+
+    def _connection(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, timeout=60, isolation_level=None, check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS results ('
+                ' key TEXT NOT NULL,'
+                ' fingerprint BLOB NOT NULL,'
+                ' results BLOB NOT NULL,'
+                ' last_used REAL NOT NULL,'
+                ' PRIMARY KEY (key, fingerprint))'
+            )
+            self._stored_size = self._total_size()
+        return self._db
+
+    def _total_size(self):
+        return self._db.execute('SELECT COALESCE(SUM(length(results)), 0) FROM results').fetchone()[0]
+
+    @staticmethod
+    def fingerprint(block):
+        return sha256(block).digest()
+
+    def get(self, fingerprint, method_count):
+        """Returns the stored list of SectorResults of the region, or None"""
+        with self._lock:
+            db = self._connection()
+            row = db.execute('SELECT results FROM results WHERE key = ? AND fingerprint = ?',
+                             (self.key, fingerprint)).fetchone()
+            if row is None:
+                return None
+            db.execute('UPDATE results SET last_used = ? WHERE key = ? AND fingerprint = ?',
+                       (time(), self.key, fingerprint))
+        return self._decode(row[0], method_count)
+
+    def put(self, fingerprint, results):
+        blob = self._encode(results)
+        with self._lock:
+            self._connection().execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)',
+                                       (self.key, fingerprint, blob, time()))
+            self._stored_size += len(blob)
+            if self._stored_size > self.size_limit:
+                # evict down to 7/8 of the limit, so that the following regions do not evict again right away
+                self._evict(self.size_limit - self.size_limit // 8)
+
+    @staticmethod
+    def _encode(results):
+        return b''.join(
+            column.tobytes()
+            for method_results in results
+            for column in (method_results.randomness.astype(np.float64, copy=False),
+                           method_results.flag, method_results.pattern)
+        )
+
+    @staticmethod
+    def _decode(blob, method_count):
+        count = len(blob) // (method_count * _RESULT_BYTES)
+        results = []
+        offset = 0
+        for _ in range(method_count):
+            randomness = np.frombuffer(blob, dtype=np.float64, count=count, offset=offset).copy()
+            offset += count * 8
+            flag = np.frombuffer(blob, dtype=np.uint8, count=count, offset=offset).copy()
+            offset += count
+            pattern = np.frombuffer(blob, dtype=np.uint8, count=count, offset=offset).copy()
+            offset += count
+            results.append(SectorResults(randomness, flag, pattern))
+        return results
+
+    def evict(self, size=None):
+        """Removes the least recently used results (of any key) exceeding the size, the size limit by default"""
+        with self._lock:
+            self._evict(self.size_limit if size is None else size)
+
+    def _evict(self, size):
+        self._connection().execute(
+            'DELETE FROM results WHERE rowid IN ('
+            ' SELECT rowid FROM ('
+            '  SELECT rowid, SUM(length(results)) OVER (ORDER BY last_used DESC, rowid DESC) AS total'
+            '  FROM results)'
+            ' WHERE total > ?)',
+            (size,)
+        )
+        self._stored_size = self._total_size()
+
+    def close(self):
+        with self._lock:
+            self._evict(self.size_limit)
+            self._db.close()
+            self._db = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class CachedAnalysis:
+    """Serves the results of regions analyzed by an earlier scan with the same parameters
+    from the cache, analyzing only the regions whose content changed since"""
+
+    def __init__(self, analysis_method, cache):
+        self.analysis_method = analysis_method
+        self.sector_size = analysis_method.sector_size
+        self.cache = cache
+
+    def calc_batch(self, block):
+        fingerprint = self.cache.fingerprint(block)
+        results = self.cache.get(fingerprint, len(self.analysis_method.methods))
+        if results is None:
+            results = self.analysis_method.calc_batch(block)
+            self.cache.put(fingerprint, results)
+        return results
+
+    def uniform_results(self, values):
+        return self.analysis_method.uniform_results(values)
@@ -0,0 +1,91 @@
+# SPDX-License-Identifier: MIT
+
+import os
+from time import monotonic
+from results_file import ResultsWriter, ResultsFile
+
+REPLAY_BATCH_SECTORS = 1 << 16  # number of checkpointed sectors passed to the output at once
+
+
+class CheckpointedOutput:
+    """Passes the results through to the output and also stores them in a checkpoint file
+    (in the binary results format with float64 randomness), recording every interval seconds
+    up to which sector the results are complete. The checkpoint is removed once the scan finishes."""
+
+    def __init__(self, output, path, sector_count, scan_info, interval):
+        self._output = output
+        self._path = path
+        self._scan_info = scan_info
+        self._sector_count = sector_count
+        self._interval = interval
+        self._writer = None
+        self.complete_sectors = 0
+        self._done = {}  # first sector -> end sector of batches after the complete ones
+        self._last_checkpoint = monotonic()
+
+    @property
+    def ORDERED(self):
+        return self._output.ORDERED
+
+    def start(self):
+        self._writer = self._open_writer('wb')
+
+    def resume(self):
+        """Passes the checkpointed results to the output and returns
+        the number of sectors the scan can skip. Returns None if the pipe was closed"""
+        with open(self._path, 'rb') as f:
+            checkpoint = ResultsFile(f)
+        if (checkpoint.sector_count, checkpoint.sector_size, checkpoint.analysis_names,
+                checkpoint.rand_lim, checkpoint.sus_rand_lim) != \
+                (self._sector_count, self._scan_info.sector_size, self._scan_info.analysis_names,
+                 self._scan_info.rand_lim, self._scan_info.sus_rand_lim):
+            raise ValueError(f'the checkpoint {self._path} was created by a different scan')
+
+        for first_sector in range(0, checkpoint.complete_sectors, REPLAY_BATCH_SECTORS):
+            end_sector = min(first_sector + REPLAY_BATCH_SECTORS, checkpoint.complete_sectors)
+            results = [checkpoint.results(i, first_sector, end_sector) for i in range(len(checkpoint.analysis_names))]
+            if not self._output.output_batch(first_sector, self._scan_info.sector_size, *results):
+                return None
+
+        self.complete_sectors = checkpoint.complete_sectors
+        self._writer = self._open_writer('r+b')
+        return self.complete_sectors
+
+    def _open_writer(self, mode):
+        return ResultsWriter(
+            open(self._path, mode),
+            self._sector_count,
+            self._scan_info.sector_size,
+            self._scan_info.analysis_names,
+            self._scan_info.rand_lim,
+            self._scan_info.sus_rand_lim,
+            randomness_size=8,
+            complete_sectors=self.complete_sectors
+        )
+
+    def output_batch(self, first_sector, sector_size, *results):
+        self._writer.write(first_sector, *results)
+        self._done[first_sector] = first_sector + len(results[0].flag)
+        while self.complete_sectors in self._done:
+            self.complete_sectors = self._done.pop(self.complete_sectors)
+        if monotonic() - self._last_checkpoint >= self._interval:
+            self.checkpoint()
+        return self._output.output_batch(first_sector, sector_size, *results)
+
+    def checkpoint(self):
+        self._writer.set_complete_sectors(self.complete_sectors)
+        self._writer.flush()
+        self._last_checkpoint = monotonic()
+
+    def error(self, message):
+        return self._output.error(message)
+
+    def finish(self):
+        """Removes the checkpoint after a finished scan"""
+        self._writer.close()
+        os.remove(self._path)
+
+    def close(self):
+        """Records the progress of an interrupted scan"""
+        self.checkpoint()
+        self._writer.close()
@@ -0,0 +1,86 @@
+# SPDX-License-Identifier: MIT
+
+import bz2
+import gzip
+import lzma
+import os
+import re
+
+# the magic numbers are followed by the compression method of gzip and by the block size
+# and the magic number of the first block (or of the end of the stream) of bzip2
+_FORMATS = [
+    (re.compile(rb'\x1f\x8b\x08', re.DOTALL), gzip.open),
+    (re.compile(rb'\xfd7zXZ\x00', re.DOTALL), lzma.open),
+    (re.compile(rb'BZh[1-9](\x31\x41\x59\x26\x53\x59|\x17\x72\x45\x38\x50\x90)', re.DOTALL), bz2.open)
+]
+_XZ_HEADER_MAGIC = b'\xfd7zXZ\x00'
+_XZ_FOOTER_MAGIC = b'YZ'
+
+
+def decompressor(f):
+    """Returns the function opening a file object decompressing the file, or None if it is not compressed.
+    Only peeks at the first bytes of the file, so that pipes can be read as well."""
+    start = f.peek(10)[:10] if hasattr(f, 'peek') else b''
+    for magic, open_decompressed in _FORMATS:
+        if magic.match(start):
+            return open_decompressed
+    return None
+
+
+def _read_multibyte_integer(data, position):
+    value = 0
+    for i in range(9):
+        byte = data[position + i]
+        value |= (byte & 0x7f) << (7 * i)
+        if not byte & 0x80:
+            return value, position + i + 1
+    raise ValueError('invalid xz multibyte integer')
+
+
+def _xz_stream_size(f, end):
+    """Returns the size of the xz stream ending at end and the uncompressed size of its blocks"""
+    f.seek(end - 12)
+    footer = f.read(12)
+    if len(footer) != 12 or footer[10:] != _XZ_FOOTER_MAGIC:
+        raise ValueError('invalid xz stream footer')
+    index_size = (int.from_bytes(footer[4:8], 'little') + 1) * 4
+    f.seek(end - 12 - index_size)
+    index = f.read(index_size)
+    if len(index) != index_size or index[0] != 0:
+        raise ValueError('invalid xz index')
+
+    records, position = _read_multibyte_integer(index, 1)
+    blocks_size = uncompressed_size = 0
+    for _ in range(records):
+        unpadded_size, position = _read_multibyte_integer(index, position)
+        size, position = _read_multibyte_integer(index, position)
+        blocks_size += -(-unpadded_size // 4) * 4
+        uncompressed_size += size
+    return 12 + blocks_size + index_size + 12, uncompressed_size
+
+
+def xz_uncompressed_size(f):
+    """Returns the uncompressed size of the (possibly concatenated) xz streams of a seekable file
+    from their indexes, which are stored at the end of each stream, or None if it cannot be read"""
+    if not f.seekable():
+        return None
+    position = f.tell()
+    try:
+        end = f.seek(0, os.SEEK_END)
+        total = 0
+        while end > 0:
+            f.seek(end - 4)
+            if f.read(4) == b'\0\0\0\0':  # stream padding
+                end -= 4
+                continue
+            stream_size, uncompressed_size = _xz_stream_size(f, end)
+            end -= stream_size
+            f.seek(end)
+            if end < 0 or f.read(6) != _XZ_HEADER_MAGIC:
+                raise ValueError('invalid xz stream header')
+            total += uncompressed_size
+        return total
+    except (ValueError, IndexError, OSError):
+        return None
+    finally:
+        f.seek(position)
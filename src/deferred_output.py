@@ -0,0 +1,71 @@
+# SPDX-License-Identifier: MIT
+
+from math import ceil
+from sys import stderr
+from tempfile import TemporaryFile
+from histograms import np
+from analysis import SectorResults
+from output_common import print_check_closed_pipe
+
+
+class DeferredOutput:
+    """Stands in for an output method which needs the size of the image, while the size is not known yet.
+    The results are spooled to a temporary file, and once the image was read to its end,
+    the output method is created with the size of the image and the results are passed to it in sector order."""
+    ORDERED = False
+
+    def __init__(self, output_method, image, scan_info, **output_args):
+        self._output_method = output_method
+        self._image = image
+        self._scan_info = scan_info
+        self._output_args = output_args
+        self._spool = TemporaryFile()
+        self._batches = []  # (first_sector, offset) of the batches in the spool
+        self._end_sector = 0
+
+    def output_batch(self, first_sector, sector_size, *results):
+        count = len(results[0].flag)
+        self._batches.append((first_sector, self._spool.tell()))
+        self._spool.write(np.array([first_sector, count], dtype=np.int64).tobytes())
+        for method_results in results:
+            self._spool.write(method_results.randomness.astype(np.float64, copy=False).tobytes())
+            self._spool.write(method_results.flag.tobytes())
+            self._spool.write(method_results.pattern.tobytes())
+        self._end_sector = max(self._end_sector, first_sector + count)
+        return True
+
+    def _replay(self, output):
+        sector_size = self._scan_info.sector_size
+        method_count = len(self._scan_info.analysis_names)
+        for _, offset in sorted(self._batches):
+            self._spool.seek(offset)
+            header = self._spool.read(16)
+            first_sector, count = np.frombuffer(header, dtype=np.int64).tolist()
+            results = []
+            for _ in range(method_count):
+                results.append(SectorResults(
+                    np.frombuffer(self._spool.read(count * 8), dtype=np.float64),
+                    np.frombuffer(self._spool.read(count), dtype=np.uint8),
+                    np.frombuffer(self._spool.read(count), dtype=np.uint8)
+                ))
+            if not output.output_batch(first_sector, sector_size, *results):
+                return
+
+    def error(self, message):
+        return print_check_closed_pipe(message, file=self._output_args.get('err_file', stderr))
+
+    def exit(self):
+        sector_size = self._scan_info.sector_size
+        sector_count = self._end_sector if self._image.size is None else ceil(self._image.size / sector_size)
+        with self._spool, self._output_method(sector_count, scan_info=self._scan_info,
+                                              **self._output_args) as output:
+            self._replay(output)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None:  # the results of a failed scan are not passed to the output method
+            self._spool.close()
+            return
+        self.exit()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: MIT
+
+import argparse
+from sys import stderr
+from output_methods import output_methods
+from argument_parsing import add_output_method_arguments, check_invalid_output_method_args, output_method_type
+from output_common import ScanInfo
+from results_file import ResultsFile
+
+BATCH_SECTORS = 1 << 16  # number of sectors passed to the output method at once
+
+
+USAGE = '%(prog)s [-h] [-a ANALYSIS_METHODS] [-s SIZE] method [output method arguments] file'
+
+
+def parse_arguments():
+    main_parser = argparse.ArgumentParser(usage=USAGE)
+    main_parser.add_argument(
+        '-a', '--analysis',
+        help='comma separated list of the analysis methods of the results file to output'
+             ' (default: all of them)',
+        dest='analysis_methods'
+    )
+    main_parser.add_argument(
+        '-s', '--size',
+        help='sector size of the results to output, one of the sizes of the levels of the results file'
+             ' (default: the sector size of the scan)',
+        type=int
+    )
+    main_parser.add_argument(
+        'method',
+        help=f'Set the output method (available: {", ".join(output_methods.keys())})',
+        type=output_method_type,
+    )
+
+    main_args, rest = main_parser.parse_known_args()
+    second_parser = argparse.ArgumentParser(usage=USAGE)
+    # the results file follows the output method arguments, which the main parser does not know
+    second_parser.add_argument(
+        'file',
+        help='results file created by the binary output method',
+        type=argparse.FileType('rb'),
+    )
+    add_output_method_arguments(second_parser, main_args.method)
+    output_args = second_parser.parse_args(rest)
+    main_args.file = output_args.file
+    delattr(output_args, 'file')
+    check_invalid_output_method_args(main_args.method, output_args, second_parser)
+
+    return main_args, output_args
+
+
+def main(args, output_args):
+    with args.file as f:
+        try:
+            results = ResultsFile(f)
+        except ValueError as e:
+            print(f'{f.name}: {e}', file=stderr)
+            exit(1)
+
+    names = results.analysis_names if args.analysis_methods is None else args.analysis_methods.split(',')
+    for name in names:
+        if name not in results.analysis_names:
+            print(f'{args.file.name} does not contain the results of {name}', file=stderr)
+            exit(1)
+    indices = [results.analysis_names.index(name) for name in names]
+    sizes = [results.sector_size << level for level in range(results.levels)]
+    size = results.sector_size if args.size is None else args.size
+    if size not in sizes:
+        print(f'{args.file.name} does not contain the results of {size} byte sectors'
+              f' (available: {", ".join(map(str, sizes))})', file=stderr)
+        exit(1)
+    level = sizes.index(size)
+    sector_count = results.level_sector_count(level)
+    complete_sectors = min(results.complete_sectors >> level, sector_count)
+    if complete_sectors < sector_count:
+        print(f'{args.file.name} is the result of an interrupted scan, only the first {complete_sectors}'
+              f' of {sector_count} sectors are output', file=stderr)
+
+    scan_info = ScanInfo(names, size, results.rand_lim, results.sus_rand_lim)
+    with args.method(sector_count, scan_info=scan_info, **vars(output_args)) as output:
+        for first_sector in range(0, complete_sectors, BATCH_SECTORS):
+            ret = output.output_batch(
+                first_sector,
+                size,
+                *(results.results(i, first_sector, min(first_sector + BATCH_SECTORS, complete_sectors), level)
+                  for i in indices)
+            )
+            if not ret:  # the pipe was closed
+                exit(0)
+
+
+if __name__ == '__main__':
+    arguments, output_arguments = parse_arguments()
+    main(arguments, output_arguments)
+    exit(0)
@@ -5,6 +5,8 @@ import argparse
 from output_methods import output_methods
 from argument_parsing import add_output_method_arguments, check_invalid_output_method_args, output_method_type
 from analysis import ResultFlag
+from output_common import ScanInfo
+from text_output import CSVOutput
 import csv
 
 
@@ -35,11 +37,40 @@ def parse_arguments():
     return main_args, output_args
 
 
-def set_to_header_end_position(f):
+def read_analysis_names(f, delimiter):
+    """Returns the names of the analysis methods the file contains the results of
+    and leaves the file positioned after the header"""
     p = f.tell()
-    line = f.readline()
-    if line[0].isdigit():
-        f.seek(p)
+    row = next(csv.reader([f.readline()], delimiter=delimiter))
+    f.seek(p)
+    if not row[0].isdigit():
+        f.readline()
+        names = CSVOutput.get_analysis_names(row)
+        return [''] if names is None else names
+    methods = (len(row) - 2) // CSVOutput.RESULT_COLUMNS
+    return [''] if methods == 1 else [f'method-{i}' for i in range(1, methods + 1)]
+
+
+def read_sector_size(f, delimiter):
+    """Returns the sector size implied by the offsets of the first two sectors or None,
+    expects the file to be positioned after the header"""
+    p = f.tell()
+    rows = [next(csv.reader([f.readline()], delimiter=delimiter), None) for _ in range(2)]
+    f.seek(p)
+    if None in rows or int(rows[1][0]) == int(rows[0][0]):
+        return None
+    return (int(rows[1][1]) - int(rows[0][1])) // (int(rows[1][0]) - int(rows[0][0]))
+
+
+def parse_results(row):
+    results = []
+    for i in range(2, len(row), CSVOutput.RESULT_COLUMNS):
+        results += (
+            float(row[i]),
+            ResultFlag(int(row[i + 1])),
+            None if row[i + 2] == '' else int(row[i + 2])
+        )
+    return results
 
 
 def get_number_of_lines(f):
@@ -53,15 +84,14 @@ def get_number_of_lines(f):
 
 def main(args, output_args):
     with args.file as f:
-        set_to_header_end_position(f)
-        with args.method(get_number_of_lines(f), **vars(output_args)) as output:
+        scan_info = ScanInfo(read_analysis_names(f, args.delimiter))
+        scan_info.sector_size = read_sector_size(f, args.delimiter)
+        with args.method(get_number_of_lines(f), scan_info=scan_info, **vars(output_args)) as output:
             for row in csv.reader(f, delimiter=args.delimiter):
                 ret = output.output(
                     int(row[0]),
                     int(row[1]),
-                    float(row[2]),
-                    ResultFlag(int(row[3])),
-                    None if row[4] == '' else int(row[4])
+                    *parse_results(row)
                 )
                 if not ret:  # the pipe was closed
                     exit(0)
@@ -0,0 +1,86 @@
+# SPDX-License-Identifier: MIT
+
+import os
+from functools import lru_cache
+from tempfile import NamedTemporaryFile
+from histograms import np
+
+TABLE_MAX_ORDER = 10  # the largest order of the curves whose coordinates are tabulated (8 MiB per table)
+
+
+def _build_coordinate_table(order):
+    """Returns the (2, 4, 4**order) x and y coordinates of the curve of the order in its four orientations"""
+    x, y = np.zeros(1, dtype=np.int16), np.zeros(1, dtype=np.int16)
+    for level in range(order):
+        s = 1 << level
+        x, y = (np.concatenate([y, x + s, x + s, s - 1 - y]),  # the quadrant of distances with the highest digit 0
+                np.concatenate([x, y, y + s, 2 * s - 1 - x]))  # is swapped and the one with 3 is flipped
+    return np.stack([np.stack([x, y, -y, -x]), np.stack([y, x, -x, -y])])
+
+
+def _build_block_table(order, table_order):
+    """Returns the orientation and the x and y offsets of every block of 4**table_order distances"""
+    high = np.arange(4 ** (order - table_order), dtype=np.int64)
+    one, zero = np.ones_like(high), np.zeros_like(high)
+    a, b, c, d, e, f = one, zero, zero, zero, one, zero
+    s = 1 << table_order
+    while s < 1 << order:
+        ry = 1 & (high >> 1)
+        rx = 1 & (high ^ ry)
+
+        # rotate accordingly
+        swap = rx == 0
+        flip = swap & (ry == 1)
+        a, b, c, d, e, f = (np.where(flip, -d, np.where(swap, d, a)), np.where(flip, -e, np.where(swap, e, b)),
+                            np.where(flip, s - 1 - f, np.where(swap, f, c)), np.where(flip, -a, np.where(swap, a, d)),
+                            np.where(flip, -b, np.where(swap, b, e)), np.where(flip, s - 1 - c, np.where(swap, c, f)))
+
+        c += s * rx
+        f += s * ry
+        high = high >> 2
+        s <<= 1
+    orientation = np.where(a == 1, 0, np.where(b == 1, 1, np.where(b == -1, 2, 3)))
+    return np.stack([orientation, c, f]).astype(np.int32)
+
+
+def _cached(directory, name, build):
+    """Loads the table from the directory, building and storing it there first if it is missing"""
+    if directory is None:
+        return build()
+    path = os.path.join(directory, f'{name}.npy')
+    try:
+        return np.load(path)
+    except (OSError, ValueError):
+        pass
+    table = build()
+    os.makedirs(directory, exist_ok=True)
+    with NamedTemporaryFile(dir=directory, suffix='.npy', delete=False) as f:
+        np.save(f, table)
+    os.replace(f.name, path)  # other processes never read a partially written table
+    return table
+
+
+@lru_cache(maxsize=None)
+def coordinate_table(order, directory=None):
+    return _cached(directory, f'hilbert-{order}', lambda: _build_coordinate_table(order))
+
+
+@lru_cache(maxsize=None)
+def block_table(order, table_order, directory=None):
+    return _cached(directory, f'hilbert-{order}-blocks-{table_order}', lambda: _build_block_table(order, table_order))
+
+
+def d2xy(order, d, directory=None):
+    """Calculates the points on the Hilbert curve of the order from the array of distances"""
+    table_order = min(order, TABLE_MAX_ORDER)
+    table = coordinate_table(table_order, directory)
+    d = np.asarray(d, dtype=np.int64)
+    low = d & ((1 << 2 * table_order) - 1)
+    if order == table_order:
+        return table[0, 0][low].astype(np.int64), table[1, 0][low].astype(np.int64)
+
+    blocks = block_table(order, table_order, directory)
+    high = d >> 2 * table_order
+    index = blocks[0][high] * (1 << 2 * table_order) + low
+    return (table[0].reshape(-1)[index] + blocks[1][high].astype(np.int64),
+            table[1].reshape(-1)[index] + blocks[2][high].astype(np.int64))
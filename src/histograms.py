@@ -0,0 +1,108 @@
+# SPDX-License-Identifier: MIT
+
+from functools import lru_cache
+from sys import stderr
+
+try:
+    import numpy as np
+except ImportError:
+    print('the numpy library is not installed. \n'
+          'Use `pip install numpy` to install it', file=stderr)
+    exit(1)
+
+
+def sectors_view(block, sector_size):
+    """Returns the block of consecutive sectors as a (sectors, sector_size)
+    array of bytes without copying it."""
+    return np.frombuffer(block, dtype=np.uint8).reshape(-1, sector_size)
+
+
+def uniform_rows(sectors):
+    """Returns a mask of the rows consisting of a single repeated byte value"""
+    return (sectors == sectors[:, :1]).all(axis=1)
+
+
+def byte_histograms(sectors):
+    """Returns a (sectors, 256) array with the count of each byte value
+    in every row of the argument."""
+    rows = sectors.shape[0]
+    # shift the values of each row into its own range of 256 bins,
+    # so that a single bincount histograms all rows at once
+    offsets = np.arange(0, rows * 256, 256, dtype=np.intp)[:, None]
+    return np.bincount((sectors + offsets).ravel(), minlength=rows * 256).reshape(rows, 256)
+
+
+def _position_type(end):
+    """Returns the smallest unsigned integer type holding the positions up to end"""
+    return np.uint16 if end < 1 << 16 else np.uint32 if end < 1 << 32 else np.uint64
+
+
+def first_positions(sectors):
+    """Returns a (sectors, 256) array with the position of the first occurrence of each byte value
+    in every row of the argument, or the length of the rows for the values not present."""
+    rows, sector_size = sectors.shape
+    position_type = _position_type(sector_size)
+    positions = np.full(rows * 256, sector_size, dtype=position_type)
+    offsets = np.arange(0, rows * 256, 256, dtype=np.intp)[:, None]
+    np.minimum.at(positions, (sectors + offsets).ravel(), np.tile(np.arange(sector_size, dtype=position_type), rows))
+    return positions.reshape(rows, 256)
+
+
+def merge_first_positions(positions, sector_size):
+    """Converts the first positions of the byte values in sectors of sector_size to those
+    in the sectors of twice the size made of the consecutive pairs of them"""
+    pairs = positions[:len(positions) // 2 * 2].reshape(-1, 2, 256).astype(_position_type(2 * sector_size))
+    return np.where(pairs[:, 0] < sector_size, pairs[:, 0], pairs[:, 1] + sector_size)
+
+
+@lru_cache(maxsize=None)
+def _byte_group_table(n):
+    """Returns a (256, 2**n) table with the count of each n bit group value in every byte value"""
+    table = np.zeros((256, 2 ** n), dtype=np.int64)
+    for byte in range(256):
+        for shift in range(8 - n, -1, -n):
+            table[byte, (byte >> shift) & (2 ** n - 1)] += 1
+    return table
+
+
+@lru_cache(maxsize=None)
+def _bit_group_positions(sector_size, n):
+    """Returns the index of the first byte of each n bit group in a sector
+    and the shift extracting the group from that byte and the following one"""
+    starts = np.arange((sector_size * 8) // n) * n
+    first_bytes = starts // 8
+    # a group within a single byte never needs the following byte,
+    # which keeps the index of the last group inside the sector
+    second_bytes = np.minimum(first_bytes + 1, sector_size - 1)
+    shifts = (16 - n - starts % 8).astype(np.uint16)
+    return first_bytes, second_bytes, shifts
+
+
+def group_histograms(counts, n):
+    """Converts (sectors, 256) byte counts to the counts of n bit groups,
+    n needs to divide 8"""
+    if n == 8:
+        return counts
+    return counts @ _byte_group_table(n)
+
+
+def bit_group_histograms(sectors, n):
+    """Returns a (sectors, 2**n) array with the count of each value of the
+    non-overlapping groups of n consecutive bits (starting with the most significant bit
+    of the first byte) in every row of the argument. Bits not forming a whole group
+    at the end of the row are ignored."""
+    if 8 % n == 0:
+        return group_histograms(byte_histograms(sectors), n)
+
+    rows, sector_size = sectors.shape
+    first_bytes, second_bytes, shifts = _bit_group_positions(sector_size, n)
+    groups = np.take(sectors, first_bytes, axis=1).astype(np.uint16)
+    groups <<= 8
+    groups |= np.take(sectors, second_bytes, axis=1)
+    groups >>= shifts
+    groups &= 2 ** n - 1
+
+    bins = 2 ** n
+    indices = groups.astype(np.intp)
+    indices += np.arange(0, rows * bins, bins, dtype=np.intp)[:, None]
+    return np.bincount(indices.ravel(), minlength=rows * bins).reshape(rows, bins)
@@ -6,7 +6,11 @@ from sys import stderr, stdout
 from output_common import OutputMethodBase, Parameter, print_check_closed_pipe
 from math import ceil, log, sqrt
 import re
-from palettes import palettes
+from palettes import palettes, compile_palette
+from analysis import ResultFlag, SectorResults
+from histograms import np
+from hilbert import d2xy
+from png_writer import PNGWriter
 
 try:
     from PIL import Image, ImageDraw, ImageFont
@@ -90,6 +94,21 @@ def font_size_type(x):
     return val
 
 
+def pixel_count_type(x):
+    match = re.fullmatch(r'(\d+)(?:x(\d+))?', x.strip().lower())
+    if match is None or int(match.group(1)) * int(match.group(2) or 1) < 1:
+        raise ArgumentTypeError(f'{x} is not a valid number of pixels')
+    return int(match.group(1)) * int(match.group(2) or 1)
+
+
+def text_size(fnt, text):
+    """Returns the width and height of the text, getsize() was removed in Pillow 10"""
+    if hasattr(fnt, 'getsize'):
+        return fnt.getsize(text)
+    _, _, right, bottom = fnt.getbbox(text)
+    return right, bottom
+
+
 def luminance_test_black_white(bg_color):
     """Based on W3 guidelines: https://www.w3.org/TR/WCAG20/#relativeluminancedef"""
     srgb = [x / 255 for x in bg_color]
@@ -109,11 +128,22 @@ class ImageOutput(OutputMethodBase):
         'palette': Parameter(palette_type, 'photocopy-safe', 'color palette to use', available=list(palettes.keys())),
         'font': Parameter(font_type, 'LiberationMono-Regular', 'font to use for legend'),
         'font_size': Parameter(font_size_type, ..., 'font size to use for legend in pixels', 'automatic'),
-        'font_color': Parameter(hex_color_type, ..., 'hex code of font color of the legend', 'automatic')
+        'font_color': Parameter(hex_color_type, ..., 'hex code of font color of the legend', 'automatic'),
+        'max_pixels': Parameter(pixel_count_type, ..., 'the largest number of pixels (e.g. 4096x4096) showing'
+                                ' the sectors, each summarizing a run of sectors if there are more of them',
+                                'one pixel per sector')
     }
+    ORDERED = False
+    NEEDS_SIZE = True
+    PROGRESSIVE = True
+    RUN_PIXELS = 1 << 20  # pixels of the runs of output_runs() drawn at once
 
     def __init__(self, input_size, **kwargs):
         super().__init__(input_size, **kwargs)
+        self._sector_count = input_size
+        self._sectors_per_pixel = 1 if self.max_pixels is Ellipsis else max(ceil(input_size / self.max_pixels), 1)
+        self._input_size = ceil(input_size / self._sectors_per_pixel)  # the number of pixels laid out
+        self._partial_pixels = {}  # position -> (totals, pattern) of the pixels whose runs were passed partly
 
         vis_size = self._get_size()
 
@@ -124,14 +154,8 @@ class ImageOutput(OutputMethodBase):
                 fnt = ImageFont.truetype(self.font, size=self.font_size)
             except OSError:
                 fnt = ImageFont.load_default()
-            legend_size = self._get_legend_size(fnt)
-            total_size = (
-                vis_size[0] + legend_size[0],
-                max(vis_size[1], legend_size[1])
-            )
         else:
             fnt = None
-            total_size = vis_size
 
         if self.font_color is Ellipsis:
             self.font_color = luminance_test_black_white(self.background)
@@ -140,18 +164,146 @@ class ImageOutput(OutputMethodBase):
             or len(self.background) == 4 \
             or len(self.font_color) == 4
 
-        self._image = Image.new(
-            'RGBA' if self._rgba else 'RGB',
-            total_size,
-            self.background
-        )
-        if not self.no_legend and len(self.palette.LEGEND) > 0:
-            self._draw_legend(fnt)
+        self._mode = 'RGBA' if self._rgba else 'RGB'
+        self._palette_table = compile_palette(self.palette)
+        self._palette_colors = self._palette_table.colors[:, :len(self._mode)]
+        self._zero_pattern_color = self._colors(SectorResults(np.zeros(1), np.array([ResultFlag.SINGLE_BYTE_PATTERN],
+                                                                                    dtype=np.uint8),
+                                                              np.zeros(1, dtype=np.uint8)))[0]
+        self._init_canvas(vis_size, fnt)
+
+    def _init_canvas(self, vis_size, fnt):
+        """Allocates the pixels of the whole image with the legend drawn on its right (unless fnt is None)"""
+        if fnt is not None:
+            legend_size = self._get_legend_size(fnt)
+            total_size = (
+                vis_size[0] + legend_size[0],
+                max(vis_size[1], legend_size[1])
+            )
+        else:
+            total_size = vis_size
+
+        image = Image.new(self._mode, total_size, self.background)
+        if fnt is not None:
+            self._draw_legend(image, fnt)
+        # the pixels are written to an array, which is converted to an image only when it is saved
+        self._pixels = np.array(image)
+        image.close()
 
     def output(self, *args):
-        self._image.putpixel(self._coords_from_pos(args[0]), self.palette.get(*args))
+        # only the results of the first analysis method are visualized
+        if self._sectors_per_pixel > 1:
+            return self.output_batch(args[0], None, SectorResults(np.array([args[2]], dtype=np.float64),
+                                                                  np.array([args[3]], dtype=np.uint8),
+                                                                  np.array([args[4] or 0], dtype=np.uint8)))
+        self._put_pixels(np.array([args[0]]), np.array([self._color(self.palette.get(*args[:5]))], dtype=np.uint8))
+        return True
+
+    def output_batch(self, first_sector, sector_size, *results):
+        if self._sectors_per_pixel > 1 and len(results[0].flag) > 0:
+            positions, colors = self._summarize(first_sector, results[0])
+            if len(positions) > 0:
+                self._put_pixels(positions, colors)
+            return True
+        if self._sectors_per_pixel > 1:
+            return True
+        sector_numbers = np.arange(first_sector, first_sector + len(results[0].flag))
+        self._put_pixels(sector_numbers, self._colors(results[0]))
+        return True
+
+    def _summarize(self, first_sector, results):
+        """Returns the positions and the colors of the pixels all sectors of the runs of which were passed.
+        The totals of the pixels of the runs passed partly are kept until the rest of the run is passed,
+        or until the sectors following them are passed if the sectors are passed in order."""
+        spp = self._sectors_per_pixel
+        positions = np.arange(first_sector // spp, (first_sector + len(results.flag) - 1) // spp + 1, dtype=np.int64)
+        starts = np.maximum(positions * spp - first_sector, 0)
+        sbp = results.flag == ResultFlag.SINGLE_BYTE_PATTERN
+        totals = np.add.reduceat(np.column_stack([
+            np.eye(len(ResultFlag))[results.flag],
+            np.where(results.flag == ResultFlag.NONE, results.randomness, 0.0),
+            sbp & (results.pattern == 0)
+        ]), starts)
+        patterns = np.maximum.reduceat(np.where(sbp, results.pattern, 0), starts)
+
+        for i in {0, len(positions) - 1}:
+            if int(positions[i]) in self._partial_pixels:
+                partial_totals, partial_pattern = self._partial_pixels.pop(int(positions[i]))
+                totals[i] += partial_totals
+                patterns[i] = max(patterns[i], partial_pattern)
+        done = totals[:, :len(ResultFlag)].sum(axis=1) >= np.minimum(spp, self._sector_count - positions * spp)
+        for i in np.flatnonzero(~done).tolist():
+            self._partial_pixels[int(positions[i])] = (totals[i], patterns[i])
+
+        if not self.ORDERED:
+            return positions[done], self._summary_colors(totals[done], patterns[done])
+        finished_positions, finished_totals, finished_patterns = self._finish_partial_pixels(positions[0])
+        return (np.concatenate([finished_positions, positions[done]]),
+                self._summary_colors(np.concatenate([finished_totals, totals[done]]),
+                                     np.concatenate([finished_patterns, patterns[done]])))
+
+    def _finish_partial_pixels(self, end_position):
+        """Returns the positions, totals and patterns of the pixels before end_position whose runs were passed partly"""
+        positions = sorted(position for position in self._partial_pixels if position < end_position)
+        partial = [self._partial_pixels.pop(position) for position in positions]
+        return (np.array(positions, dtype=np.int64),
+                np.array([totals for totals, _ in partial]).reshape(len(partial), len(ResultFlag) + 2),
+                np.array([pattern for _, pattern in partial], dtype=np.uint8))
+
+    def _summary_colors(self, totals, patterns):
+        """Returns the colors of the pixels summarizing runs of sectors: the color of the most common result flag
+        of the sectors other than the zeroed ones (with the mean randomness of the sectors without a result flag
+        and the largest byte pattern), blended toward the color of the zeroed sectors by their fraction of the run"""
+        counts = totals[:, :len(ResultFlag)].copy()
+        zeroed = totals[:, len(ResultFlag) + 1]
+        zeroed_fraction = zeroed / np.maximum(counts.sum(axis=1), 1)
+        counts[:, ResultFlag.SINGLE_BYTE_PATTERN] -= zeroed
+        flag = counts.argmax(axis=1).astype(np.uint8)
+        randomness = totals[:, len(ResultFlag)] / np.maximum(counts[:, ResultFlag.NONE], 1)
+        colors = self._colors(SectorResults(randomness, flag, patterns.astype(np.uint8)))
+        blended = colors + zeroed_fraction[:, None] * (self._zero_pattern_color.astype(np.float64) - colors)
+        return np.rint(blended).astype(np.uint8)
+
+    def output_runs(self, sector_numbers, run_length, sector_size, *results):
+        colors = self._colors(results[0])
+        # a bounded number of pixels at once
+        step = max(self.RUN_PIXELS // run_length, 1)
+        for start in range(0, len(sector_numbers), step):
+            positions = (sector_numbers[start:start + step, None] + np.arange(run_length)).ravel()
+            run_colors = np.repeat(colors[start:start + step], run_length, axis=0)
+            inside = positions < self._input_size
+            self._put_pixels(positions[inside], run_colors[inside])
         return True
 
+    def _color(self, color):
+        """Returns the color as a tuple of the channels of the image"""
+        return (*color, 255) if self._rgba and len(color) == 3 else color
+
+    def _colors(self, results):
+        """Returns a (sectors, channels) array with the color of each sector, gathered from the compiled palette"""
+        return self._palette_colors[self._palette_table.indexes(results.flag, results.pattern, results.randomness)]
+
+    def _put_pixels(self, positions, colors):
+        x, y = self._coords_from_pos(positions)
+        self._pixels[y, x] = colors
+
+    def flush(self):
+        # intermediate images are only written to files, which can be rewritten by the final one
+        if self.output_file.seekable():
+            self._save()
+        return True
+
+    def _save(self):
+        if self.output_file.seekable():
+            self.output_file.seek(0)
+            self.output_file.truncate()
+        with Image.fromarray(self._pixels, self._mode) as image:
+            try:
+                image.save(self.output_file)
+            except ValueError:
+                image.save(self.output_file, 'PNG')
+        self.output_file.flush()
+
     def _coords_from_pos(self, pos):
         raise NotImplementedError(
             f'Class {self.__class__.__name__} needs to implement the _coords_from_pos() method'
@@ -162,15 +314,20 @@ class ImageOutput(OutputMethodBase):
             f'Class {self.__class__.__name__} needs to implement the _get_size() method'
         )
 
+    def _tile_last_positions(self, tile_size):
+        """Returns a (rows, columns) array with the last position within each tile of the side tile_size"""
+        raise NotImplementedError(
+            f'Class {self.__class__.__name__} needs to implement the _tile_last_positions() method'
+        )
+
     def error(self, message):
         return print_check_closed_pipe(message, file=self.err_file)
 
     def exit(self):
-        try:
-            self._image.save(self.output_file)
-        except ValueError:
-            self._image.save(self.output_file, 'PNG')
-        self._image.close()
+        positions, totals, patterns = self._finish_partial_pixels(float('inf'))
+        if len(positions) > 0:
+            self._put_pixels(positions, self._summary_colors(totals, patterns))
+        self._save()
         self.output_file.close()
         self.err_file.close()
 
@@ -178,23 +335,23 @@ class ImageOutput(OutputMethodBase):
         if len(self.palette.LEGEND) < 1:
             raise ValueError('Legend needs to have at least one element')
 
-        square_size = fnt.getsize('a')[1]
+        square_size = text_size(fnt, 'a')[1]
         spacing = square_size // 2
-        width = spacing * 3 + square_size + max(fnt.getsize(x[1])[0] for x in self.palette.LEGEND)
+        width = spacing * 3 + square_size + max(text_size(fnt, x[1])[0] for x in self.palette.LEGEND)
         height = len(self.palette.LEGEND) * square_size + (len(self.palette.LEGEND) + 1) * spacing
 
         return width, height
 
-    def _draw_legend(self, fnt):
-        d = ImageDraw.Draw(self._image)
+    def _draw_legend(self, image, fnt):
+        d = ImageDraw.Draw(image)
         lw, lh = self._get_legend_size(fnt)
         outline_color = luminance_test_black_white(self.background)
-        square_size = fnt.getsize('a')[1]
+        square_size = text_size(fnt, 'a')[1]
         square_border_width = max(square_size // 16, 1)
         spacing = square_size // 2
-        square_pos_w = self._image.size[0] - lw + spacing
+        square_pos_w = image.size[0] - lw + spacing
         text_pos_w = square_pos_w + square_size + spacing
-        text_pos_h = self._image.size[1] // 2 - lh // 2 + spacing
+        text_pos_h = image.size[1] // 2 - lh // 2 + spacing
 
         for color, desc in self.palette.LEGEND:
             d.text((text_pos_w, text_pos_h), desc, font=fnt, fill=self.font_color)
@@ -211,7 +368,9 @@ class SweepingBlocks(ImageOutput):
     default_parameters = {
         **ImageOutput.default_parameters,
         'width': Parameter(int, ..., 'the width of resulting image in pixels', 'automatic square'),
-        'sweeping_block_size': Parameter(int, ..., 'the size of block groups of the resulting image', 'automatic')
+        'sweeping_block_size': Parameter(int, ..., 'the size of block groups of the resulting image', 'automatic'),
+        'stream': Parameter(bool, False, 'the image is written while the sectors are analyzed, keeping only a row'
+                                         ' of blocks in memory (the sectors are passed to the output in order)')
     }
 
     def __init__(self, input_size, **kwargs):
@@ -222,6 +381,72 @@ class SweepingBlocks(ImageOutput):
         if sbsie and self.sweeping_block_size == 1:
             print_check_closed_pipe(f'warn: sensible sweeping block size for width {self.width}'
                                     ' could not be selected, defaulting to sweeping.', file=stderr)
+        if self.stream:
+            self.ORDERED = True
+
+    def _init_canvas(self, vis_size, fnt):
+        """Starts writing the image instead of allocating its pixels if it is streamed"""
+        if not self.stream:
+            return super()._init_canvas(vis_size, fnt)
+        legend_size = (0, 0) if fnt is None else self._get_legend_size(fnt)
+        self._vis_width = vis_size[0]
+        self._total_size = (vis_size[0] + legend_size[0], max(vis_size[1], legend_size[1]))
+        self._legend = None
+        if fnt is not None:
+            # the legend is drawn on a strip of the rows around it, centered the same way as on the whole image
+            legend_rows = min(self._total_size[1], 3 * legend_size[1])
+            with Image.new(self._mode, (legend_size[0], legend_rows), self.background) as image:
+                self._draw_legend(image, fnt)
+                self._legend = np.array(image)
+            self._legend_top = self._total_size[1] // 2 - legend_rows // 2
+        # the standard output is opened in the text mode by default
+        self._writer = PNGWriter(getattr(self.output_file, 'buffer', self.output_file), *self._total_size, self._mode)
+        self._strip_index = 0
+        self._strip = self._strip_rows(0)
+
+    def _strip_rows(self, index):
+        """Returns the background and the legend of the rows of the index-th row of blocks"""
+        _, sbs = self._calc_widths()
+        first_row = index * sbs
+        rows = np.tile(np.array(self._color(self.background), dtype=np.uint8),
+                       (min(sbs, self._total_size[1] - first_row), self._total_size[0], 1))
+        if self._legend is not None:
+            start = max(first_row, self._legend_top)
+            end = min(first_row + len(rows), self._legend_top + len(self._legend))
+            if start < end:
+                rows[start - first_row:end - first_row, self._vis_width:] = \
+                    self._legend[start - self._legend_top:end - self._legend_top]
+        return rows
+
+    def _write_strips(self, index):
+        """Writes the rows of blocks preceding the index-th one"""
+        if index < self._strip_index:
+            raise ValueError('the sectors of a streamed image need to be passed in order')
+        while self._strip_index < index and self._writer.rows_written < self._total_size[1]:
+            self._writer.write_rows(self._strip)
+            self._strip_index += 1
+            if self._writer.rows_written < self._total_size[1]:
+                self._strip = self._strip_rows(self._strip_index)
+
+    def _put_pixels(self, positions, colors):
+        if not self.stream:
+            return super()._put_pixels(positions, colors)
+        strip_positions = self.width * self.sweeping_block_size
+        strips = positions // strip_positions
+        bounds = np.flatnonzero(np.diff(strips)) + 1
+        for start, end in zip([0, *bounds.tolist()], [*bounds.tolist(), len(strips)]):
+            self._write_strips(int(strips[start]))
+            x, y = self._coords_from_pos(positions[start:end])
+            self._strip[y - self._strip_index * self.sweeping_block_size, x] = colors[start:end]
+        if len(positions) > 0:
+            # the row of blocks is written once its last sector was passed
+            self._write_strips((int(positions[-1]) + 1) // strip_positions)
+
+    def _save(self):
+        if not self.stream:
+            return super()._save()
+        self._write_strips(ceil(self._total_size[1] / self.sweeping_block_size))
+        self._writer.close()
 
     def _calc_widths(self):
         preferred_block_size = max(16, 2 ** (int(sqrt(self._input_size)).bit_length() - 5))
@@ -253,6 +478,14 @@ class SweepingBlocks(ImageOutput):
                 (pos // self.sweeping_block_size) % self.sweeping_block_size + pos //
                 (self.sweeping_block_size * self.width) * self.sweeping_block_size)
 
+    def _tile_last_positions(self, tile_size):
+        # the blocks and the pixels within them are ordered by rows, so the bottom right pixel is the last one
+        width, height = self._get_size()
+        _, sbs = self._calc_widths()
+        x = np.minimum(np.arange(1, ceil(width / tile_size) + 1) * tile_size, width)[None, :] - 1
+        y = np.minimum(np.arange(1, ceil(height / tile_size) + 1) * tile_size, height)[:, None] - 1
+        return (y // sbs) * sbs * width + (x // sbs) * sbs ** 2 + (y % sbs) * sbs + x % sbs
+
     @staticmethod
     def check_args(**kwargs):
         if 'width' in kwargs and 'sweeping_block_size' in kwargs \
@@ -267,7 +500,9 @@ class SweepingBlocks(ImageOutput):
 class Sweeping(SweepingBlocks):
     default_parameters = {
         **ImageOutput.default_parameters,
-        'width': Parameter(int, ..., 'the width of the resulting image in pixels', 'automatic square')
+        'width': Parameter(int, ..., 'the width of the resulting image in pixels', 'automatic square'),
+        'stream': Parameter(bool, False, 'the image is written while the sectors are analyzed, keeping only a row'
+                                         ' in memory (the sectors are passed to the output in order)')
     }
 
     def __init__(self, input_size, **kwargs):
@@ -278,12 +513,17 @@ class Sweeping(SweepingBlocks):
 
 # hilbert-curve
 class HilbertCurve(ImageOutput):
-    def __init__(self, input_size, **kwargs):
+    default_parameters = {
+        **ImageOutput.default_parameters,
+        'table_dir': Parameter(str, ..., 'directory to cache the coordinate tables of the curve in', 'none')
+    }
+
+    def _get_size(self):
         # get the smallest number of iterations of Hilbert curve required to fit all sectors
-        iterations = ceil(log(input_size, 4))
+        iterations = ceil(log(self._input_size, 4))
 
         # if the image would take up more than three curves of lower iteration,
-        if input_size > 3 * 4 ** (iterations - 1):
+        if self._input_size > 3 * 4 ** (iterations - 1):
             # use smallest single curve that fits all sectors
             self.width = self.height = 2 ** iterations
         else:
@@ -291,38 +531,20 @@ class HilbertCurve(ImageOutput):
             self.width = 2 ** (iterations - 1)
             # and set the smallest height (in half-curve-side increments) that fits all sectors
             self.height = int(ceil(
-                input_size / 2 ** (2 * iterations - 3)) * 2 ** (iterations - 2))
-
-        super().__init__(input_size, **kwargs)
-
-    def _get_size(self):
+                self._input_size / 2 ** (2 * iterations - 3)) * 2 ** (iterations - 2))
         return self.width, self.height
 
     def _coords_from_pos(self, pos):
-        p = self._d2xy(self.width, pos % self.width ** 2)
-        return p[0], p[1] + (pos // self.width ** 2) * self.width
-
-    @staticmethod
-    def _d2xy(n, d):
-        """Calculates point on Hilbert curve from given distance
-
-        code adapted from
-        https://en.wikipedia.org/wiki/Hilbert_curve#Applications_and_mapping_algorithms"""
-
-        x = y = 0
-        s = 1
-        while s < n:
-            ry = 1 & (d >> 1)
-            rx = 1 & (d ^ ry)
-
-            # rotate accordingly
-            if rx == 0 and ry == 1:
-                x, y = s - 1 - y, s - 1 - x
-            elif rx == 0:
-                x, y = y, x
-
-            x += s * rx
-            y += s * ry
-            d >>= 2
-            s <<= 1
-        return x, y
+        x, y = d2xy(self.width.bit_length() - 1, pos % self.width ** 2,
+                    None if self.table_dir is Ellipsis else self.table_dir)
+        return x, y + (pos // self.width ** 2) * self.width
+
+    def _tile_last_positions(self, tile_size):
+        # every aligned square of the side group covers group**2 consecutive distances and lies within one tile
+        group = min(tile_size, self.width)
+        starts = np.arange(ceil(self.height / self.width) * (self.width // group) ** 2, dtype=np.int64) * group ** 2
+        x, y = self._coords_from_pos(starts)
+        inside = y // group * group < self.height
+        last = np.full((ceil(self.height / tile_size), ceil(self.width / tile_size)), -1, dtype=np.int64)
+        np.maximum.at(last, (y[inside] // tile_size, x[inside] // tile_size), starts[inside] + group ** 2 - 1)
+        return last
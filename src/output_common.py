@@ -2,6 +2,7 @@
 
 from typing import Dict, Any, List, Optional
 from dataclasses import dataclass
+from itertools import chain
 
 
 @dataclass
@@ -13,11 +14,25 @@ class Parameter:
     available: Optional[List[str]] = None
 
 
+@dataclass
+class ScanInfo:
+    analysis_names: List[str]
+    sector_size: Optional[int] = None
+    rand_lim: Optional[float] = None
+    sus_rand_lim: Optional[float] = None
+    levels: int = 1  # the results of the sectors of 2, 4, ... 2**(levels - 1) times sector_size follow the others
+
+
 class OutputMethodBase:
     default_parameters: Dict[str, Parameter] = dict()
+    ORDERED = True  # whether the results need to be passed in the order of sectors
+    PROGRESSIVE = False  # whether output_runs() and flush() are implemented
+    NEEDS_SIZE = False  # whether the input_size needs to be known (otherwise it may be None)
+    LEVELS = False  # whether the results of the larger sectors of ScanInfo.levels are accepted
 
-    def __init__(self, input_size, **kwargs):
+    def __init__(self, input_size, scan_info=None, **kwargs):
         self._input_size = input_size
+        self._scan_info = ScanInfo(['']) if scan_info is None else scan_info
         for key, value in {**{k: v.default_value for k, v in self.default_parameters.items()},
                            **kwargs}.items():
             if key in self.default_parameters:
@@ -34,6 +49,28 @@ class OutputMethodBase:
             f'Class {self.__class__.__name__} needs to implement the output() method'
         )
 
+    def output_batch(self, first_sector, sector_size, *results):
+        """Outputs SectorResults of consecutive sectors starting with first_sector,
+           one for each analysis method. Returns False if the pipe was closed, otherwise True"""
+        for sector_number, result in enumerate(zip(*(r.rows() for r in results)), first_sector):
+            if not self.output(sector_number, sector_number * sector_size, *chain.from_iterable(result)):
+                return False
+        return True
+
+    def output_runs(self, sector_numbers, run_length, sector_size, *results):
+        """Outputs SectorResults of the sectors in the sector_numbers array, one for each analysis method.
+           Each of the sectors also stands in for the following run_length - 1 sectors until their
+           own results are output. Returns False if the pipe was closed, otherwise True"""
+        raise NotImplementedError(
+            f'Class {self.__class__.__name__} needs to implement the output_runs() method'
+        )
+
+    def flush(self):
+        """Outputs the results passed so far. Returns False if the pipe was closed, otherwise True"""
+        raise NotImplementedError(
+            f'Class {self.__class__.__name__} needs to implement the flush() method'
+        )
+
     @staticmethod
     def check_args(**kwargs):
         """Return None if args are correct otherwise return error message"""
@@ -50,6 +87,21 @@ class OutputMethodBase:
         )
 
 
+class ShiftedOutput:
+    """Passes the results to the output with the sector numbers counted from first_sector"""
+
+    def __init__(self, output, first_sector):
+        self._output = output
+        self._first_sector = first_sector
+        self.ORDERED = output.ORDERED
+
+    def output_batch(self, first_sector, sector_size, *results):
+        return self._output.output_batch(first_sector - self._first_sector, sector_size, *results)
+
+    def error(self, message):
+        return self._output.error(message)
+
+
 def print_check_closed_pipe(*args, **kwargs):
     """Returns False on BrokenPipeError,
        otherwise lets error through or returns True"""
@@ -1,12 +1,18 @@
 # SPDX-License-Identifier: MIT
 
 from image_output import HilbertCurve, SweepingBlocks, Sweeping
+from tile_output import DeepZoomHilbertCurve, DeepZoomSweepingBlocks, DeepZoomSweeping
 from text_output import CSVOutput, SampleOutput
+from binary_output import BinaryOutput
 
 output_methods: dict = {
     'sample-output': SampleOutput,
     'csv': CSVOutput,
+    'binary': BinaryOutput,
     'sweeping': Sweeping,
     'sweeping-blocks': SweepingBlocks,
-    'hilbert-curve': HilbertCurve
+    'hilbert-curve': HilbertCurve,
+    'deep-zoom-sweeping': DeepZoomSweeping,
+    'deep-zoom-sweeping-blocks': DeepZoomSweepingBlocks,
+    'deep-zoom-hilbert-curve': DeepZoomHilbertCurve
 }
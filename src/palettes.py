@@ -1,6 +1,10 @@
 # SPDX-License-Identifier: MIT
 
+from functools import lru_cache
 from analysis import ResultFlag
+from histograms import np
+
+_PROBES = 4097  # randomness values probed for color changes, closer than the narrowest color of 8 bit channels
 
 
 def _linear_rgb_color_interpolation(color1, color2, val, min_val=0, max_val=1):
@@ -92,6 +96,58 @@ class AsalorPalette:
         raise ValueError(f'invalid result_flag value: \'{result_flag}\'')
 
 
+class PaletteTable:
+    """The colors of the byte patterns, the result flags and the randomness levels of a palette"""
+
+    def __init__(self, colors, thresholds):
+        self.colors = colors  # (entries, 4) array of RGBA colors
+        self.thresholds = thresholds
+
+    def indexes(self, flag, pattern, randomness):
+        """Returns the index of the color of each sector of the result arrays"""
+        levels = 256 + len(ResultFlag) + np.searchsorted(self.thresholds, randomness, side='right')
+        return np.where(flag == ResultFlag.SINGLE_BYTE_PATTERN, pattern,
+                        np.where(flag == ResultFlag.NONE, levels, 256 + flag))
+
+
+def _rgba(color):
+    return (*color, 255) if len(color) == 3 else color
+
+
+def _randomness_thresholds(color_at):
+    """Returns the smallest randomness values from 0 to 1 at which the color changes"""
+    probes = np.linspace(0, 1, _PROBES).tolist()
+    colors = [color_at(p) for p in probes]
+    thresholds = []
+    for low, high, high_color in zip(probes, probes[1:], colors[1:]):
+        while color_at(low) != high_color:  # there may be several changes between two probes
+            low_color, upper = color_at(low), high
+            while True:
+                middle = (low + upper) / 2
+                if middle in (low, upper):
+                    break
+                if color_at(middle) == low_color:
+                    low = middle
+                else:
+                    upper = middle
+            thresholds.append(upper)
+            low = upper
+    return thresholds
+
+
+@lru_cache(maxsize=None)
+def compile_palette(palette):
+    """Returns the PaletteTable of the palette"""
+    color_at = lambda randomness: palette.get(0, 0, randomness, ResultFlag.NONE, None)
+    thresholds = _randomness_thresholds(color_at)
+    colors = ([palette.get(0, 0, 0.0, ResultFlag.SINGLE_BYTE_PATTERN, pattern) for pattern in range(256)]
+              + [color_at(0.0) if flag in (ResultFlag.NONE, ResultFlag.SINGLE_BYTE_PATTERN)
+                 else palette.get(0, 0, 0.0, flag, None) for flag in ResultFlag]
+              + [color_at(0.0)] + [color_at(threshold) for threshold in thresholds])
+    return PaletteTable(np.array([_rgba(color) for color in colors], dtype=np.uint8),
+                        np.array(thresholds, dtype=np.float64))
+
+
 palettes = {
     'asalor': AsalorPalette,
     'sample': _get_simple_palette(
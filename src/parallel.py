@@ -0,0 +1,74 @@
+# SPDX-License-Identifier: MIT
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from histograms import np
+from reader import open_image
+
+_worker_file = None
+_worker_image = None
+_worker_analysis = None
+
+
+def _init_worker(path, decompress, analysis_method):
+    global _worker_file, _worker_image, _worker_analysis
+    # the file stays open as long as the worker, which exits with the pool
+    _worker_file = open(path, 'rb')
+    _worker_image = open_image(_worker_file, decompress)
+    _worker_image.advise_sequential()
+    _worker_analysis = analysis_method
+
+
+def _analyze(sector_number, count):
+    """Analyzes sectors of the worker's own mapping of the image,
+    so that only the compact result arrays pass between the processes"""
+    sector_size = _worker_analysis.sector_size
+    with _worker_image.read(sector_number * sector_size, count * sector_size) as block:
+        results = _worker_analysis.calc_batch(block)
+    _worker_image.release(sector_number * sector_size, count * sector_size)
+    return sector_number, results
+
+
+def _hole_results(analysis_method, sector_number, count):
+    return sector_number, analysis_method.uniform_results(np.zeros(count, dtype=np.uint8))
+
+
+def _in_order(executor, analysis_method, batches, window):
+    pending = deque()
+    for sector_number, count, hole in batches:
+        pending.append((sector_number, count, None if hole else executor.submit(_analyze, sector_number, count)))
+        while len(pending) > window or (pending and pending[0][2] is None):
+            sector_number, count, future = pending.popleft()
+            yield _hole_results(analysis_method, sector_number, count) if future is None else future.result()
+    for sector_number, count, future in pending:
+        yield _hole_results(analysis_method, sector_number, count) if future is None else future.result()
+
+
+def _as_completed(executor, analysis_method, batches, window):
+    running = set()
+    for sector_number, count, hole in batches:
+        if hole:
+            yield _hole_results(analysis_method, sector_number, count)
+            continue
+        running.add(executor.submit(_analyze, sector_number, count))
+        if len(running) >= window:
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    for future in wait(running).done:
+        yield future.result()
+
+
+def iterate_parallel(path, sector_size, analysis_method, output, batches, jobs, decompress=True):
+    """Analyzes the (first_sector, sector_count, is_hole) batches of the image at path
+    (opened by open_image() with the decompress argument) in a pool of jobs processes.
+    The results are passed to the output in sector order, unless the output method accepts them in any order.
+    Returns False if the pipe was closed, otherwise True"""
+    with ProcessPoolExecutor(jobs, initializer=_init_worker,
+                             initargs=(path, decompress, analysis_method)) as executor:
+        results = (_in_order if output.ORDERED else _as_completed)(executor, analysis_method, batches, jobs * 4)
+        for sector_number, batch_results in results:
+            if not output.output_batch(sector_number, sector_size, *batch_results):
+                executor.shutdown(wait=False, cancel_futures=True)
+                return False
+    return True
@@ -0,0 +1,139 @@
+# SPDX-License-Identifier: MIT
+
+import struct
+import zlib
+from dataclasses import dataclass
+from uuid import UUID
+
+MBR_SECTOR_SIZE = 512
+_MBR_SIGNATURE = b'\x55\xaa'
+_MBR_ENTRY = struct.Struct('<B3sB3sII')
+_MBR_ENTRIES_OFFSET = 446
+_PROTECTIVE_MBR_TYPE = 0xee
+_EXTENDED_TYPES = (0x05, 0x0f, 0x85)
+_MAX_LOGICAL_PARTITIONS = 128  # guards against loops of the extended boot records
+_GPT_SIGNATURE = b'EFI PART'
+_GPT_HEADER = struct.Struct('<8sIIIIQQQQ16sQIII')
+_GPT_ENTRY = struct.Struct('<16s16sQQQ72s')
+_GPT_LOGICAL_BLOCK_SIZES = (512, 4096)
+_GPT_MAX_ENTRIES_SIZE = 1 << 20
+
+
+@dataclass
+class Partition:
+    number: int
+    start: int  # byte offset of the partition on the disk
+    end: int
+    type: str  # hexadecimal MBR partition type or GPT partition type GUID
+    name: str = ''
+
+    def sectors(self, sector_size):
+        """Returns the first and the end sector of the whole sectors within the partition"""
+        return -(-self.start // sector_size), self.end // sector_size
+
+
+def _read(image, offset, length):
+    with image.read(offset, length) as view:
+        return bytes(view)
+
+
+def _mbr_entries(sector):
+    for i in range(4):
+        _, _, partition_type, _, first_lba, sector_count = _MBR_ENTRY.unpack_from(sector, _MBR_ENTRIES_OFFSET + 16 * i)
+        if partition_type != 0 and sector_count != 0:
+            yield i + 1, partition_type, first_lba, sector_count
+
+
+def _logical_partitions(image, extended_lba):
+    """Yields the logical partitions of the chain of extended boot records in the extended partition"""
+    ebr_lba = extended_lba
+    for number in range(5, 5 + _MAX_LOGICAL_PARTITIONS):
+        sector = _read(image, ebr_lba * MBR_SECTOR_SIZE, MBR_SECTOR_SIZE)
+        if len(sector) < MBR_SECTOR_SIZE or sector[510:] != _MBR_SIGNATURE:
+            raise ValueError(f'invalid extended boot record at sector {ebr_lba}')
+        entries = list(_mbr_entries(sector))
+        next_lba = None
+        for index, partition_type, first_lba, sector_count in entries:
+            if partition_type in _EXTENDED_TYPES:
+                next_lba = extended_lba + first_lba
+            elif index == 1:
+                start = (ebr_lba + first_lba) * MBR_SECTOR_SIZE
+                yield Partition(number, start, start + sector_count * MBR_SECTOR_SIZE, f'0x{partition_type:02x}')
+        if next_lba is None:
+            return
+        if next_lba <= ebr_lba:
+            raise ValueError('the extended boot records form a loop')
+        ebr_lba = next_lba
+
+
+def _mbr_partitions(image, sector):
+    partitions = []
+    for number, partition_type, first_lba, sector_count in _mbr_entries(sector):
+        start = first_lba * MBR_SECTOR_SIZE
+        if partition_type in _EXTENDED_TYPES:
+            partitions.extend(_logical_partitions(image, first_lba))
+        else:
+            partitions.append(Partition(number, start, start + sector_count * MBR_SECTOR_SIZE,
+                                        f'0x{partition_type:02x}'))
+    return partitions
+
+
+def _gpt_header(image, lba, block_size):
+    """Returns the fields of the GPT header at the logical block, or None if it is not valid"""
+    header = _read(image, lba * block_size, block_size)
+    if len(header) < _GPT_HEADER.size or header[:8] != _GPT_SIGNATURE:
+        return None
+    fields = _GPT_HEADER.unpack_from(header)
+    header_size, header_crc = fields[2], fields[3]
+    if not _GPT_HEADER.size <= header_size <= block_size:
+        return None
+    if zlib.crc32(header[:16] + bytes(4) + header[20:header_size]) != header_crc:
+        return None
+    return fields
+
+
+def _gpt_partitions(image, fields, block_size):
+    *_, entries_lba, entry_count, entry_size, entries_crc = fields
+    if entry_size < _GPT_ENTRY.size or entry_count * entry_size > _GPT_MAX_ENTRIES_SIZE:
+        raise ValueError('the GPT partition entries are not supported')
+    entries = _read(image, entries_lba * block_size, entry_count * entry_size)
+    if zlib.crc32(entries) != entries_crc:
+        raise ValueError('the GPT partition entries are corrupted')
+
+    partitions = []
+    for i in range(entry_count):
+        type_guid, _, first_lba, last_lba, _, name = _GPT_ENTRY.unpack_from(entries, i * entry_size)
+        if type_guid == bytes(16):
+            continue
+        partitions.append(Partition(i + 1, first_lba * block_size, (last_lba + 1) * block_size,
+                                    str(UUID(bytes_le=type_guid)),
+                                    name.decode('utf-16-le', errors='replace').split('\0')[0]))
+    return partitions
+
+
+def read_partitions(image):
+    """Returns the partitions of the GPT or the MBR partition table of the image, ordered by their number.
+    The backup GPT header is only used if the primary one is corrupted and the image is seekable.
+    The byte ranges are read in increasing order, so that the partitions of streams can be read as well."""
+    mbr = _read(image, 0, MBR_SECTOR_SIZE)
+    if len(mbr) < MBR_SECTOR_SIZE or mbr[510:] != _MBR_SIGNATURE:
+        raise ValueError('the image has no MBR or GPT partition table')
+    if all(partition_type != _PROTECTIVE_MBR_TYPE for _, partition_type, _, _ in _mbr_entries(mbr)):
+        return _mbr_partitions(image, mbr)
+
+    for block_size in _GPT_LOGICAL_BLOCK_SIZES:
+        fields = _gpt_header(image, 1, block_size)
+        if fields is None and image.seekable and image.size is not None:
+            fields = _gpt_header(image, image.size // block_size - 1, block_size)
+        if fields is not None:
+            return _gpt_partitions(image, fields, block_size)
+    raise ValueError('the GPT header is missing or corrupted')
+
+
+def format_partitions(partitions):
+    """Formats the partitions as a table of their numbers, byte ranges, sizes, types and names"""
+    lines = [f'{"number":>6} {"start":>14} {"end":>14} {"size [MiB]":>12}  {"type":<36}  name']
+    for p in partitions:
+        lines.append(f'{p.number:>6} {p.start:>14} {p.end:>14} {(p.end - p.start) / (1 << 20):>12.1f}'
+                     f'  {p.type:<36}  {p.name}')
+    return '\n'.join(lines)
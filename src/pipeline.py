@@ -0,0 +1,212 @@
+# SPDX-License-Identifier: MIT
+
+from queue import Queue, Empty, Full
+from threading import Thread, Event
+from time import perf_counter
+from histograms import np
+from reader import StreamImage, extent_batches
+
+_END = None  # passed through the queues after the last batch
+
+
+class StageTimes:
+    """Time a thread of a stage of the pipeline spent working and waiting for the other stages"""
+
+    def __init__(self, name):
+        self.name = name
+        self.busy = 0.0
+        self.idle = 0.0
+        self.batches = 0
+        self._start = None
+
+    def start(self):
+        self._start = perf_counter()
+
+    def stop(self):
+        self.busy += perf_counter() - self._start - self.idle
+
+    def get(self, queue, stop):
+        """Returns the next item of the queue, or _END if the pipeline was stopped first"""
+        start = perf_counter()
+        try:
+            while not stop.is_set():
+                try:
+                    return queue.get(timeout=0.1)
+                except Empty:
+                    pass
+            return _END
+        finally:
+            self.idle += perf_counter() - start
+
+    def put(self, queue, item, stop):
+        """Puts the item to the queue, unless the pipeline was stopped first. Returns False if it was"""
+        start = perf_counter()
+        try:
+            while not stop.is_set():
+                try:
+                    queue.put(item, timeout=0.1)
+                    return True
+                except Full:
+                    pass
+            return False
+        finally:
+            self.idle += perf_counter() - start
+
+
+def format_stage_times(stages):
+    """Formats the busy and idle times of the stages, summing those of the threads of the same stage"""
+    names = list(dict.fromkeys(stage.name for stage in stages))
+    lines = [f'{"stage":<12} {"busy [s]":>10} {"idle [s]":>10} {"batches":>8}']
+    for name in names:
+        threads = [stage for stage in stages if stage.name == name]
+        label = name if len(threads) == 1 else f'{name} x{len(threads)}'
+        lines.append(f'{label:<12} {sum(t.busy for t in threads):>10.2f} {sum(t.idle for t in threads):>10.2f}'
+                     f' {sum(t.batches for t in threads):>8}')
+    return '\n'.join(lines)
+
+
+class Pipeline:
+    """Scans the image in three stages connected by bounded queues, a thread reading the batches
+    ahead, analysis_threads threads analyzing them and the calling thread passing the results
+    to the output, so that reading, analysis and the output overlap.
+    The results are passed to the output in sector order, unless the output method
+    accepts them in any order."""
+
+    def __init__(self, image, sector_size, analysis_method, output, batch_sectors,
+                 read_queue=4, output_queue=4, analysis_threads=1):
+        self._image = image
+        self._sector_size = sector_size
+        self._analysis_method = analysis_method
+        self._output = output
+        self._batch_sectors = batch_sectors
+        self._blocks = Queue(read_queue)
+        self._results = Queue(output_queue)
+        self._analysis_threads = analysis_threads
+        self._stop = Event()
+        self.read_times = StageTimes('read')
+        self.analysis_times = [StageTimes('analyze') for _ in range(analysis_threads)]
+        self.output_times = StageTimes('output')
+
+    @property
+    def stage_times(self):
+        return [self.read_times, *self.analysis_times, self.output_times]
+
+    def _batches(self, extents, first_sector):
+        """Yields (sector_number, count, is_hole, block) batches, the blocks stay valid
+        while the following batches are read"""
+        batch_size = self._batch_sectors * self._sector_size
+        if extents is None:
+            end_sector = None if self._image.size is None else self._image.size // self._sector_size
+            extents = [(first_sector, end_sector, False)]
+        if isinstance(self._image, StreamImage):
+            for first, end, _ in extents:
+                length = None if end is None else (end - first) * self._sector_size
+                for offset, block in self._image.chunks(first * self._sector_size, batch_size, length=length):
+                    whole_sectors = len(block) - len(block) % self._sector_size
+                    if whole_sectors > 0:
+                        yield offset // self._sector_size, whole_sectors // self._sector_size, False, \
+                            bytes(block[:whole_sectors])
+                        self._image.release(offset, whole_sectors)
+            return
+
+        for sector_number, count, hole in extent_batches(extents, self._batch_sectors):
+            if hole:
+                yield sector_number, count, True, None
+                continue
+            offset = sector_number * self._sector_size
+            self._image.prefetch(offset, count * self._sector_size)
+            if self._image.stable_views:
+                yield sector_number, count, False, self._image.read(offset, count * self._sector_size)
+            else:  # the buffer of the image is reused by the next read
+                with self._image.read(offset, count * self._sector_size) as view:
+                    block = bytes(view)
+                self._image.release(offset, count * self._sector_size)
+                yield sector_number, count, False, block
+
+    def _read(self, extents, first_sector):
+        self.read_times.start()
+        try:
+            for index, batch in enumerate(self._batches(extents, first_sector)):
+                if not self.read_times.put(self._blocks, (index, *batch), self._stop):
+                    return
+                self.read_times.batches += 1
+            for _ in range(self._analysis_threads):
+                self.read_times.put(self._blocks, _END, self._stop)
+        except BaseException as e:
+            self.read_times.put(self._blocks, e, self._stop)
+        finally:
+            self.read_times.stop()
+
+    def _analyze(self, times):
+        times.start()
+        try:
+            while True:
+                item = times.get(self._blocks, self._stop)
+                if item is _END or isinstance(item, BaseException):
+                    times.put(self._results, item, self._stop)
+                    return
+                index, sector_number, count, hole, block = item
+                if hole:
+                    results = self._analysis_method.uniform_results(np.zeros(count, dtype=np.uint8))
+                else:
+                    results = self._analysis_method.calc_batch(block)
+                    if self._image.stable_views:
+                        block.release()
+                        self._image.release(sector_number * self._sector_size, count * self._sector_size)
+                if not times.put(self._results, (index, sector_number, results), self._stop):
+                    return
+                times.batches += 1
+        except BaseException as e:
+            times.put(self._results, e, self._stop)
+        finally:
+            times.stop()
+
+    def run(self, extents=None, first_sector=0):
+        """Returns False if the pipe was closed, otherwise True"""
+        threads = [Thread(target=self._read, args=(extents, first_sector), daemon=True)]
+        threads += [Thread(target=self._analyze, args=(times,), daemon=True) for times in self.analysis_times]
+        for thread in threads:
+            thread.start()
+
+        self.output_times.start()
+        try:
+            pending = {}  # results which cannot be output before those of the preceding batches
+            next_index = 0
+            running = self._analysis_threads
+            while running > 0:
+                item = self.output_times.get(self._results, self._stop)
+                if item is _END:
+                    running -= 1
+                    continue
+                if isinstance(item, BaseException):
+                    raise item
+                pending[item[0]] = item
+                while pending:
+                    if self._output.ORDERED:
+                        if next_index not in pending:
+                            break
+                        _, sector_number, results = pending.pop(next_index)
+                    else:
+                        _, sector_number, results = pending.popitem()[1]
+                    next_index += 1
+                    if not self._output.output_batch(sector_number, self._sector_size, *results):
+                        return False
+                    self.output_times.batches += 1
+            return True
+        finally:
+            self._stop.set()
+            self.output_times.stop()
+            for thread in threads:
+                thread.join()
+            self._discard_blocks()
+
+    def _discard_blocks(self):
+        """Releases the views of the batches left in the queue when the pipeline was stopped early,
+        so that the image can be closed"""
+        while True:
+            try:
+                item = self._blocks.get_nowait()
+            except Empty:
+                return
+            if isinstance(item, tuple) and isinstance(item[-1], memoryview):
+                item[-1].release()
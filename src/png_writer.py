@@ -0,0 +1,59 @@
+# SPDX-License-Identifier: MIT
+
+import struct
+import zlib
+from histograms import np
+
+_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+_COLOR_TYPES = {'RGB': 2, 'RGBA': 6}
+_FILTER_UP = 2
+_IDAT_SIZE = 1 << 16  # compressed bytes written in a chunk at once
+
+
+class PNGWriter:
+    """Writes a PNG image to the file row by row"""
+
+    def __init__(self, f, width, height, mode):
+        self._file = f
+        self._width = width
+        self._height = height
+        self._compressor = zlib.compressobj(6)
+        self._previous = np.zeros((1, width, len(mode)), dtype=np.uint8)
+        self._pending = []
+        self._pending_size = 0
+        self.rows_written = 0
+        self._file.write(_SIGNATURE)
+        self._write_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, _COLOR_TYPES[mode], 0, 0, 0))
+
+    def _write_chunk(self, chunk_type, data):
+        self._file.write(struct.pack('>I', len(data)) + chunk_type + data
+                         + struct.pack('>I', zlib.crc32(data, zlib.crc32(chunk_type))))
+
+    def _write_data(self, data, flush=False):
+        if data:
+            self._pending.append(data)
+            self._pending_size += len(data)
+        if self._pending_size >= _IDAT_SIZE or (flush and self._pending_size > 0):
+            self._write_chunk(b'IDAT', b''.join(self._pending))
+            self._pending = []
+            self._pending_size = 0
+            self._file.flush()
+
+    def write_rows(self, rows):
+        """Writes the (rows, width, channels) array of the next rows of the image"""
+        if self.rows_written + len(rows) > self._height:
+            raise ValueError('more rows than the height of the image written')
+        filtered = np.diff(np.concatenate([self._previous, rows]), axis=0)  # modulo 256 as uint8
+        lines = np.empty((len(rows), 1 + filtered[0].size), dtype=np.uint8)
+        lines[:, 0] = _FILTER_UP
+        lines[:, 1:] = filtered.reshape(len(rows), -1)
+        self._write_data(self._compressor.compress(lines.tobytes()))
+        self._previous = rows[-1:].copy()
+        self.rows_written += len(rows)
+
+    def close(self):
+        if self.rows_written != self._height:
+            raise ValueError(f'{self.rows_written} rows of the image of the height {self._height} written')
+        self._write_data(self._compressor.flush(), flush=True)
+        self._write_chunk(b'IEND', b'')
+        self._file.flush()
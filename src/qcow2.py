@@ -0,0 +1,149 @@
+# SPDX-License-Identifier: MIT
+
+import os
+import struct
+import zlib
+from histograms import np
+
+MAGIC = b'QFI\xfb'
+_HEADER = struct.Struct('>4sIQIIQIIQQIIQ')  # the fields common to versions 2 and 3
+_V3_HEADER = struct.Struct('>QQQII')
+_SUPPORTED_INCOMPATIBLE_FEATURES = 1  # only the dirty bit, the refcounts are not used
+_COMPRESSION_TYPE_OFFSET = 104
+_OFFSET_MASK = 0x00fffffffffffe00
+_COMPRESSED = 1 << 62
+_ZERO = 1
+_L2_CACHE_SIZE = 16  # number of L2 tables kept in memory
+
+
+def is_qcow2(f):
+    return hasattr(f, 'peek') and f.peek(4)[:4] == MAGIC
+
+
+class Qcow2File:
+    """Guest disk of a qcow2 image, read by walking its L1 and L2 tables.
+    Unallocated and zero clusters are reported as holes and read as zeros without touching the file,
+    clusters at consecutive host offsets are read at once and compressed clusters are inflated.
+    Images with a backing file, encryption, an external data file, extended L2 entries
+    or zstd compression are not supported."""
+
+    def __init__(self, f):
+        self.fd = f.fileno()
+        header = os.pread(self.fd, 512, 0)
+        if len(header) < _HEADER.size:
+            raise ValueError('the qcow2 header is truncated')
+        (_, version, backing_file_offset, _, self._cluster_bits, self.size, crypt_method,
+         l1_size, l1_table_offset, _, _, _, _) = _HEADER.unpack_from(header)
+        if version not in (2, 3):
+            raise ValueError(f'qcow2 version {version} is not supported')
+        if backing_file_offset != 0:
+            raise ValueError('qcow2 images with a backing file are not supported')
+        if crypt_method != 0:
+            raise ValueError('encrypted qcow2 images are not supported')
+        if version == 3:
+            incompatible_features, _, _, _, header_length = _V3_HEADER.unpack_from(header, _HEADER.size)
+            if incompatible_features & ~_SUPPORTED_INCOMPATIBLE_FEATURES:
+                raise ValueError(f'the qcow2 image uses unsupported features (0x{incompatible_features:x})')
+            if header_length > _COMPRESSION_TYPE_OFFSET and header[_COMPRESSION_TYPE_OFFSET] != 0:
+                raise ValueError('only zlib compressed qcow2 images are supported')
+
+        self._cluster_size = 1 << self._cluster_bits
+        self._l2_bits = self._cluster_bits - 3
+        self._l1 = np.frombuffer(os.pread(self.fd, l1_size * 8, l1_table_offset), dtype='>u8')
+        self._l2_cache = {}
+        self._compressed_cluster = (None, None)  # the last inflated cluster and its descriptor
+        self.read_ranges = []  # the (offset, length) host ranges read, the user of the file may clear it
+
+    def _l2_table(self, l1_index):
+        """Returns the L2 table of the L1 entry, or None if the table is not allocated"""
+        if l1_index >= len(self._l1):
+            return None
+        table_offset = int(self._l1[l1_index]) & _OFFSET_MASK
+        if table_offset == 0:
+            return None
+        table = self._l2_cache.pop(table_offset, None)
+        if table is None:
+            table = np.frombuffer(os.pread(self.fd, self._cluster_size, table_offset), dtype='>u8')
+            if len(self._l2_cache) >= _L2_CACHE_SIZE:
+                del self._l2_cache[next(iter(self._l2_cache))]
+        self._l2_cache[table_offset] = table  # the most recently used tables are the last ones
+        return table
+
+    def _cluster_entry(self, cluster):
+        table = self._l2_table(cluster >> self._l2_bits)
+        return 0 if table is None else int(table[cluster & ((1 << self._l2_bits) - 1)])
+
+    def _zero_clusters(self, table):
+        standard = (table & _COMPRESSED) == 0
+        return standard & (((table & _ZERO) != 0) | ((table & _OFFSET_MASK) == 0))
+
+    def holes(self):
+        """Yields the (start, end) guest byte ranges of the unallocated and zero clusters"""
+        clusters = -(-self.size // self._cluster_size)
+        l2_entries = 1 << self._l2_bits
+        hole_start = None
+        for l1_index in range(-(-clusters // l2_entries)):
+            first_cluster = l1_index * l2_entries
+            count = min(l2_entries, clusters - first_cluster)
+            table = self._l2_table(l1_index)
+            zero = np.ones(count, dtype=bool) if table is None else self._zero_clusters(table[:count])
+            # the clusters at which the runs of zero and data clusters change
+            changes = np.flatnonzero(np.diff(zero.view(np.int8), prepend=np.int8(hole_start is not None)))
+            for change in changes.tolist():
+                position = (first_cluster + change) << self._cluster_bits
+                if zero[change]:
+                    hole_start = position
+                else:
+                    yield hole_start, position
+                    hole_start = None
+        if hole_start is not None:
+            yield hole_start, self.size
+
+    def _read_compressed(self, entry):
+        if self._compressed_cluster[0] == entry:
+            return self._compressed_cluster[1]
+        offset_bits = 62 - (self._cluster_bits - 8)
+        host_offset = entry & ((1 << offset_bits) - 1)
+        sectors = ((entry & (_COMPRESSED - 1)) >> offset_bits) + 1  # the additional 512 byte sectors
+        data = os.pread(self.fd, sectors * 512 - host_offset % 512, host_offset)
+        cluster = zlib.decompressobj(-15).decompress(data, self._cluster_size)
+        cluster += bytes(self._cluster_size - len(cluster))
+        self._compressed_cluster = (entry, cluster)
+        self.read_ranges.append((host_offset, len(data)))
+        return cluster
+
+    def read_into(self, view, offset):
+        """Fills the view with the guest bytes starting at offset (zeros past the end of the disk)"""
+        run_start = run_host = None  # the part of the view read from consecutive host clusters
+
+        def read_run(end):
+            if run_start is not None:
+                self._read_host(view[run_start:end], run_host)
+
+        position = 0
+        while position < len(view):
+            guest = offset + position
+            in_cluster = guest & (self._cluster_size - 1)
+            length = min(self._cluster_size - in_cluster, len(view) - position)
+            entry = self._cluster_entry(guest >> self._cluster_bits) if guest < self.size else 0
+            host = entry & _OFFSET_MASK
+            if not entry & (_COMPRESSED | _ZERO) and host != 0:
+                host += in_cluster
+                if run_start is None or run_host + (position - run_start) != host:
+                    read_run(position)
+                    run_start, run_host = position, host
+            else:
+                read_run(position)
+                run_start = None
+                if entry & _COMPRESSED:
+                    view[position:position + length] = \
+                        self._read_compressed(entry)[in_cluster:in_cluster + length]
+                else:
+                    view[position:position + length] = bytes(length)
+            position += length
+        read_run(position)
+
+    def _read_host(self, view, host_offset):
+        if os.preadv(self.fd, [view], host_offset) != len(view):
+            raise ValueError('the qcow2 image is truncated')
+        self.read_ranges.append((host_offset, len(view)))
@@ -0,0 +1,399 @@
+# SPDX-License-Identifier: MIT
+
+import os
+import mmap
+import lzma
+from errno import ENXIO
+from queue import Queue
+from threading import Thread
+from histograms import np
+from compressed import decompressor, xz_uncompressed_size
+from qcow2 import Qcow2File, is_qcow2
+
+STREAM_BUFFER_SIZE = 1 << 20  # initial size of the buffer the images which cannot be mapped are read into
+
+
+def _page_range(offset, length):
+    """Returns the start and the length of the whole pages within the byte range"""
+    start = -(-offset // mmap.PAGESIZE) * mmap.PAGESIZE
+    end = (offset + length) // mmap.PAGESIZE * mmap.PAGESIZE
+    return start, max(end - start, 0)
+
+
+def _fadvise(fd, offset, length, advice_name):
+    if hasattr(os, 'posix_fadvise'):
+        try:
+            os.posix_fadvise(fd, offset, length, getattr(os, advice_name))
+        except OSError:
+            pass  # e.g. ESPIPE, the advice is only a hint
+
+
+class MappedImage:
+    """Disk image mapped to memory, which hands out the requested byte ranges as memoryviews
+    of the mapping without copying them. Consumed ranges can be released, dropping their pages
+    both from the mapping and from the page cache, so that scanning a large image neither
+    grows the memory of the process nor evicts the page cache of the rest of the system."""
+
+    def __init__(self, f):
+        self.fd = f.fileno()
+        self._mmap = mmap.mmap(self.fd, length=0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+        self.size = len(self._mmap)
+        self.seekable = True
+        self.stable_views = True  # the memoryviews stay valid until the image is closed
+
+    def _madvise(self, advice_name, offset=0, length=None):
+        if hasattr(self._mmap, 'madvise') and hasattr(mmap, advice_name):
+            if length is None:
+                self._mmap.madvise(getattr(mmap, advice_name))
+            elif length > 0:
+                self._mmap.madvise(getattr(mmap, advice_name), offset, length)
+
+    def advise_sequential(self):
+        self._madvise('MADV_SEQUENTIAL')
+        _fadvise(self.fd, 0, 0, 'POSIX_FADV_SEQUENTIAL')
+
+    def advise_random(self):
+        self._madvise('MADV_RANDOM')
+        _fadvise(self.fd, 0, 0, 'POSIX_FADV_RANDOM')
+
+    def prefetch(self, offset, length):
+        start = offset - offset % mmap.PAGESIZE
+        self._madvise('MADV_WILLNEED', start, min(offset + length, self.size) - start)
+
+    def extents(self, sector_size):
+        """Returns the (first_sector, end_sector, is_hole) runs of the image"""
+        return sector_extents(self.fd, self.size, sector_size)
+
+    def read(self, offset, length):
+        """Returns a memoryview of the byte range, which needs to be released before the image is closed"""
+        return self._view[offset:offset + length]
+
+    def release(self, offset, length):
+        """Drops the pages of the consumed byte range"""
+        start, page_length = _page_range(offset, length)
+        self._madvise('MADV_DONTNEED', start, page_length)
+        _fadvise(self.fd, start, page_length, 'POSIX_FADV_DONTNEED')
+
+    def gather(self, sector_numbers, sector_size):
+        """Returns a (sectors, sector_size) array with copies of the given whole sectors"""
+        sectors = np.frombuffer(self._view, dtype=np.uint8,
+                                count=self.size // sector_size * sector_size).reshape(-1, sector_size)
+        try:
+            return sectors[sector_numbers]
+        finally:
+            del sectors  # the mapping cannot be closed while an array refers to it
+
+    def close(self):
+        self._view.release()
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class StreamImage:
+    """Disk image which cannot be mapped to memory (e.g. a pipe, a compressed image or some block devices),
+    read into reusable buffers. The byte ranges of a stream which is not seekable need to be requested
+    in increasing order, the memoryview of a range is only valid until the next one is read.
+    The size is None if it cannot be determined without reading the whole stream,
+    in which case it is set once the end of the stream is reached."""
+
+    def __init__(self, f, size=None, compressed=False):
+        self._file = f
+        # the offsets of a compressed image do not correspond to those of the file
+        self.fd = None if compressed else f.fileno()
+        self.seekable = not compressed and f.seekable()
+        self.stable_views = False
+        self.size = size
+        if self.size is None and self.seekable:
+            self.size = f.seek(0, os.SEEK_END)  # also the size of block devices, unlike fstat
+            f.seek(0)
+        self._position = 0
+        self._buffer = bytearray(STREAM_BUFFER_SIZE)
+
+    def _fadvise(self, offset, length, advice_name):
+        if self.fd is not None:
+            _fadvise(self.fd, offset, length, advice_name)
+
+    def advise_sequential(self):
+        self._fadvise(0, 0, 'POSIX_FADV_SEQUENTIAL')
+
+    def advise_random(self):
+        self._fadvise(0, 0, 'POSIX_FADV_RANDOM')
+
+    def prefetch(self, offset, length):
+        self._fadvise(offset, length, 'POSIX_FADV_WILLNEED')
+
+    def extents(self, sector_size):
+        if self.size is None:
+            return None
+        return [(0, self.size // sector_size, False)]
+
+    def _skip_to(self, offset):
+        if self.seekable:
+            self._file.seek(offset)
+        elif offset < self._position:
+            raise ValueError('the byte ranges of a stream need to be read in increasing order')
+        else:
+            while self._position < offset:
+                if not self._readinto(memoryview(self._buffer)[:offset - self._position]):
+                    break
+        self._position = offset
+
+    def _readinto(self, view):
+        """Fills the view, unless the stream ends first. Returns the number of bytes read"""
+        filled = 0
+        while filled < len(view):
+            count = self._file.readinto(view[filled:])
+            if not count:
+                self.size = self._position + filled
+                break
+            filled += count
+        self._position += filled
+        return filled
+
+    def read(self, offset, length):
+        self._skip_to(offset)
+        if len(self._buffer) < length:
+            self._buffer = bytearray(length)
+        with memoryview(self._buffer)[:length] as view:
+            count = self._readinto(view)
+        return memoryview(self._buffer)[:count]
+
+    def chunks(self, offset, chunk_size, depth=2, length=None):
+        """Yields (offset, memoryview) chunks of chunk_size bytes (except the last one) from offset
+        to the end of the stream, or to offset + length. While a chunk is analyzed, a thread reads
+        the following ones into the other depth - 1 buffers. The memoryview is only valid
+        until the next chunk is requested."""
+        self._skip_to(offset)
+        free = Queue()
+        filled = Queue()
+        for _ in range(depth):
+            free.put(bytearray(chunk_size))
+
+        def read_chunks():
+            try:
+                while True:
+                    buffer = free.get()
+                    if buffer is None:  # the chunks are not needed anymore
+                        return
+                    position = self._position
+                    size = chunk_size if length is None else min(chunk_size, offset + length - position)
+                    with memoryview(buffer)[:size] as view:
+                        count = self._readinto(view)
+                    filled.put((position, buffer, count))
+                    if count < chunk_size:
+                        return
+            except BaseException as e:
+                filled.put(e)
+
+        Thread(target=read_chunks, daemon=True).start()
+        try:
+            while True:
+                item = filled.get()
+                if isinstance(item, BaseException):
+                    raise item
+                position, buffer, count = item
+                if count > 0:
+                    with memoryview(buffer)[:count] as view:
+                        yield position, view
+                if count < chunk_size:
+                    return
+                free.put(buffer)
+        finally:
+            free.put(None)
+
+    def release(self, offset, length):
+        self._fadvise(offset, length, 'POSIX_FADV_DONTNEED')
+
+    def gather(self, sector_numbers, sector_size):
+        if not self.seekable:
+            raise ValueError('sectors of a stream cannot be read out of order')
+        sectors = np.empty((len(sector_numbers), sector_size), dtype=np.uint8)
+        for row, sector_number in zip(sectors, sector_numbers.tolist()):
+            os.preadv(self.fd, [row], sector_number * sector_size)
+        return sectors
+
+    def close(self):
+        if self.fd is None:
+            self._file.close()  # only the decompressing file object
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class Qcow2Image:
+    """Guest disk of a qcow2 image. The unallocated and zero clusters are reported as holes,
+    the rest is read into a reusable buffer. The memoryview of a range is only valid
+    until the next one is read."""
+
+    def __init__(self, f):
+        self._qcow2 = Qcow2File(f)
+        self.fd = self._qcow2.fd
+        self.size = self._qcow2.size
+        self.seekable = True
+        self.stable_views = False
+        self._buffer = bytearray(STREAM_BUFFER_SIZE)
+
+    def advise_sequential(self):
+        pass  # the host clusters are not necessarily in the order of the guest ones
+
+    def advise_random(self):
+        _fadvise(self.fd, 0, 0, 'POSIX_FADV_RANDOM')
+
+    def prefetch(self, offset, length):
+        pass
+
+    def extents(self, sector_size):
+        return hole_extents(self._qcow2.holes(), self.size, sector_size)
+
+    def read(self, offset, length):
+        if len(self._buffer) < length:
+            self._buffer = bytearray(length)
+        with memoryview(self._buffer)[:length] as view:
+            self._qcow2.read_into(view, offset)
+        return memoryview(self._buffer)[:length]
+
+    def release(self, offset, length):
+        """Drops the host ranges read since the last release from the page cache"""
+        for host_offset, host_length in self._qcow2.read_ranges:
+            _fadvise(self.fd, host_offset, host_length, 'POSIX_FADV_DONTNEED')
+        self._qcow2.read_ranges.clear()
+
+    def gather(self, sector_numbers, sector_size):
+        sectors = np.empty((len(sector_numbers), sector_size), dtype=np.uint8)
+        for row, sector_number in zip(sectors, sector_numbers.tolist()):
+            with memoryview(row) as view:
+                self._qcow2.read_into(view, sector_number * sector_size)
+        self._qcow2.read_ranges.clear()
+        return sectors
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def open_image(f, decompress=True):
+    """Maps the disk image to memory if possible, otherwise reads it as a stream.
+    Unless decompress is False, the guest disk of qcow2 images is read and gzip, xz and bzip2
+    compressed images are decompressed."""
+    if decompress and is_qcow2(f):
+        if not f.seekable():
+            raise ValueError('qcow2 images need to be seekable files')
+        return Qcow2Image(f)
+    open_decompressed = decompressor(f) if decompress else None
+    if open_decompressed is not None:
+        size = xz_uncompressed_size(f) if open_decompressed is lzma.open else None
+        return StreamImage(open_decompressed(f), size, compressed=True)
+    try:
+        return MappedImage(f)
+    except (ValueError, OSError):  # e.g. empty files, pipes, block devices reporting no size
+        return StreamImage(f)
+
+
+def holes(fd, size):
+    """Yields the (start, end) byte ranges of the holes of a sparse file.
+    Yields nothing if the platform or the file system cannot report holes."""
+    if not hasattr(os, 'SEEK_HOLE'):
+        return
+    offset = 0
+    try:
+        while offset < size:
+            hole = os.lseek(fd, offset, os.SEEK_HOLE)
+            if hole >= size:
+                return
+            try:
+                offset = os.lseek(fd, hole, os.SEEK_DATA)
+            except OSError as e:
+                if e.errno != ENXIO:
+                    raise
+                offset = size  # the hole reaches the end of the file
+            yield hole, min(offset, size)
+    except OSError:
+        return  # e.g. EINVAL, seeking to holes is not supported
+    finally:
+        os.lseek(fd, 0, os.SEEK_SET)
+
+
+def sector_extents(fd, size, sector_size):
+    """Yields (first_sector, end_sector, is_hole) runs covering all whole sectors of the file.
+    A sector is in a hole only if all of its bytes are."""
+    return hole_extents(holes(fd, size), size, sector_size)
+
+
+def hole_extents(hole_ranges, size, sector_size):
+    """Yields (first_sector, end_sector, is_hole) runs covering all whole sectors of an image of size bytes
+    with the sorted (start, end) byte ranges of holes. A sector is in a hole only if all of its bytes are."""
+    sectors = size // sector_size
+    position = 0
+    for start, end in hole_ranges:
+        first = -(-start // sector_size)
+        last = min(end // sector_size, sectors)
+        if first >= last:
+            continue
+        if first > position:
+            yield position, first, False
+        yield first, last, True
+        position = last
+    if position < sectors:
+        yield position, sectors, False
+
+
+def extent_batches(extents, batch_sectors):
+    """Splits (first_sector, end_sector, is_hole) extents into
+    (first_sector, sector_count, is_hole) batches of at most batch_sectors sectors"""
+    for first_sector, end_sector, hole in extents:
+        for sector_number in range(first_sector, end_sector, batch_sectors):
+            yield sector_number, min(batch_sectors, end_sector - sector_number), hole
+
+
+def align_extents(extents, alignment):
+    """Shrinks the holes of the consecutive (first_sector, end_sector, is_hole) extents to multiples of alignment"""
+    data_start = None  # the start of the sectors which are not in an aligned hole
+    end_sector = None
+    for first_sector, end_sector, hole in extents:
+        if hole:
+            aligned_first = -(-first_sector // alignment) * alignment
+            aligned_end = end_sector // alignment * alignment
+            if aligned_first < aligned_end:
+                if data_start is not None and data_start < aligned_first:
+                    yield data_start, aligned_first, False
+                yield aligned_first, aligned_end, True
+                data_start = aligned_end if aligned_end < end_sector else None
+                continue
+        if data_start is None:
+            data_start = first_sector
+    if data_start is not None and data_start < end_sector:
+        yield data_start, end_sector, False
+
+
+def skip_sectors(extents, first_sector):
+    """Removes the sectors before first_sector from (first_sector, end_sector, is_hole) extents,
+    an end_sector of None stands for the end of a stream of unknown size"""
+    for extent_first, extent_end, hole in extents:
+        if extent_end is None or extent_end > first_sector:
+            yield max(extent_first, first_sector), extent_end, hole
+
+
+def clip_extents(extents, ranges):
+    """Yields the parts of the (first_sector, end_sector, is_hole) extents within the sorted
+    (first_sector, end_sector) ranges, an end_sector of None stands for the end of the image"""
+    extents = list(extents)
+    for range_first, range_end in ranges:
+        for extent_first, extent_end, hole in extents:
+            first = max(extent_first, range_first)
+            end = extent_end if range_end is None else range_end if extent_end is None else min(extent_end, range_end)
+            if end is None or first < end:
+                yield first, end, hole
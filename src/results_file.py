@@ -0,0 +1,141 @@
+# SPDX-License-Identifier: MIT
+
+"""Compact binary format of the results of a scan.
+
+The file starts with a header (see HEADER) followed by the names of the analysis
+methods, each prefixed by its length in one byte, padded to a multiple of 64 bytes.
+The header is followed by three columns per analysis method, each sector_count long:
+randomness as little endian float32 (or float64), result flag as uint8 and pattern as uint8.
+A file with several levels continues with the columns of the sectors of twice the size
+(sector_count // 2 long) and so on, each level l holding the sectors of 2**l times the sector size.
+Sector numbers and offsets are implied by the position in the columns,
+so the whole file can be memory mapped and used without any parsing.
+Only the results of the first complete_sectors sectors are final, the rest
+of the file may not have been written yet (e.g. in a checkpoint)."""
+
+import os
+import struct
+from math import nan, isnan
+from analysis import SectorResults
+from histograms import np
+
+MAGIC = b'EVRSLTS\0'
+VERSION = 1
+# magic, version, header size, sector size, sector count, complete sectors,
+# rand lim, sus rand lim, size of randomness in bytes, number of analysis methods, number of levels
+HEADER = struct.Struct('<8sHIQQQddBHB')
+COMPLETE_SECTORS_OFFSET = struct.calcsize('<8sHIQQ')
+HEADER_ALIGNMENT = 64
+
+
+def _columns(randomness_size):
+    return np.dtype(f'<f{randomness_size}'), np.dtype('u1'), np.dtype('u1')
+
+
+def _column_offsets(header_size, sector_count, randomness_size, method_count, method_index, level=0):
+    columns = _columns(randomness_size)
+    offset = header_size + (sum(sector_count >> lower for lower in range(level)) * method_count
+                            + method_index * (sector_count >> level)) * (randomness_size + 2)
+    sector_count >>= level
+    offsets = []
+    for dtype in columns:
+        offsets.append(offset)
+        offset += sector_count * dtype.itemsize
+    return offsets
+
+
+class ResultsWriter:
+    """Writes results of any sectors in any order to a seekable file"""
+
+    def __init__(self, file, sector_count, sector_size, analysis_names, rand_lim=None, sus_rand_lim=None,
+                 randomness_size=4, complete_sectors=0, levels=1):
+        self._file = file
+        self.sector_count = sector_count
+        self._randomness_size = randomness_size
+        self._method_count = len(analysis_names)
+        self._levels = levels
+        names = b''.join(bytes([len(n)]) + n for n in (name.encode() for name in analysis_names))
+        self._header_size = -(-(HEADER.size + len(names)) // HEADER_ALIGNMENT) * HEADER_ALIGNMENT
+        self._file.seek(0)
+        self._file.write(HEADER.pack(
+            MAGIC, VERSION, self._header_size, sector_size or 0, sector_count, complete_sectors,
+            nan if rand_lim is None else rand_lim,
+            nan if sus_rand_lim is None else sus_rand_lim,
+            randomness_size,
+            len(analysis_names),
+            levels
+        ) + names)
+        # allocate the whole file, the columns are written to their place as the results come
+        self._file.truncate(_column_offsets(self._header_size, sector_count, randomness_size, len(analysis_names),
+                                            0, levels)[0])
+
+    def write(self, first_sector, *results):
+        """Writes the results of each method starting with first_sector, followed by those of each method
+        of the higher levels (if the file has several levels) starting with first_sector >> level"""
+        for index, method_results in enumerate(results):
+            level, method_index = divmod(index, self._method_count)
+            level_first_sector = first_sector >> level
+            count = max(min(len(method_results.flag), (self.sector_count >> level) - level_first_sector), 0)
+            for offset, dtype, column in zip(
+                    _column_offsets(self._header_size, self.sector_count, self._randomness_size,
+                                    self._method_count, method_index, level),
+                    _columns(self._randomness_size),
+                    method_results):
+                self._file.seek(offset + level_first_sector * dtype.itemsize)
+                self._file.write(column[:count].astype(dtype, copy=False).tobytes())
+
+    def set_complete_sectors(self, complete_sectors):
+        """Records that the results of the first complete_sectors sectors are final"""
+        self._file.seek(COMPLETE_SECTORS_OFFSET)
+        self._file.write(struct.pack('<Q', complete_sectors))
+
+    def flush(self):
+        """Makes sure everything written so far is stored on the disk"""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+class ResultsFile:
+    """Memory maps a results file for reading"""
+
+    def __init__(self, file):
+        self._data = np.memmap(file, dtype=np.uint8, mode='r')
+        if len(self._data) < HEADER.size or bytes(self._data[:len(MAGIC)]) != MAGIC:
+            raise ValueError('the file is not a results file')
+        magic, version, self._header_size, self.sector_size, self.sector_count, self.complete_sectors, \
+            rand_lim, sus_rand_lim, self._randomness_size, method_count, self.levels = \
+            HEADER.unpack(bytes(self._data[:HEADER.size]))
+        if version != VERSION:
+            raise ValueError(f'unsupported results file version {version}')
+        self.rand_lim = None if isnan(rand_lim) else rand_lim
+        self.sus_rand_lim = None if isnan(sus_rand_lim) else sus_rand_lim
+
+        self.analysis_names = []
+        position = HEADER.size
+        for _ in range(method_count):
+            length = int(self._data[position])
+            self.analysis_names.append(bytes(self._data[position + 1:position + 1 + length]).decode())
+            position += 1 + length
+        if len(self._data) < _column_offsets(self._header_size, self.sector_count, self._randomness_size,
+                                             method_count, 0, self.levels)[0]:
+            raise ValueError('the results file is truncated')
+
+    def level_sector_count(self, level):
+        return self.sector_count >> level
+
+    def results(self, method_index, first_sector=0, end_sector=None, level=0):
+        """Returns SectorResults of the sectors from first_sector to end_sector
+        of the analysis method and level, as views of the mapped file"""
+        sector_count = self.level_sector_count(level)
+        end_sector = sector_count if end_sector is None else min(end_sector, sector_count)
+        return SectorResults(*(
+            self._data[offset + first_sector * dtype.itemsize:offset + end_sector * dtype.itemsize].view(dtype)
+            for offset, dtype in zip(
+                _column_offsets(self._header_size, self.sector_count, self._randomness_size,
+                                len(self.analysis_names), method_index, level),
+                _columns(self._randomness_size)
+            )
+        ))
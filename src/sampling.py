@@ -0,0 +1,56 @@
+# SPDX-License-Identifier: MIT
+
+from math import sqrt
+from statistics import NormalDist
+from histograms import np
+from analysis import ResultFlag
+
+
+def stratified_sample(sector_count, sample_size, seed=None):
+    """Splits the sectors into sample_size strata of (nearly) equal size and returns
+    the sorted numbers of one randomly chosen sector of each of them.
+    Returns all the sectors if the sample would not be smaller."""
+    if sample_size >= sector_count:
+        return np.arange(sector_count)
+    rng = np.random.default_rng(seed)
+    bounds = np.arange(sample_size + 1, dtype=np.int64) * sector_count // sample_size
+    return bounds[:-1] + (rng.random(sample_size) * (bounds[1:] - bounds[:-1])).astype(np.int64)
+
+
+def wilson_interval(successes, n, z):
+    """Wilson score interval of a proportion (https://en.wikipedia.org/wiki/Binomial_proportion_confidence_interval)"""
+    if n == 0:
+        return 0.0, 1.0
+    p = successes / n
+    denominator = 1 + z ** 2 / n
+    center = (p + z ** 2 / (2 * n)) / denominator
+    half_width = z / denominator * sqrt(p * (1 - p) / n + z ** 2 / (4 * n ** 2))
+    return max(center - half_width, 0.0), min(center + half_width, 1.0)
+
+
+def composition_report(sector_numbers, flags, sector_count, analysis_names, regions, confidence, seed):
+    """Yields the lines of a report of the estimated proportion of each result flag of every analysis method,
+    of the whole image and of each of the regions it is split to. flags holds the flag arrays of the sample
+    of each method. The intervals treat the stratified sample as a simple random one, which makes them
+    slightly conservative."""
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    bounds = np.arange(regions + 1, dtype=np.int64) * sector_count // regions
+    region_of_sample = np.searchsorted(bounds, sector_numbers, side='right') - 1
+
+    yield (f'# {len(sector_numbers)} of {sector_count} sectors sampled (seed {seed}),'
+           f' {confidence:.0%} confidence intervals')
+    yield f'{"METHOD":<10} {"FIRST_SECTOR":>12} {"LAST_SECTOR":>12} {"SAMPLES":>8}' \
+          f' {"RESULT_FLAG":<28} {"PROPORTION":>10} {"LOWER":>8} {"UPPER":>8}'
+    for name, method_flags in zip(analysis_names, flags):
+        present = [flag for flag in ResultFlag if (method_flags == flag).any()]
+        rows = [(0, sector_count, method_flags)]
+        for region in range(regions):
+            if bounds[region] < bounds[region + 1]:
+                rows.append((bounds[region], bounds[region + 1], method_flags[region_of_sample == region]))
+        for first_sector, end_sector, region_flags in rows:
+            n = len(region_flags)
+            for flag in present:
+                count = int((region_flags == flag).sum())
+                lower, upper = wilson_interval(count, n, z)
+                yield (f'{name:<10} {first_sector:>12} {end_sector - 1:>12} {n:>8} {flag.name:<28}'
+                       f' {count / n if n else 0:>10.4f} {lower:>8.4f} {upper:>8.4f}')
@@ -1,39 +1,362 @@
 #!/usr/bin/env python3
 # SPDX-License-Identifier: MIT
 
-from sys import exit
+from sys import exit, stderr
 from argument_parsing import parse_arguments
-from mmap import mmap, ACCESS_READ
+from analysis import analysis_methods, MultiAnalysis, LevelsAnalysis
+from output_common import ScanInfo, ShiftedOutput
+from histograms import np
+from reader import open_image, StreamImage, extent_batches, skip_sectors, clip_extents, align_extents
+from checkpoint import CheckpointedOutput
+from deferred_output import DeferredOutput
+from parallel import iterate_parallel
+from pipeline import Pipeline, format_stage_times
+from cache import ResultsCache, CachedAnalysis, cache_key
+from contextlib import nullcontext
+from sampling import stratified_sample, composition_report
+from partitions import read_partitions, format_partitions
+from boundaries import find_transitions, refine_boundary, boundary_report, is_random
+from output_common import print_check_closed_pipe
+from os import urandom, dup, fdopen, remove
+from os.path import splitext, isfile, getsize
+from copy import copy
 from math import ceil
 
+BATCH_SIZE = 1 << 20  # number of bytes analyzed at once
+PROGRESSIVE_STRIDES = (4096, 1024, 256, 64, 16, 4, 1)
+
 
 def main(args, output_args):
-    with args.disk_image as f, \
-            mmap(f.fileno(), length=0, access=ACCESS_READ) as file, \
-            args.output_method(ceil(file.size() / args.size), **vars(output_args)) as output:
-        iterate(
-            file,
-            args.size,
-            args.analysis_method(args.size, args.rand_lim, args.sus_rand_lim),
-            output
-        )
+    with args.disk_image as f, open_checked_image(args, f) as image:
+        if args.list_partitions:
+            for line in format_partitions(checked_partitions(image)).split('\n'):
+                if not print_check_closed_pipe(line):
+                    exit(0)
+            return
+        if args.sample is not None:
+            sample(args, image)
+            return
+        if args.boundaries:
+            find_boundaries(args, image)
+            return
+        if not args.each_partition:
+            analyze(args, output_args, f, image, selected_ranges(args, image))
+            return
 
+        for partition in selected_partitions(args, image):
+            analyze(args, partition_output_args(output_args, partition), f, image, [partition.sectors(args.size)],
+                    output_range=partition.sectors(args.size))
+        remove_unused_output_file(output_args.output_file)
 
-def iterate(file, sector_size, analysis_method, output):
-    sector_number = 0
-    buf = file.read(sector_size)
-    while len(buf) == sector_size:
-        ret = output.output(
-            sector_number,
-            sector_number * sector_size,
-            *analysis_method.calc(buf)
-        )
-        if not ret:  # the pipe was closed
+
+def analyze(args, output_args, f, image, ranges=None, output_range=None):
+    """Analyzes the sectors within the (first_sector, end_sector) ranges, or the whole image if ranges is None,
+    and passes the results to a new instance of the output method. The output covers the sectors
+    of the (first_sector, end_sector) output_range, numbered from its first sector, or the whole image"""
+    scan_info = ScanInfo(args.analysis_methods, args.size, args.rand_lim, args.sus_rand_lim, args.levels)
+    sector_count = None if image.size is None else ceil(image.size / args.size)
+    if output_range is not None:
+        first_sector, end_sector = output_range
+        sector_count = (end_sector if sector_count is None else min(end_sector, sector_count)) - first_sector
+    with open_output(args, output_args, image, sector_count, scan_info) as output, \
+            open_cache(args, scan_info) as cache:
+        if output_range is not None:
+            output = ShiftedOutput(output, output_range[0])
+        if args.levels > 1:
+            analysis_method = LevelsAnalysis([[analysis_methods[name](args.size << level, args.rand_lim,
+                                                                      args.sus_rand_lim)
+                                               for name in args.analysis_methods]
+                                              for level in range(args.levels)])
+        else:
+            analysis_method = MultiAnalysis([analysis_methods[name](args.size, args.rand_lim, args.sus_rand_lim)
+                                             for name in args.analysis_methods])
+        if cache is not None:
+            analysis_method = CachedAnalysis(analysis_method, cache)
+        if args.checkpoint is None:
+            scan(args, f, image, analysis_method, output, ranges)
+            return
+
+        checkpointed = CheckpointedOutput(output, args.checkpoint, sector_count, scan_info,
+                                          args.checkpoint_interval)
+        first_sector = 0
+        if args.resume:
+            try:
+                first_sector = checkpointed.resume()
+            except ValueError as e:
+                output.error(str(e))
+                exit(1)
+            if first_sector is None:  # the pipe was closed
+                exit(0)
+        else:
+            checkpointed.start()
+        try:
+            scan(args, f, image, analysis_method, checkpointed, ranges, first_sector)
+        except BaseException:
+            checkpointed.close()
+            raise
+        checkpointed.finish()
+
+
+def checked_partitions(image):
+    try:
+        return read_partitions(image)
+    except ValueError as e:
+        print(f'The partition table could not be read: {e}', file=stderr)
+        exit(1)
+
+
+def selected_partitions(args, image):
+    """Returns the partitions selected by --partition (all of them if it was not used) ordered by their start"""
+    partitions = checked_partitions(image)
+    if args.partition is not None:
+        numbers = {p.number for p in partitions}
+        for number in args.partition:
+            if number not in numbers:
+                print(f'The image has no partition {number} (the partitions are'
+                      f' {", ".join(str(p.number) for p in partitions)})', file=stderr)
+                exit(1)
+        partitions = [p for p in partitions if p.number in args.partition]
+    return sorted(partitions, key=lambda p: p.start)  # a stream is read in increasing order
+
+
+def selected_ranges(args, image):
+    """Returns the sorted (first_sector, end_sector) ranges of whole sectors selected by --offset and --length
+    or by --partition, or None if the whole image is analyzed. An end_sector of None stands for the end of the image"""
+    if args.partition is not None:
+        return [p.sectors(args.size) for p in selected_partitions(args, image)]
+    if args.offset is None and args.length is None:
+        return None
+    offset = args.offset or 0
+    end_sector = None if args.length is None else (offset + args.length) // args.size
+    return [(-(-offset // args.size), end_sector)]
+
+
+def partition_output_args(output_args, partition):
+    """Returns the output method arguments with the output file replaced by one of the partition,
+    named after the output file with the number of the partition appended (e.g. disk-p2.png)"""
+    partition_args = copy(output_args)
+    root, extension = splitext(output_args.output_file.name)
+    partition_args.output_file = open(f'{root}-p{partition.number}{extension}', output_args.output_file.mode)
+    # the output method closes the error output file once it finishes
+    partition_args.err_file = fdopen(dup(output_args.err_file.fileno()), 'w')
+    return partition_args
+
+
+def remove_unused_output_file(output_file):
+    """Removes the output file created by the argument parsing if nothing was written to it"""
+    output_file.close()
+    if isfile(output_file.name) and getsize(output_file.name) == 0:
+        remove(output_file.name)
+
+
+def open_checked_image(args, f):
+    try:
+        image = open_image(f, not args.raw)
+    except ValueError as e:
+        print(f'The disk image could not be read: {e}', file=stderr)
+        exit(1)
+    check_image(args, image)
+    return image
+
+
+def check_image(args, image):
+    """Exits if the options need to know the size of the image or to read it out of order, but cannot"""
+    if not image.seekable:
+        for option, used in (('multiple jobs', args.jobs > 1), ('--progressive', args.progressive),
+                             ('--sample', args.sample is not None), ('--boundaries', args.boundaries)):
+            if used:
+                print(f'The disk image needs to be a seekable file to use {option}', file=stderr)
+                exit(1)
+    if image.size is None:
+        for option, used in (('--checkpoint', args.checkpoint is not None), ('--levels', args.levels > 1)):
+            if used:
+                print(f'The size of provided image could not be determined, which {option} needs', file=stderr)
+                exit(1)
+
+
+def open_output(args, output_args, image, sector_count, scan_info):
+    if sector_count is None and args.output_method.NEEDS_SIZE:
+        return DeferredOutput(args.output_method, image, scan_info, **vars(output_args))
+    return args.output_method(sector_count, scan_info=scan_info, **vars(output_args))
+
+
+def open_cache(args, scan_info):
+    if args.cache is None:
+        return nullcontext()
+    return ResultsCache(args.cache, cache_key(scan_info), args.cache_size)
+
+
+def scan(args, f, image, analysis_method, output, ranges=None, first_sector=0):
+    alignment = 1 << (args.levels - 1)  # so that each batch consists of whole sectors of every level
+    batch_sectors = -(-max(args.batch_size // args.size, 1) // alignment) * alignment
+    batch_size = batch_sectors * args.size
+    extents = scanned_extents(image, args.size, ranges, first_sector, alignment)
+    if args.progressive:
+        iterate_progressive(image, args.size, analysis_method, output, batch_size)
+    elif args.jobs > 1:
+        if not iterate_parallel(f.name, args.size, analysis_method, output, extent_batches(extents, batch_sectors),
+                                args.jobs, not args.raw):
+            exit(0)  # the pipe was closed
+        check_size(image, args.size, output)
+    elif args.pipeline:
+        pipeline = Pipeline(image, args.size, analysis_method, output, batch_sectors,
+                            args.read_queue, args.output_queue, args.analysis_threads)
+        completed = pipeline.run(extents)
+        print(format_stage_times(pipeline.stage_times), file=stderr)
+        if not completed:
+            exit(0)  # the pipe was closed
+        check_size(image, args.size, output)
+    elif isinstance(image, StreamImage):
+        iterate_stream(image, args.size, analysis_method, output, extents, batch_size)
+    else:
+        iterate(image, args.size, analysis_method, output, extents, batch_size)
+
+
+def scanned_extents(image, sector_size, ranges=None, first_sector=0, alignment=1):
+    """Returns the (first_sector, end_sector, is_hole) extents of the image within the (first_sector, end_sector)
+    ranges, or of the whole image if ranges is None, starting with first_sector. The holes are shrunk
+    to multiples of alignment."""
+    extents = image.extents(sector_size)
+    if extents is None:  # a stream of unknown size
+        extents = [(0, None, False)]
+    elif alignment > 1:
+        extents = align_extents(extents, alignment)
+    if ranges is not None:
+        extents = clip_extents(extents, ranges)
+    return skip_sectors(extents, first_sector)
+
+
+def iterate(image, sector_size, analysis_method, output, extents=None, batch_size=BATCH_SIZE):
+    """Analyzes the sectors of the image in batches and passes the results to the output.
+    The sectors of the (first_sector, end_sector, is_hole) extents marked as holes
+    are known to be zeroed and are not read. The pages of the analyzed batches are dropped,
+    so the memory used does not depend on the size of the image."""
+    if extents is None:
+        extents = [(0, image.size // sector_size, False)]
+
+    image.advise_sequential()
+    for sector_number, count, hole in extent_batches(extents, max(batch_size // sector_size, 1)):
+        if hole:
+            results = analysis_method.uniform_results(np.zeros(count, dtype=np.uint8))
+        else:
+            with image.read(sector_number * sector_size, count * sector_size) as block:
+                results = analysis_method.calc_batch(block)
+            image.release(sector_number * sector_size, count * sector_size)
+        if not output.output_batch(sector_number, sector_size, *results):  # the pipe was closed
+            exit(0)
+
+    check_size(image, sector_size, output)
+
+
+def iterate_stream(image, sector_size, analysis_method, output, extents=None, batch_size=BATCH_SIZE):
+    """Analyzes the sectors of the (first_sector, end_sector, is_hole) extents of a stream (the whole stream
+    if extents is None) in batches, reading the following batch while one is analyzed"""
+    if extents is None:
+        extents = [(0, None, False)]
+
+    image.advise_sequential()
+    chunk_size = max(batch_size // sector_size, 1) * sector_size
+    for first_sector, end_sector, _ in extents:
+        length = None if end_sector is None else (end_sector - first_sector) * sector_size
+        for offset, block in image.chunks(first_sector * sector_size, chunk_size, length=length):
+            whole_sectors = len(block) - len(block) % sector_size
+            if whole_sectors == 0:
+                break
+            results = analysis_method.calc_batch(block[:whole_sectors])
+            image.release(offset, whole_sectors)
+            if not output.output_batch(offset // sector_size, sector_size, *results):  # the pipe was closed
+                exit(0)
+
+    check_size(image, sector_size, output)
+
+
+def iterate_progressive(image, sector_size, analysis_method, output, batch_size=BATCH_SIZE):
+    """Analyzes every 4096th sector first, then every 1024th and so on down to every sector.
+    Each analyzed sector stands in for the following sectors until they are analyzed,
+    and the output is flushed after each level, so that the whole image is shown early on."""
+    sector_count = image.size // sector_size
+    batch_sectors = max(batch_size // sector_size, 1)
+    previous_stride = None
+    for stride in PROGRESSIVE_STRIDES:
+        sector_numbers = np.arange(0, sector_count, stride)
+        if previous_stride is not None:  # skip the sectors analyzed by the previous levels
+            sector_numbers = sector_numbers[sector_numbers % previous_stride != 0]
+        for start in range(0, len(sector_numbers), batch_sectors):
+            batch = sector_numbers[start:start + batch_sectors]
+            results = analysis_method.calc_batch(image.gather(batch, sector_size))
+            if not output.output_runs(batch, stride, sector_size, *results):  # the pipe was closed
+                exit(0)
+        if not output.flush():
             exit(0)
+        previous_stride = stride
+
+    check_size(image, sector_size, output)
+
+
+def sample(args, image):
+    """Analyzes a stratified sample of the sectors and prints the estimated composition of the image"""
+    if image.size % args.size != 0:
+        print(f'The size of provided image was not a multiple of {args.size}', file=stderr)
+        exit(1)
+    sector_count = image.size // args.size
+    seed = int.from_bytes(urandom(4), 'little') if args.seed is None else args.seed
+    sector_numbers = stratified_sample(sector_count, args.sample, seed)
+    analysis_method = MultiAnalysis([analysis_methods[name](args.size, args.rand_lim, args.sus_rand_lim)
+                                     for name in args.analysis_methods])
+
+    image.advise_random()  # only the pages of the sampled sectors are read
+    batch_sectors = max(args.batch_size // args.size, 1)
+    flags = [[] for _ in args.analysis_methods]
+    for start in range(0, len(sector_numbers), batch_sectors):
+        results = analysis_method.calc_batch(image.gather(sector_numbers[start:start + batch_sectors], args.size))
+        for method_flags, method_results in zip(flags, results):
+            method_flags.append(method_results.flag)
+
+    for line in composition_report(sector_numbers, [np.concatenate(f) for f in flags], sector_count,
+                                   args.analysis_methods, args.sample_regions, args.confidence, seed):
+        if not print_check_closed_pipe(line):
+            exit(0)
+
+
+def find_boundaries(args, image):
+    """Finds the byte offsets at which the data looking random starts and ends and prints them"""
+    sector_count = image.size // args.size
+    ranges = selected_ranges(args, image) or [(0, sector_count)]
+    ranges = [(first_sector, sector_count if end_sector is None else min(end_sector, sector_count))
+              for first_sector, end_sector in ranges]
+    analysis_method = MultiAnalysis([analysis_methods[args.analysis_methods[0]](args.size, args.rand_lim,
+                                                                                args.sus_rand_lim)])
+    batch_sectors = max(args.batch_size // args.size, 1)
+    sectors_read = 0
+
+    def classify(sector_numbers):
+        nonlocal sectors_read
+        sectors_read += len(sector_numbers)
+        flags = [analysis_method.calc_batch(image.gather(sector_numbers[start:start + batch_sectors],
+                                                         args.size))[0].flag
+                 for start in range(0, len(sector_numbers), batch_sectors)]
+        return is_random(np.concatenate(flags) if flags else np.zeros(0, dtype=np.uint8))
+
+    image.advise_random()  # only the sectors near the boundaries are read
+    boundaries = []
+    for last_sector, random_after in find_transitions(classify, ranges, args.boundary_step):
+        # the boundary is within the last sector of the first class or the first one of the second class
+        first_sector, end_sector = max(last_sector - 1, 0), min(last_sector + 3, sector_count)
+        window = image.gather(np.arange(first_sector, end_sector), args.size)
+        sectors_read += end_sector - first_sector
+        search_start = (last_sector - first_sector) * args.size
+        search_end = min((last_sector + 2 - first_sector) * args.size, window.size)
+        offset, confidence = refine_boundary(window, search_start, search_end, random_after)
+        boundaries.append((first_sector * args.size + offset, random_after, confidence))
+
+    for line in boundary_report(boundaries, args.analysis_methods[0], sector_count, args.boundary_step,
+                                sectors_read):
+        if not print_check_closed_pipe(line):
+            exit(0)
+
 
-        sector_number += 1
-        buf = file.read(sector_size)
-    if len(buf) != 0:
+def check_size(image, sector_size, output):
+    if image.size is not None and image.size % sector_size != 0:  # unknown if a stream was not read to its end
         output.error(
             f'The size of provided image was not a multiple of {sector_size}'
         )
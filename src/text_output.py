@@ -32,6 +32,7 @@ class TextLineOutput(OutputMethodBase):
         )
 
     def output(self, *args):
+        # the limit applies to the randomness of the first analysis method
         if self.entropy_limit >= args[2]:
             return print_check_closed_pipe(self._get_line(*args), file=self.output_file)
         return True
@@ -46,15 +47,16 @@ class TextLineOutput(OutputMethodBase):
 
 # sample-output
 class SampleOutput(TextLineOutput):
-    def _get_line(
-        self,
-        sector_number,
-        sector_offset,
-        sector_randomness,
-        result_flag,
-        sector_pattern
-    ):
-        return (f'{sector_number} (0x{sector_offset:x}) - {sector_randomness:.4f}, {result_flag.name}' +
+    def _get_line(self, sector_number, sector_offset, *results):
+        names = self._scan_info.analysis_names
+        return f'{sector_number} (0x{sector_offset:x}) - ' + '; '.join(
+            (f'{name}: ' if len(names) > 1 else '') + self._get_result(*results[i * 3:i * 3 + 3])
+            for i, name in enumerate(names)
+        )
+
+    @staticmethod
+    def _get_result(sector_randomness, result_flag, sector_pattern):
+        return (f'{sector_randomness:.4f}, {result_flag.name}' +
                 (f' (pattern of 0x{sector_pattern:02x})' if sector_pattern is not None else ''))
 
 
@@ -73,16 +75,38 @@ class CSVOutput(TextLineOutput):
         'RESULT_FLAG',
         'PATTERN'
     ]
+    RESULT_COLUMNS = 3  # the number of columns of each analysis method
 
-    def __init__(self, input_size, **kwargs):
-        super().__init__(input_size, **kwargs)
+    def __init__(self, input_size, scan_info=None, **kwargs):
+        super().__init__(input_size, scan_info, **kwargs)
 
         if not self.no_header:
             print_check_closed_pipe(
-                self.separator.join(self.COLUMN_NAMES),
+                self.separator.join(self.get_column_names(self._scan_info.analysis_names)),
                 file=self.output_file
             )
 
+    @classmethod
+    def get_column_names(cls, analysis_names):
+        """With more than one analysis method, the result columns of each method
+        are suffixed with its name, e.g. SECTOR_RANDOMNESS_CHI2_8"""
+        if len(analysis_names) == 1:
+            return cls.COLUMN_NAMES
+        return cls.COLUMN_NAMES[:-cls.RESULT_COLUMNS] + [
+            f'{column}_{name.upper().replace("-", "_")}'
+            for name in analysis_names
+            for column in cls.COLUMN_NAMES[-cls.RESULT_COLUMNS:]
+        ]
+
+    @classmethod
+    def get_analysis_names(cls, column_names):
+        """Inverse of get_column_names(), returns None for a single unnamed method"""
+        randomness_columns = [name for name in column_names if name.startswith(cls.COLUMN_NAMES[-cls.RESULT_COLUMNS])]
+        if randomness_columns == [cls.COLUMN_NAMES[-cls.RESULT_COLUMNS]]:
+            return None
+        return [name[len(cls.COLUMN_NAMES[-cls.RESULT_COLUMNS]) + 1:].lower().replace('_', '-')
+                for name in randomness_columns]
+
     def _get_line(self, *args):
         return self.separator.join(map(self._string_map, args))
     
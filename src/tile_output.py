@@ -0,0 +1,166 @@
+# SPDX-License-Identifier: MIT
+
+import os
+from argparse import ArgumentTypeError, FileType
+from image_output import ImageOutput, SweepingBlocks, Sweeping, HilbertCurve, Image
+from output_common import Parameter
+from histograms import np
+
+
+def tile_size_type(x):
+    val = int(x)
+    if val < 2 or val & (val - 1) != 0:
+        raise ArgumentTypeError(f'{x} is not a power of two')
+    return val
+
+
+class DeepZoom(ImageOutput):
+    """Writes the image as a Deep Zoom pyramid of PNG tiles, the .dzi file being the output file and the tiles
+    written to the directory next to it (e.g. disk_files/ next to disk.dzi). The tiles of every zoom level
+    but the finest one are aggregated from the four tiles of the finer level they cover.
+
+    The sectors need to be passed in order, a tile is written and aggregated once the last sector within it
+    was passed, so only the tiles being filled are kept in memory. Those are a few of them for the hilbert-curve
+    layout and a row of tiles for the sweeping ones."""
+    default_parameters = {
+        **ImageOutput.default_parameters,
+        'output_file': Parameter(FileType('w'), None, 'the .dzi file, the tiles are written next to it'),
+        'tile_size': Parameter(tile_size_type, 256, 'the side of the tiles in pixels, a power of two')
+    }
+    ORDERED = True
+    PROGRESSIVE = False
+    stream = False  # the tiles are always written while the sectors are analyzed
+
+    def _init_canvas(self, vis_size, fnt):
+        """Writes the legend next to the output file, instead of allocating the pixels of the whole image"""
+        root = os.path.splitext(self.output_file.name)[0]
+        self._tiles_dir = f'{root}_files'
+        self._width, self._height = vis_size
+        self._max_level = (max(vis_size) - 1).bit_length()
+        for level in range(self._max_level + 1):
+            os.makedirs(os.path.join(self._tiles_dir, str(level)), exist_ok=True)
+
+        if fnt is not None:
+            with Image.new(self._mode, self._get_legend_size(fnt), self.background) as image:
+                self._draw_legend(image, fnt)
+                image.save(f'{root}_legend.png')
+
+        self._background = np.array(self._color(self.background), dtype=np.uint8)
+        self._tiles = {}  # (level, column, row) -> pixels of the tiles being filled
+        self._finished_children = {}  # (level, column, row) -> number of the finished tiles of the finer level
+        last_positions = self._tile_last_positions(self.tile_size)
+        self._columns = last_positions.shape[1]
+        self._tile_order = np.argsort(last_positions, axis=None, kind='stable')
+        self._sorted_last_positions = last_positions.ravel()[self._tile_order]
+        self._finished_tiles = 0
+
+    def _level_size(self, level):
+        scale = 1 << (self._max_level - level)
+        return -(-self._width // scale), -(-self._height // scale)
+
+    def _tile(self, level, column, row):
+        key = (level, column, row)
+        if key not in self._tiles:
+            self._tiles[key] = np.tile(self._background, (self.tile_size, self.tile_size, 1))
+        return self._tiles[key]
+
+    def output(self, *args):
+        super().output(*args)
+        self._finish_tiles((args[0] + 1) // self._sectors_per_pixel)
+        return True
+
+    def output_batch(self, first_sector, sector_size, *results):
+        super().output_batch(first_sector, sector_size, *results)
+        self._finish_tiles((first_sector + len(results[0].flag)) // self._sectors_per_pixel)
+        return True
+
+    def _put_pixels(self, positions, colors):
+        x, y = self._coords_from_pos(positions)
+        tiles = (y // self.tile_size) * self._columns + x // self.tile_size
+        order = np.argsort(tiles, kind='stable')
+        tiles, x, y, colors = tiles[order], x[order], y[order], colors[order]
+        bounds = np.flatnonzero(np.diff(tiles)) + 1
+        for start, end in zip([0, *bounds.tolist()], [*bounds.tolist(), len(tiles)]):
+            row, column = divmod(int(tiles[start]), self._columns)
+            self._tile(self._max_level, column, row)[y[start:end] % self.tile_size,
+                                                     x[start:end] % self.tile_size] = colors[start:end]
+
+    def _finish_tiles(self, end_position):
+        """Writes the tiles of the finest level all positions of which precede end_position"""
+        finished = int(np.searchsorted(self._sorted_last_positions, end_position))
+        for tile in self._tile_order[self._finished_tiles:finished].tolist():
+            row, column = divmod(tile, self._columns)
+            self._finish_tile(self._max_level, column, row)
+        self._finished_tiles = max(finished, self._finished_tiles)
+
+    def _finish_tile(self, level, column, row):
+        """Writes the tile and aggregates it into the tile of the coarser level,
+        which is finished as well once all the tiles it covers are"""
+        pixels = self._tile(level, column, row)
+        del self._tiles[(level, column, row)]
+        level_width, level_height = self._level_size(level)
+        width = min(self.tile_size, level_width - column * self.tile_size)
+        height = min(self.tile_size, level_height - row * self.tile_size)
+        with Image.fromarray(pixels[:height, :width], self._mode) as image:
+            image.save(os.path.join(self._tiles_dir, str(level), f'{column}_{row}.png'))
+        if level == 0:
+            return
+
+        # the odd last column and row are averaged with themselves instead of with the background
+        if width % 2 == 1:
+            pixels[:, width] = pixels[:, width - 1]
+        if height % 2 == 1:
+            pixels[height] = pixels[height - 1]
+        half = self.tile_size // 2
+        aggregated = pixels.reshape(half, 2, half, 2, -1).mean(axis=(1, 3)).round().astype(np.uint8)
+        parent = (level - 1, column // 2, row // 2)
+        self._tile(*parent)[(row % 2) * half:(row % 2 + 1) * half,
+                            (column % 2) * half:(column % 2 + 1) * half] = aggregated
+
+        columns = -(-level_width // self.tile_size)
+        rows = -(-level_height // self.tile_size)
+        children = min(2, columns - column // 2 * 2) * min(2, rows - row // 2 * 2)
+        self._finished_children[parent] = self._finished_children.get(parent, 0) + 1
+        if self._finished_children[parent] == children:
+            del self._finished_children[parent]
+            self._finish_tile(*parent)
+
+    def flush(self):
+        return True
+
+    @staticmethod
+    def check_args(**kwargs):
+        if 'output_file' in kwargs and kwargs['output_file'].name.startswith('<'):
+            return 'the tiles of the deep zoom output methods are written next to the output file, it cannot be stdout'
+        return None
+
+    def _save(self):
+        self._finish_tiles(np.iinfo(np.int64).max)
+        self.output_file.write(
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            f'<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" TileSize="{self.tile_size}" Overlap="0"'
+            f' Format="png">\n'
+            f'  <Size Width="{self._width}" Height="{self._height}"/>\n'
+            '</Image>\n')
+        self.output_file.flush()
+
+
+# deep-zoom-sweeping-blocks
+class DeepZoomSweepingBlocks(DeepZoom, SweepingBlocks):
+    default_parameters = {**SweepingBlocks.default_parameters, **DeepZoom.default_parameters}
+    del default_parameters['stream']
+
+    @staticmethod
+    def check_args(**kwargs):
+        return DeepZoom.check_args(**kwargs) or SweepingBlocks.check_args(**kwargs)
+
+
+# deep-zoom-sweeping
+class DeepZoomSweeping(DeepZoom, Sweeping):
+    default_parameters = {**Sweeping.default_parameters, **DeepZoom.default_parameters}
+    del default_parameters['stream']
+
+
+# deep-zoom-hilbert-curve
+class DeepZoomHilbertCurve(DeepZoom, HilbertCurve):
+    default_parameters = {**HilbertCurve.default_parameters, **DeepZoom.default_parameters}
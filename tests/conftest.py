@@ -0,0 +1,29 @@
+# SPDX-License-Identifier: MIT
+
+import subprocess
+import sys
+from pathlib import Path
+import pytest
+
+SRC = Path(__file__).resolve().parent.parent / 'src'
+
+# the modules of src/ import each other by their plain names, the same way script.py runs them
+sys.path.insert(0, str(SRC))
+
+
+@pytest.fixture
+def run_script():
+    """Returns a function running script.py with the arguments and returning its standard output"""
+    def run(*args):
+        return subprocess.run([sys.executable, str(SRC / 'script.py'), *map(str, args)],
+                              check=True, capture_output=True).stdout
+    return run
+
+
+@pytest.fixture
+def run_from_binary():
+    """Returns a function running from_binary.py with the arguments and returning its standard output"""
+    def run(*args):
+        return subprocess.run([sys.executable, str(SRC / 'from_binary.py'), *map(str, args)],
+                              check=True, capture_output=True).stdout
+    return run
@@ -0,0 +1,93 @@
+# SPDX-License-Identifier: MIT
+
+"""Writes small qcow2 images of raw images for the tests, with the kind of every cluster chosen by the test"""
+
+import random
+import struct
+import zlib
+
+UNALLOCATED = 'unallocated'  # no L2 entry, or no L2 table for the whole range of the L1 entry
+ZERO = 'zero'  # the zero flag without a host cluster (version 3)
+ZERO_ALLOCATED = 'zero-allocated'  # the zero flag over a host cluster of garbage which must not be read (version 3)
+DATA = 'data'
+COMPRESSED = 'compressed'
+
+_COPIED = 1 << 63
+_COMPRESSED = 1 << 62
+_ZERO = 1
+
+
+def cluster_kinds(raw, cluster_bits, version, seed=0):
+    """Chooses a kind for each cluster of the raw image: zeroed clusters become unallocated
+    or (in version 3) zero clusters, the others are stored as they are or compressed"""
+    rng = random.Random(seed)
+    cluster_size = 1 << cluster_bits
+    zero_kinds = [UNALLOCATED, ZERO, ZERO_ALLOCATED] if version == 3 else [UNALLOCATED]
+    return [rng.choice(zero_kinds) if not any(raw[start:start + cluster_size]) else rng.choice([DATA, COMPRESSED])
+            for start in range(0, len(raw), cluster_size)]
+
+
+def write_qcow2(path, raw, kinds, cluster_bits=9, version=3, seed=0):
+    """Writes the raw image as a qcow2 image with the given kind of each cluster.
+    The host clusters are stored in a shuffled order of runs of up to 4 consecutive guest clusters,
+    so that some of them are adjacent on the host and some are not.
+    Returns the host offsets of the garbage clusters under the allocated zero clusters."""
+    cluster_size = 1 << cluster_bits
+    l2_entries = cluster_size // 8
+    clusters = len(kinds)
+    l1_size = -(-clusters // l2_entries)
+    l1_offset = cluster_size
+    next_offset = l1_offset + -(-l1_size * 8 // cluster_size) * cluster_size
+
+    l2_offsets = {}
+    for table in range(l1_size):
+        if any(kind != UNALLOCATED for kind in kinds[table * l2_entries:(table + 1) * l2_entries]):
+            l2_offsets[table] = next_offset
+            next_offset += cluster_size
+    l2 = {table: [0] * l2_entries for table in l2_offsets}
+
+    runs = [list(range(start, min(start + 4, clusters))) for start in range(0, clusters, 4)]
+    random.Random(seed).shuffle(runs)
+    writes = []
+    garbage = []
+    for cluster in (cluster for run in runs for cluster in run):
+        table, index = divmod(cluster, l2_entries)
+        data = raw[cluster * cluster_size:(cluster + 1) * cluster_size]
+        data += bytes(cluster_size - len(data))
+        kind = kinds[cluster]
+        if kind == ZERO:
+            l2[table][index] = _ZERO
+        elif kind == ZERO_ALLOCATED:
+            l2[table][index] = _COPIED | next_offset | _ZERO
+            writes.append((next_offset, b'\xaa' * cluster_size))
+            garbage.append(next_offset)
+            next_offset += cluster_size
+        elif kind == DATA:
+            l2[table][index] = _COPIED | next_offset
+            writes.append((next_offset, data))
+            next_offset += cluster_size
+        elif kind == COMPRESSED:
+            compressor = zlib.compressobj(6, zlib.DEFLATED, -12)
+            compressed = compressor.compress(data) + compressor.flush()
+            start = next_offset + 7  # compressed clusters need not start at a sector boundary
+            offset_bits = 62 - (cluster_bits - 8)
+            additional_sectors = (start % 512 + len(compressed) - 1) // 512
+            l2[table][index] = _COMPRESSED | (additional_sectors << offset_bits) | start
+            writes.append((start, compressed))
+            next_offset = -(-(start + len(compressed)) // cluster_size) * cluster_size
+
+    header = struct.pack('>4sIQIIQIIQQIIQ', b'QFI\xfb', version, 0, 0, cluster_bits, len(raw), 0,
+                         l1_size, l1_offset, 0, 0, 0, 0)
+    if version == 3:
+        header += struct.pack('>QQQII', 0, 0, 0, 4, 104)
+    image = bytearray(next_offset)
+    image[:len(header)] = header
+    l1 = [_COPIED | l2_offsets[table] if table in l2_offsets else 0 for table in range(l1_size)]
+    image[l1_offset:l1_offset + 8 * l1_size] = struct.pack(f'>{l1_size}Q', *l1)
+    for table, offset in l2_offsets.items():
+        image[offset:offset + cluster_size] = struct.pack(f'>{l2_entries}Q', *l2[table])
+    for offset, data in writes:
+        image[offset:offset + len(data)] = data
+    with open(path, 'wb') as f:
+        f.write(image)
+    return garbage
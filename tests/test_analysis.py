@@ -0,0 +1,134 @@
+# SPDX-License-Identifier: MIT
+
+import pytest
+from collections import Counter
+from math import log2
+from histograms import np
+from analysis import analysis_methods, ResultFlag, MultiAnalysis
+from benchmark import _reference_bit_groups
+
+
+def mixed_sectors(sector_size, count, seed=0):
+    """Random sectors, sectors of a narrower range of byte values, text-like sectors,
+    sparse sectors and sectors of a single byte value"""
+    rng = np.random.default_rng(seed)
+    kinds = rng.integers(0, 5, count)
+    data = rng.integers(0, 256, (count, sector_size), dtype=np.uint8)
+    narrow = kinds == 1
+    data[narrow] = rng.integers(0, 16, (narrow.sum(), sector_size), dtype=np.uint8)
+    text = kinds == 2
+    data[text] = rng.integers(32, 127, (text.sum(), sector_size), dtype=np.uint8)
+    sparse = kinds == 3
+    data[sparse] *= rng.random((sparse.sum(), sector_size)) < 0.02
+    uniform = kinds == 4
+    data[uniform] = rng.integers(0, 256, (uniform.sum(), 1), dtype=np.uint8)
+    return data.tobytes()
+
+
+def per_sector(method, data):
+    return [method.calc(data[i:i + method.sector_size]) for i in range(0, len(data), method.sector_size)]
+
+
+@pytest.mark.parametrize('sector_size', [512, 4096])
+@pytest.mark.parametrize('name', ['shannon', 'chi2-8', 'chi2-4'])
+def test_calc_batch_matches_calc(name, sector_size):
+    method = analysis_methods[name](sector_size)
+    data = mixed_sectors(sector_size, 200)
+    assert list(method.calc_batch(data).rows()) == per_sector(method, data)
+
+
+def reference_shannon(buf):
+    """The entropy as released before the batch analysis, summed in the order of the first occurrences"""
+    freq = Counter(buf)
+    if len(freq) == 1:
+        return 0.0, ResultFlag.SINGLE_BYTE_PATTERN, freq.popitem()[0]
+    entropy = sum(f * log2(f) for f in freq.values()) / len(buf) - log2(len(buf))
+    return abs(entropy) / 8, ResultFlag.NONE, None
+
+
+@pytest.mark.parametrize('sector_size', [512, 4096])
+def test_shannon_matches_released_results(sector_size):
+    # the float depends on the order the terms are added in, so shuffling the bytes of the sectors
+    # changes the last digits of some of them
+    method = analysis_methods['shannon'](sector_size)
+    data = np.frombuffer(mixed_sectors(sector_size, 400, seed=1), dtype=np.uint8).reshape(-1, sector_size)
+    for sectors in (data, np.random.default_rng(1).permuted(data, axis=1)):
+        block = sectors.tobytes()
+        expected = [reference_shannon(block[i:i + sector_size]) for i in range(0, len(block), sector_size)]
+        assert per_sector(method, block) == expected
+        assert list(method.calc_batch(block).rows()) == expected
+
+
+def reference_chi_square_n(buf, method):
+    """The per-bit loop chi2-3 and the set bit count chi2-1 used before the bit group engine"""
+    vals = _reference_bit_groups(buf, method.N)
+    if vals[0] == method.single_byte_pattern_count:
+        return 0.0, ResultFlag.SINGLE_BYTE_PATTERN, 0
+    if vals[-1] == method.single_byte_pattern_count:
+        return 0.0, ResultFlag.SINGLE_BYTE_PATTERN, 255
+    chis = sum((i - method.expected) ** 2 for i in vals)
+    randomness = 1 - chis / method.max_chis
+    if chis < method.sus_random_limit:
+        return randomness, ResultFlag.RANDOMNESS_SUSPICIOUSLY_HIGH, None
+    if chis <= method.random_limit:
+        return randomness, ResultFlag.RANDOM, None
+    return randomness, ResultFlag.NOT_RANDOM, None
+
+
+@pytest.mark.parametrize('sector_size', [512, 4096])
+@pytest.mark.parametrize('name', ['chi2-7', 'chi2-6', 'chi2-5', 'chi2-3', 'chi2-2', 'chi2-1'])
+def test_chi_square_n_matches_per_bit_loop(name, sector_size):
+    method = analysis_methods[name](sector_size)
+    data = mixed_sectors(sector_size, 40)
+    expected = [reference_chi_square_n(data[i:i + sector_size], method) for i in range(0, len(data), sector_size)]
+    assert list(method.calc_batch(data).rows()) == expected
+    assert per_sector(method, data) == expected
+
+
+def reference_kstest(buf, method):
+    """The kstest analysis as released, calling scipy for every sector"""
+    from scipy.stats import kstest, uniform
+    _, p = kstest(bytearray(buf), uniform(0, 255).cdf, mode='asymp')
+    if p > method.p_sus_rand_lim:
+        return 0.0, ResultFlag.RANDOMNESS_SUSPICIOUSLY_HIGH, None
+    if p < method.p_rand_lim:
+        return 0.5, ResultFlag.NOT_RANDOM, None
+    return 1.0, ResultFlag.RANDOM, None
+
+
+@pytest.mark.parametrize('sector_size', [512, 4096])
+def test_kstest_matches_scipy(sector_size):
+    method = analysis_methods['kstest'](sector_size)
+    # sectors of random bytes from 0 to a random upper bound lie on both sides of the significance levels
+    rng = np.random.default_rng(2)
+    bounds = rng.integers(200, 257, (100, 1))
+    data = np.concatenate([np.frombuffer(mixed_sectors(sector_size, 100), dtype=np.uint8).reshape(-1, sector_size),
+                           (rng.random((100, sector_size)) * bounds).astype(np.uint8)]).tobytes()
+    expected = [reference_kstest(data[i:i + sector_size], method) for i in range(0, len(data), sector_size)]
+    assert {flag for _, flag, _ in expected} >= {ResultFlag.RANDOM, ResultFlag.NOT_RANDOM}
+    assert list(method.calc_batch(data).rows()) == expected
+    assert per_sector(method, data) == expected
+
+
+def test_multi_analysis_matches_each_method():
+    # the histogram based methods share the byte histograms, the others are calculated on their own
+    names = ['shannon', 'chi2-8', 'chi2-4', 'chi2-3', 'chi2-1', 'kstest']
+    methods = [analysis_methods[name](512) for name in names]
+    data = mixed_sectors(512, 200, seed=3)
+    for method, results in zip(methods, MultiAnalysis(methods).calc_batch(data)):
+        assert list(results.rows()) == per_sector(method, data)
+
+
+@pytest.mark.parametrize('name', ['shannon', 'chi2-8', 'chi2-4', 'chi2-3', 'chi2-1', 'kstest'])
+def test_uniform_sectors_are_looked_up(name):
+    method = analysis_methods[name](512)
+    every_value = np.repeat(np.arange(256, dtype=np.uint8), 512).tobytes()
+    assert list(method.uniform_results(np.arange(256)).rows()) == per_sector(method, every_value)
+
+    # runs of zeroed and filled sectors between analyzed ones, as in a mostly empty disk
+    rng = np.random.default_rng(4)
+    sectors = np.frombuffer(mixed_sectors(512, 300, seed=4), dtype=np.uint8).reshape(-1, 512).copy()
+    sectors[rng.random(300) < 0.7] = 0
+    data = sectors.tobytes()
+    assert list(MultiAnalysis([method]).calc_batch(data)[0].rows()) == per_sector(method, data)
+    assert list(MultiAnalysis([method]).calc_batch(bytes(512 * 16))[0].rows()) == per_sector(method, bytes(512 * 16))
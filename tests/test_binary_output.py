@@ -0,0 +1,121 @@
+# SPDX-License-Identifier: MIT
+
+import subprocess
+import sys
+from pathlib import Path
+import pytest
+from histograms import np
+from analysis import SectorResults
+from binary_output import BinaryOutput
+from output_common import ScanInfo
+from results_file import ResultsFile
+from test_analysis import mixed_sectors
+
+SECTOR_COUNT = 1000
+FROM_BINARY = Path(__file__).resolve().parent.parent / 'src' / 'from_binary.py'
+
+
+def batch(count, seed=0):
+    rng = np.random.default_rng(seed)
+    return SectorResults(rng.random(count), rng.integers(0, 5, count, dtype=np.uint8),
+                         rng.integers(0, 256, count, dtype=np.uint8))
+
+
+def binary_output(path):
+    return BinaryOutput(SECTOR_COUNT, scan_info=ScanInfo(['shannon'], 512), output_file=open(path, 'wb'),
+                        err_file=open(path.with_suffix('.err'), 'w'))
+
+
+def complete_sectors(path):
+    with open(path, 'rb') as f:
+        return ResultsFile(f).complete_sectors
+
+
+@pytest.mark.parametrize('batches, complete', [
+    ([(0, 300)], 300),
+    ([(0, 300), (600, 700)], 300),
+    ([(300, 600), (0, 300), (700, 800)], 600),
+    ([(100, 300)], 0),
+])
+def test_interrupted_scan_is_complete_up_to_the_first_missing_sector(tmp_path, batches, complete):
+    path = tmp_path / 'results.bin'
+    with pytest.raises(KeyboardInterrupt):
+        with binary_output(path) as output:
+            for first_sector, end_sector in batches:
+                output.output_batch(first_sector, 512, batch(end_sector - first_sector, first_sector))
+            raise KeyboardInterrupt
+    assert complete_sectors(path) == complete
+
+
+def test_sectors_passed_one_by_one_are_complete_once_flushed(tmp_path):
+    path = tmp_path / 'results.bin'
+    with pytest.raises(SystemExit):
+        with binary_output(path) as output:
+            for sector_number in range(10):
+                output.output(sector_number, sector_number * 512, 0.5, 3, None)
+            raise SystemExit(1)
+    assert complete_sectors(path) == 10
+
+
+def test_finished_scan_is_complete(tmp_path):
+    path = tmp_path / 'results.bin'
+    with binary_output(path) as output:
+        output.output_batch(0, 512, batch(SECTOR_COUNT))
+    assert complete_sectors(path) == SECTOR_COUNT
+
+
+def assert_same_csv(replayed, scanned):
+    """The randomness is stored as float32 in the results file, the rest of the columns are the same"""
+    replayed, scanned = replayed.decode().splitlines(), scanned.decode().splitlines()
+    assert replayed[0] == scanned[0] and len(replayed) == len(scanned)
+    randomness_columns = [i for i, name in enumerate(scanned[0].split(',')) if name.startswith('SECTOR_RANDOMNESS')]
+    for replayed_line, scanned_line in zip(replayed[1:], scanned[1:]):
+        replayed_fields, scanned_fields = replayed_line.split(','), scanned_line.split(',')
+        for i in randomness_columns:
+            assert float(replayed_fields[i]) == float(np.float32(scanned_fields[i]))
+            replayed_fields[i] = scanned_fields[i] = ''
+        assert replayed_fields == scanned_fields
+
+
+@pytest.fixture
+def image(tmp_path):
+    path = tmp_path / 'disk.img'
+    path.write_bytes(mixed_sectors(512, 3000))
+    return path
+
+
+@pytest.mark.parametrize('analysis', ['shannon', 'chi2-8,kstest'])
+def test_results_replay_to_the_csv_of_a_scan(image, tmp_path, run_script, run_from_binary, analysis):
+    results = tmp_path / 'results.bin'
+    run_script('-m', 'binary', '-a', analysis, '--output-file', results, image)
+    assert_same_csv(run_from_binary('csv', results), run_script('-m', 'csv', '-a', analysis, image))
+
+
+def test_levels_replay_to_the_csv_of_a_scan_of_larger_sectors(image, tmp_path, run_script, run_from_binary):
+    results = tmp_path / 'results.bin'
+    run_script('-m', 'binary', '-a', 'shannon,chi2-4', '--levels', 3, '--output-file', results, image)
+    for size in (512, 1024, 2048):
+        assert_same_csv(run_from_binary('-s', size, 'csv', results),
+                        run_script('-m', 'csv', '-a', 'shannon,chi2-4', '-s', size, image))
+
+
+def test_only_complete_sectors_are_replayed(tmp_path):
+    path = tmp_path / 'results.bin'
+    with pytest.raises(KeyboardInterrupt):
+        with binary_output(path) as output:
+            output.output_batch(0, 512, batch(300))
+            output.output_batch(600, 512, batch(100))
+            raise KeyboardInterrupt
+    replay = subprocess.run([sys.executable, str(FROM_BINARY), 'csv', path], capture_output=True, check=True)
+    assert len(replay.stdout.decode().splitlines()) == 1 + 300
+    assert b'interrupted' in replay.stderr
+
+
+def test_output_method_arguments_precede_the_results_file(image, tmp_path, run_script, run_from_binary):
+    results = tmp_path / 'results.bin'
+    run_script('-m', 'binary', '--levels', 2, '--output-file', results, image)
+    run_from_binary('-s', 1024, 'hilbert-curve', '--no-legend', '--font', '-', '--output-file', tmp_path / 'disk.png',
+                    results)
+    assert (tmp_path / 'disk.png').read_bytes().startswith(b'\x89PNG')
+    assert run_from_binary('csv', '--output-file', tmp_path / 'disk.csv', results) == b''
+    assert (tmp_path / 'disk.csv').read_bytes() == run_from_binary('csv', results)
@@ -0,0 +1,82 @@
+# SPDX-License-Identifier: MIT
+
+import pytest
+from histograms import np
+from boundaries import probe_sectors, find_transitions, refine_boundary
+from argument_parsing import parse_arguments
+
+RANDOM_START, RANDOM_END = 512123, 1536200  # byte offsets of the random data in the synthetic image
+
+
+def synthetic_image(size=2 << 20, seed=0):
+    """Printable text with random bytes from RANDOM_START to RANDOM_END"""
+    rng = np.random.default_rng(seed)
+    data = rng.integers(32, 127, size, dtype=np.uint8)
+    data[RANDOM_START:RANDOM_END] = rng.integers(0, 256, RANDOM_END - RANDOM_START, dtype=np.uint8)
+    return data.tobytes()
+
+
+def test_probe_sectors():
+    probes, range_indexes = probe_sectors([(0, 10), (20, 20), (30, 34)], 4)
+    assert probes.tolist() == [0, 4, 8, 9, 30, 33]
+    assert range_indexes.tolist() == [0, 0, 0, 0, 2, 2]
+
+
+def test_transitions_are_bisected_to_the_sector():
+    random = np.zeros(10000, dtype=bool)
+    random[1000:5001] = True
+    random[7777:] = True
+    classified = []
+
+    def classify(sector_numbers):
+        classified.extend(sector_numbers.tolist())
+        return random[sector_numbers]
+
+    assert find_transitions(classify, [(0, 10000)], 256) == [(999, True), (5000, False), (7776, True)]
+    # the probes and a bisection of 8 steps per transition
+    assert len(classified) == len(probe_sectors([(0, 10000)], 256)[0]) + 3 * 8
+
+
+def test_transitions_between_ranges_are_ignored():
+    random = np.zeros(1000, dtype=bool)
+    random[500:] = True
+    assert find_transitions(lambda sector_numbers: random[sector_numbers], [(0, 500), (500, 1000)], 64) == []
+    assert find_transitions(lambda sector_numbers: random[sector_numbers], [(0, 600)], 64) == [(499, True)]
+
+
+@pytest.mark.parametrize('random_after', [True, False])
+def test_boundary_is_refined_to_the_byte(random_after):
+    data = np.frombuffer(synthetic_image(), dtype=np.uint8)
+    boundary = RANDOM_START if random_after else RANDOM_END
+    window = data[boundary - 700:boundary + 1300].tobytes()
+    offset, confidence = refine_boundary(window, 512, 1536, random_after)
+    # a random byte next to the boundary may as well be printable
+    assert abs(offset - 700) <= 2
+    assert 0 < confidence <= 1
+
+
+@pytest.mark.parametrize('method', ['chi2-4', 'chi2-8', 'kstest'])
+def test_boundaries_of_synthetic_image(tmp_path, run_script, method):
+    image = tmp_path / 'disk.img'
+    image.write_bytes(synthetic_image())
+    lines = run_script('-m', 'csv', '--boundaries', '--boundary-step', 64, '-a', method, image).decode().splitlines()
+    assert lines[0].startswith(f'# 2 boundaries found by {method} classifying every 64th of 4096 sectors')
+    boundaries = [line.split() for line in lines[2:]]
+    assert [(kind, end) for _, kind, end, _ in boundaries] == [('random', 'start'), ('random', 'end')]
+    assert abs(int(boundaries[0][0]) - RANDOM_START) <= 2
+    assert abs(int(boundaries[1][0]) - RANDOM_END) <= 2
+
+
+def test_boundaries_need_a_method_classifying_randomness(monkeypatch, capsys):
+    monkeypatch.setattr('sys.argv', ['script.py', '-m', 'csv', '--boundaries', '-a', 'shannon', 'disk.img'])
+    with pytest.raises(SystemExit) as exit_info:
+        parse_arguments()
+    assert exit_info.value.code == 2
+    assert 'shannon' in capsys.readouterr().err
+
+
+def test_boundaries_do_not_use_the_output_method(tmp_path, run_script):
+    image = tmp_path / 'disk.img'
+    image.write_bytes(synthetic_image())
+    # the default image output method would need a font
+    assert run_script('--boundaries', image) == run_script('-m', 'csv', '--boundaries', image)
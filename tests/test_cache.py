@@ -0,0 +1,110 @@
+# SPDX-License-Identifier: MIT
+
+import sqlite3
+from threading import Thread
+from histograms import np
+from analysis import SectorResults
+from cache import ResultsCache
+from test_analysis import mixed_sectors
+
+REGION_SECTORS = 512
+REGION_BYTES = REGION_SECTORS * 10  # the stored size of the results of a region of a single analysis method
+
+
+def region_results(seed):
+    rng = np.random.default_rng(seed)
+    return [SectorResults(rng.random(REGION_SECTORS),
+                          rng.integers(0, 5, REGION_SECTORS, dtype=np.uint8),
+                          rng.integers(0, 256, REGION_SECTORS, dtype=np.uint8))]
+
+
+def stored_size(path):
+    with sqlite3.connect(path) as db:
+        return db.execute('SELECT COALESCE(SUM(length(results)), 0) FROM results').fetchone()[0]
+
+
+def test_results_are_returned(tmp_path):
+    cache = ResultsCache(tmp_path / 'scans.cache', 'key')
+    fingerprint = cache.fingerprint(b'region')
+    assert cache.get(fingerprint, 1) is None
+    cache.put(fingerprint, region_results(0))
+    for stored, expected in zip(cache.get(fingerprint, 1), region_results(0)):
+        for column, expected_column in zip(stored, expected):
+            assert np.array_equal(column, expected_column)
+    assert ResultsCache(tmp_path / 'scans.cache', 'other key').get(fingerprint, 1) is None
+    cache.close()
+
+
+def test_size_stays_bounded_while_putting(tmp_path):
+    path = tmp_path / 'scans.cache'
+    limit = REGION_BYTES * 10
+    cache = ResultsCache(path, 'key', limit)
+    for region in range(100):
+        cache.put(cache.fingerprint(bytes([region])), region_results(region))
+        # checked on the database itself, as a killed scan never reaches close()
+        assert stored_size(path) <= limit
+    # the most recently used regions were kept
+    assert cache.get(cache.fingerprint(bytes([99])), 1) is not None
+    assert cache.get(cache.fingerprint(bytes([0])), 1) is None
+    cache.close()
+    assert stored_size(path) <= limit
+
+
+def test_recently_read_regions_are_kept(tmp_path):
+    cache = ResultsCache(tmp_path / 'scans.cache', 'key', REGION_BYTES * 4)
+    for region in range(4):
+        cache.put(cache.fingerprint(bytes([region])), region_results(region))
+    assert cache.get(cache.fingerprint(bytes([0])), 1) is not None
+    cache.put(cache.fingerprint(bytes([4])), region_results(4))
+    assert cache.get(cache.fingerprint(bytes([0])), 1) is not None
+    assert cache.get(cache.fingerprint(bytes([1])), 1) is None
+    cache.close()
+
+
+def test_size_limit_applies_to_an_existing_cache(tmp_path):
+    path = tmp_path / 'scans.cache'
+    cache = ResultsCache(path, 'key', REGION_BYTES * 100)
+    for region in range(20):
+        cache.put(cache.fingerprint(bytes([region])), region_results(region))
+    cache.close()
+
+    smaller = ResultsCache(path, 'key', REGION_BYTES * 8)
+    smaller.put(smaller.fingerprint(b'new'), region_results(20))
+    assert stored_size(path) <= REGION_BYTES * 8
+    smaller.close()
+
+
+def test_threads_share_the_cache(tmp_path):
+    cache = ResultsCache(tmp_path / 'scans.cache', 'key', REGION_BYTES * 16)
+    errors = []
+
+    def put_and_get(first):
+        try:
+            for region in range(first, first + 32):
+                cache.put(cache.fingerprint(bytes([region])), region_results(region))
+                # the other threads may have evicted the region already
+                stored = cache.get(cache.fingerprint(bytes([region])), 1)
+                if stored is not None:
+                    assert np.array_equal(stored[0].randomness, region_results(region)[0].randomness)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [Thread(target=put_and_get, args=(first,)) for first in range(0, 128, 32)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    cache.close()
+    assert errors == []
+    assert stored_size(tmp_path / 'scans.cache') <= REGION_BYTES * 16
+
+
+def test_pipeline_results_are_cached(tmp_path, run_script):
+    image = tmp_path / 'disk.img'
+    image.write_bytes(mixed_sectors(512, 8 * 2048))
+    cache = tmp_path / 'scans.cache'
+    expected = run_script('-m', 'csv', '-a', 'shannon,chi2-3', image)
+    for _ in range(2):  # analyzes and stores the regions, then reads them from the cache
+        assert run_script('-m', 'csv', '-a', 'shannon,chi2-3', '--pipeline', '--analysis-threads', 4,
+                          '--cache', cache, image) == expected
+    assert stored_size(cache) == 8 * 2048 * 2 * 10
@@ -0,0 +1,98 @@
+# SPDX-License-Identifier: MIT
+
+import subprocess
+import sys
+from pathlib import Path
+import pytest
+from histograms import np
+from analysis import SectorResults
+from checkpoint import CheckpointedOutput
+from output_common import ScanInfo
+from results_file import ResultsFile
+from test_analysis import mixed_sectors
+
+SRC = Path(__file__).resolve().parent.parent / 'src'
+SECTOR_COUNT = 4096
+# runs script.py, interrupting the scan once the checkpointed output got the given number of batches
+INTERRUPTED_SCRIPT = '''
+import sys
+sys.path.insert(0, {src!r})
+sys.argv = ['script.py', *{args!r}]
+import checkpoint
+import script
+
+output_batch = checkpoint.CheckpointedOutput.output_batch
+batches = 0
+
+
+def interrupted_output_batch(self, *args):
+    global batches
+    batches += 1
+    if batches > {batches}:
+        raise KeyboardInterrupt
+    return output_batch(self, *args)
+
+
+checkpoint.CheckpointedOutput.output_batch = interrupted_output_batch
+script.main(*script.parse_arguments())
+'''
+
+
+class RecordingOutput:
+    ORDERED = False
+
+    def __init__(self):
+        self.batches = []
+
+    def output_batch(self, first_sector, sector_size, *results):
+        self.batches.append((first_sector, results[0].randomness.copy()))
+        return True
+
+
+def batch(first_sector, end_sector):
+    count = end_sector - first_sector
+    return SectorResults(np.arange(first_sector, end_sector, dtype=np.float64), np.zeros(count, dtype=np.uint8),
+                         np.zeros(count, dtype=np.uint8))
+
+
+def test_batches_out_of_order_are_complete_once_the_gaps_are_filled(tmp_path):
+    path = tmp_path / 'scan.checkpoint'
+    checkpointed = CheckpointedOutput(RecordingOutput(), path, 1000, ScanInfo(['shannon'], 512), 60)
+    checkpointed.start()
+    for first_sector, end_sector, complete in [(100, 200, 0), (300, 400, 0), (0, 100, 200), (200, 300, 400),
+                                               (500, 600, 400)]:
+        checkpointed.output_batch(first_sector, 512, batch(first_sector, end_sector))
+        assert checkpointed.complete_sectors == complete
+    checkpointed.close()
+
+    resumed = CheckpointedOutput(RecordingOutput(), path, 1000, ScanInfo(['shannon'], 512), 60)
+    assert resumed.resume() == 400
+    replayed = np.concatenate([randomness for _, randomness in sorted(resumed._output.batches)])
+    assert np.array_equal(replayed, np.arange(400))
+    resumed.finish()
+    assert not path.exists()
+
+
+def interrupted_scan(args, batches):
+    process = subprocess.run([sys.executable, '-c', INTERRUPTED_SCRIPT.format(src=str(SRC), args=list(map(str, args)),
+                                                                              batches=batches)],
+                             capture_output=True)
+    assert process.returncode != 0 and b'KeyboardInterrupt' in process.stderr
+
+
+@pytest.mark.parametrize('options', [['-m', 'csv'], ['-m', 'binary', '--jobs', 3]], ids=['serial', 'jobs'])
+def test_resumed_scan_matches_uninterrupted_scan(tmp_path, run_script, options):
+    image = tmp_path / 'disk.img'
+    image.write_bytes(mixed_sectors(512, SECTOR_COUNT))
+    checkpoint = tmp_path / 'scan.checkpoint'
+    common = [*options, '-a', 'shannon,chi2-8', '--batch-size', 64]
+    run_script(*common, '--output-file', tmp_path / 'expected', image)
+
+    interrupted_scan([*common, '--checkpoint', checkpoint, '--output-file', tmp_path / 'interrupted', image], 10)
+    with open(checkpoint, 'rb') as f:
+        complete_sectors = ResultsFile(f).complete_sectors
+    assert 0 < complete_sectors < SECTOR_COUNT
+
+    run_script(*common, '--checkpoint', checkpoint, '--resume', '--output-file', tmp_path / 'resumed', image)
+    assert (tmp_path / 'resumed').read_bytes() == (tmp_path / 'expected').read_bytes()
+    assert not checkpoint.exists()
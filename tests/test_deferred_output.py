@@ -0,0 +1,76 @@
+# SPDX-License-Identifier: MIT
+
+import gzip
+import subprocess
+import sys
+from pathlib import Path
+import pytest
+from histograms import np
+from analysis import SectorResults
+from deferred_output import DeferredOutput
+from output_common import ScanInfo
+from test_analysis import mixed_sectors
+
+SCRIPT = Path(__file__).resolve().parent.parent / 'src' / 'script.py'
+
+
+class RecordingOutput:
+    created = []
+
+    def __init__(self, input_size, scan_info=None, **kwargs):
+        self.input_size = input_size
+        self.batches = []
+        RecordingOutput.created.append(self)
+
+    def output_batch(self, first_sector, sector_size, *results):
+        self.batches.append(first_sector)
+        return True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        pass
+
+
+class UnknownSizeImage:
+    size = None
+
+
+def results(count):
+    return SectorResults(np.zeros(count), np.zeros(count, dtype=np.uint8), np.zeros(count, dtype=np.uint8))
+
+
+def test_results_are_replayed_in_order():
+    RecordingOutput.created.clear()
+    with DeferredOutput(RecordingOutput, UnknownSizeImage(), ScanInfo(['shannon'], 512)) as output:
+        output.output_batch(100, 512, results(50))
+        output.output_batch(0, 512, results(100))
+    assert [(created.input_size, created.batches) for created in RecordingOutput.created] == [(150, [0, 100])]
+
+
+def test_failed_scan_creates_no_output():
+    RecordingOutput.created.clear()
+    with pytest.raises(KeyboardInterrupt):
+        with DeferredOutput(RecordingOutput, UnknownSizeImage(), ScanInfo(['shannon'], 512)) as output:
+            output.output_batch(0, 512, results(100))
+            raise KeyboardInterrupt
+    assert RecordingOutput.created == []
+
+
+@pytest.mark.parametrize('method', ['csv', 'binary'])
+def test_stream_and_compressed_scans_match_file_scan(tmp_path, run_script, method):
+    data = mixed_sectors(512, 3000)
+    image = tmp_path / 'disk.img'
+    image.write_bytes(data)
+    compressed = tmp_path / 'disk.img.gz'
+    compressed.write_bytes(gzip.compress(data))
+    options = ['-m', method, '-a', 'shannon,chi2-3', '--batch-size', 256]
+
+    run_script(*options, '--output-file', tmp_path / 'file', image)
+    run_script(*options, '--output-file', tmp_path / 'compressed', compressed)
+    subprocess.run([sys.executable, str(SCRIPT), *map(str, options), '--output-file', tmp_path / 'stream', '-'],
+                   input=data, check=True, capture_output=True)
+    expected = (tmp_path / 'file').read_bytes()
+    assert (tmp_path / 'compressed').read_bytes() == expected
+    assert (tmp_path / 'stream').read_bytes() == expected
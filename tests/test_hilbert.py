@@ -0,0 +1,15 @@
+# SPDX-License-Identifier: MIT
+
+import pytest
+from histograms import np
+from hilbert import d2xy, TABLE_MAX_ORDER
+from benchmark import _reference_d2xy
+
+
+@pytest.mark.parametrize('order', [1, 3, TABLE_MAX_ORDER, TABLE_MAX_ORDER + 1, 16])
+def test_coordinate_tables_match_scalar_d2xy(order, tmp_path):
+    distances = np.random.default_rng(order).integers(0, 4 ** order, 5000)
+    expected = np.array([_reference_d2xy(1 << order, distance) for distance in distances.tolist()]).T
+    for directory in (None, tmp_path):
+        x, y = d2xy(order, distances, directory)
+        assert np.array_equal(x, expected[0]) and np.array_equal(y, expected[1])
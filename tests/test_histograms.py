@@ -0,0 +1,14 @@
+# SPDX-License-Identifier: MIT
+
+import pytest
+from histograms import np, sectors_view, bit_group_histograms
+from benchmark import _reference_bit_groups
+from test_analysis import mixed_sectors
+
+
+@pytest.mark.parametrize('sector_size', [512, 520, 4096])
+@pytest.mark.parametrize('n', range(1, 9))
+def test_bit_group_histograms_match_per_bit_loop(n, sector_size):
+    data = mixed_sectors(sector_size, 40)
+    expected = [_reference_bit_groups(data[i:i + sector_size], n) for i in range(0, len(data), sector_size)]
+    assert np.array_equal(bit_group_histograms(sectors_view(data, sector_size), n), expected)
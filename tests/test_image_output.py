@@ -0,0 +1,156 @@
+# SPDX-License-Identifier: MIT
+
+import pytest
+from PIL import Image
+from histograms import np
+from analysis import ResultFlag, SectorResults
+from image_output import Sweeping, SweepingBlocks, HilbertCurve, palette_type
+from benchmark import _reference_d2xy
+
+SECTORS_PER_PIXEL = 4
+NONE, SBP, NOT_RANDOM, RANDOM = ResultFlag.NONE, ResultFlag.SINGLE_BYTE_PATTERN, ResultFlag.NOT_RANDOM, ResultFlag.RANDOM
+
+# the (flag, randomness, pattern) of the sectors of each run summarized by a pixel,
+# the (flag, randomness, pattern) of the sector colored as the sectors other than the zeroed ones
+# and the fraction of the zeroed sectors
+RUNS = [
+    ([(SBP, 0, 0)] * 4, (SBP, 0, 0), 1),
+    ([(RANDOM, 0, 0)] * 4, (RANDOM, 0, 0), 0),
+    ([(SBP, 0, 0), (RANDOM, 0, 0), (RANDOM, 0, 0), (NOT_RANDOM, 0, 0)], (RANDOM, 0, 0), 0.25),
+    ([(NONE, 0.2, 0), (SBP, 0, 0), (NONE, 0.4, 0), (SBP, 0, 0)], (NONE, 0.3, 0), 0.5),
+    ([(SBP, 0, 0), (SBP, 0, 0xff), (SBP, 0, 0), (SBP, 0, 0)], (SBP, 0, 0xff), 0.75),
+    ([(SBP, 0, 0xff), (NOT_RANDOM, 0, 0), (SBP, 0, 0x40), (SBP, 0, 0xff)], (SBP, 0, 0xff), 0),
+]
+
+
+def results(sectors):
+    flag, randomness, pattern = zip(*sectors)
+    return SectorResults(np.array(randomness, dtype=np.float64), np.array(flag, dtype=np.uint8),
+                         np.array(pattern, dtype=np.uint8))
+
+
+@pytest.fixture
+def output(tmp_path):
+    with open(tmp_path / 'image.png', 'wb') as output_file:
+        yield Sweeping(len(RUNS) * SECTORS_PER_PIXEL, output_file=output_file, no_legend=True,
+                       palette=palette_type('photocopy-safe'), max_pixels=len(RUNS))
+
+
+def expected_colors(output):
+    colors = []
+    for _, rest, zeroed_fraction in RUNS:
+        color = output._colors(results([rest]))[0].astype(np.float64)
+        colors.append(np.rint(color + zeroed_fraction * (output._zero_pattern_color - color)))
+    return np.array(colors, dtype=np.uint8)
+
+
+def test_runs_are_blended_by_the_zeroed_fraction(output):
+    positions, colors = output._summarize(0, results([sector for sectors, _, _ in RUNS for sector in sectors]))
+    assert positions.tolist() == list(range(len(RUNS)))
+    assert np.array_equal(colors, expected_colors(output))
+    # the mixed runs differ from both of their parts
+    assert not np.array_equal(colors[2], colors[1])
+    assert not np.array_equal(colors[2], colors[0])
+
+
+def test_runs_passed_in_parts(output):
+    sectors = [sector for sectors, _, _ in RUNS for sector in sectors]
+    positions, colors = [], []
+    for start, end in [(0, 6), (6, 7), (7, 17), (17, len(sectors))]:
+        batch_positions, batch_colors = output._summarize(start, results(sectors[start:end]))
+        positions.extend(batch_positions.tolist())
+        colors.extend(batch_colors)
+    assert positions == list(range(len(RUNS)))
+    assert np.array_equal(np.array(colors), expected_colors(output))
+
+
+def random_results(count, seed=0):
+    rng = np.random.default_rng(seed)
+    flag = rng.integers(0, 5, count).astype(np.uint8)
+    pattern = np.where(flag == SBP, rng.choice([0, 0, 0x40, 0xff], count), 0).astype(np.uint8)
+    return SectorResults(rng.random(count), flag, pattern)
+
+
+def scalar_coordinates(output, pos):
+    """The per-sector coordinates of the image outputs before the batch rendering"""
+    if hasattr(output, 'sweeping_block_size'):
+        sbs = output.sweeping_block_size
+        return ((pos % sbs + (pos // sbs ** 2) * sbs) % output.width,
+                (pos // sbs) % sbs + pos // (sbs * output.width) * sbs)
+    x, y = _reference_d2xy(output.width, pos % output.width ** 2)
+    return x, y + (pos // output.width ** 2) * output.width
+
+
+def rendered(output, batches, path):
+    for first_sector, batch in batches:
+        output.output_batch(first_sector, 512, batch)
+    output.exit()
+    with Image.open(path) as image:
+        return np.array(image.convert('RGB'))
+
+
+def image_output(output_class, sector_count, tmp_path, **kwargs):
+    return output_class(sector_count, output_file=open(tmp_path / 'image.png', 'wb'),
+                        err_file=open(tmp_path / 'err', 'w'), no_legend=True, **kwargs)
+
+
+def batches_of(results, size, shuffled=False):
+    batches = [(start, SectorResults(*(column[start:start + size] for column in results)))
+               for start in range(0, len(results.flag), size)]
+    if shuffled:
+        np.random.default_rng(1).shuffle(batches)
+    return batches
+
+
+@pytest.mark.parametrize('output_class', [Sweeping, SweepingBlocks, HilbertCurve])
+@pytest.mark.parametrize('palette', ['photocopy-safe', 'asalor', 'rg'])
+def test_batches_render_the_pixels_of_putpixel(tmp_path, output_class, palette):
+    sector_count = 3001
+    results = random_results(sector_count)
+    output = image_output(output_class, sector_count, tmp_path, palette=palette_type(palette))
+    pixels = rendered(output, batches_of(results, 256, shuffled=True), tmp_path / 'image.png')
+
+    with Image.new('RGB', pixels.shape[1::-1], (255, 255, 255)) as expected:
+        for sector_number in range(sector_count):
+            expected.putpixel(scalar_coordinates(output, sector_number),
+                              palette_type(palette).get(sector_number, sector_number * 512,
+                                                        float(results.randomness[sector_number]),
+                                                        int(results.flag[sector_number]),
+                                                        int(results.pattern[sector_number])))
+        assert np.array_equal(pixels, np.array(expected))
+
+
+def downsampled(output, results, sectors_per_pixel):
+    """The color of each run of sectors_per_pixel sectors summarized one sector at a time"""
+    palette = output.palette
+    zero_color = np.array(palette.get(0, 0, 0.0, SBP, 0), dtype=np.float64)
+    colors = []
+    for start in range(0, len(results.flag), sectors_per_pixel):
+        run = list(zip(*(column[start:start + sectors_per_pixel].tolist() for column in results)))
+        zeroed = [sector for sector in run if sector[1] == SBP and sector[2] == 0]
+        rest = [sector for sector in run if not (sector[1] == SBP and sector[2] == 0)]
+        counts = [sum(1 for _, flag, _ in rest if flag == value) for value in ResultFlag]
+        flag = max(ResultFlag, key=lambda value: (counts[value], -value))
+        none = [randomness for randomness, flag, _ in rest if flag == NONE]
+        randomness = sum(none) / max(len(none), 1)
+        pattern = max([pattern for _, flag, pattern in run if flag == SBP], default=0)
+        color = np.array(palette.get(0, 0, randomness, flag, pattern), dtype=np.float64)
+        colors.append(np.rint(color + len(zeroed) / len(run) * (zero_color - color)))
+    return np.array(colors, dtype=np.uint8)
+
+
+@pytest.mark.parametrize('output_class', [Sweeping, HilbertCurve])
+@pytest.mark.parametrize('shuffled', [False, True], ids=['in-order', 'out-of-order'])
+def test_max_pixels_matches_downsampled_image(tmp_path, output_class, shuffled):
+    sector_count = 3001  # the last pixel summarizes a shorter run
+    sectors_per_pixel = 7
+    results = random_results(sector_count, 2)
+    output = image_output(output_class, sector_count, tmp_path, palette=palette_type('photocopy-safe'),
+                          max_pixels=-(-sector_count // sectors_per_pixel))
+    assert output._sectors_per_pixel == sectors_per_pixel
+    # the batches start and end within the runs of the pixels
+    pixels = rendered(output, batches_of(results, 100, shuffled), tmp_path / 'image.png')
+
+    positions = np.arange(-(-sector_count // sectors_per_pixel))
+    x, y = output._coords_from_pos(positions)
+    assert np.array_equal(pixels[y, x], downsampled(output, results, sectors_per_pixel))
@@ -0,0 +1,42 @@
+# SPDX-License-Identifier: MIT
+
+import pytest
+from histograms import np
+from analysis import ResultFlag
+from palettes import palettes, compile_palette, _get_simple_palette, _rgba
+
+custom_palette = _get_simple_palette(
+    random=(10, 200, 30, 128),
+    not_random=(250, 5, 90, 255),
+    too_random=(1, 2, 3, 4),
+    zero_pattern=(0, 0, 0, 0),
+    pattern=(255, 255, 255, 255),
+    low_pattern=(17, 34, 51, 68),
+    absolute_not_random_at=0.3
+)
+
+
+def sector_results(thresholds):
+    """Every byte pattern, every result flag and randomness values around each color change"""
+    randomness = np.concatenate([
+        np.linspace(0, 1, 10001),
+        np.random.default_rng(0).random(10000),
+        thresholds,
+        np.nextafter(thresholds, 0)
+    ])
+    flag = np.full(len(randomness), ResultFlag.NONE, dtype=np.uint8)
+    pattern = np.zeros(len(randomness), dtype=np.uint8)
+    flag[:256] = ResultFlag.SINGLE_BYTE_PATTERN
+    pattern[:256] = np.arange(256)
+    flag[256:256 + len(ResultFlag)] = list(ResultFlag)
+    return flag, pattern, randomness
+
+
+@pytest.mark.parametrize('palette', [*palettes.values(), custom_palette])
+def test_compiled_palette_matches_get(palette):
+    table = compile_palette(palette)
+    flag, pattern, randomness = sector_results(table.thresholds)
+    compiled = table.colors[table.indexes(flag, pattern, randomness)]
+    expected = [_rgba(palette.get(0, 0, r, f, p if f == ResultFlag.SINGLE_BYTE_PATTERN else None))
+                for f, p, r in zip(flag.tolist(), pattern.tolist(), randomness.tolist())]
+    assert compiled.tolist() == [list(color) for color in expected]
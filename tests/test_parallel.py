@@ -0,0 +1,30 @@
+# SPDX-License-Identifier: MIT
+
+import pytest
+from test_analysis import mixed_sectors
+
+
+@pytest.fixture
+def image(tmp_path):
+    path = tmp_path / 'disk.img'
+    path.write_bytes(mixed_sectors(512, 3000))
+    return path
+
+
+@pytest.mark.parametrize('jobs', [2, 3])
+def test_parallel_csv_is_identical_to_serial_scan(image, run_script, jobs):
+    options = ['-m', 'csv', '-a', 'shannon,chi2-3', '--batch-size', 16]
+    assert run_script(*options, '--jobs', jobs, image) == run_script(*options, image)
+
+
+@pytest.mark.parametrize('method_options', [
+    ['-m', 'binary'],
+    ['-m', 'sweeping', '--no-legend', '--font', '-'],
+    ['-m', 'hilbert-curve', '--no-legend', '--font', '-']
+])
+def test_parallel_output_files_are_identical_to_serial_scan(tmp_path, image, run_script, method_options):
+    # the image outputs take the batches in the order they complete
+    options = [*method_options, '--batch-size', 16]
+    run_script(*options, '--output-file', tmp_path / 'serial', image)
+    run_script(*options, '--jobs', 3, '--output-file', tmp_path / 'parallel', image)
+    assert (tmp_path / 'parallel').read_bytes() == (tmp_path / 'serial').read_bytes()
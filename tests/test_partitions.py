@@ -0,0 +1,37 @@
+# SPDX-License-Identifier: MIT
+
+import struct
+import pytest
+from test_analysis import mixed_sectors
+
+SECTOR_COUNT = 6000
+PARTITIONS = [(1, 2048, 1500), (2, 3600, 2399)]  # (number, first sector, sectors), the second one with an odd size
+
+
+def mbr_image(path):
+    data = bytearray(mixed_sectors(512, SECTOR_COUNT))
+    entries = b''.join(struct.pack('<B3sB3sII', 0, b'\0' * 3, 0x83, b'\0' * 3, first_sector, sectors)
+                       for _, first_sector, sectors in PARTITIONS)
+    data[446:512] = entries.ljust(64, b'\0') + b'\x55\xaa'
+    path.write_bytes(data)
+    return data
+
+
+@pytest.mark.parametrize('method', [['-m', 'csv'], ['-m', 'binary'], ['-m', 'hilbert-curve', '--no-legend', '--font', '-']],
+                         ids=['csv', 'binary', 'hilbert-curve'])
+def test_each_partition_matches_a_scan_of_the_partition(tmp_path, run_script, method):
+    data = mbr_image(tmp_path / 'disk.img')
+    extension = '.png' if 'hilbert-curve' in method else '.out'
+    run_script(*method, '--each-partition', '--output-file', tmp_path / f'disk{extension}', tmp_path / 'disk.img')
+    for number, first_sector, sectors in PARTITIONS:
+        partition = tmp_path / f'partition{number}.img'
+        partition.write_bytes(data[first_sector * 512:(first_sector + sectors) * 512])
+        run_script(*method, '--output-file', tmp_path / f'partition{number}{extension}', partition)
+        assert (tmp_path / f'disk-p{number}{extension}').read_bytes() == \
+            (tmp_path / f'partition{number}{extension}').read_bytes()
+
+
+def test_partitions_are_listed_without_the_output_method(tmp_path, run_script):
+    mbr_image(tmp_path / 'disk.img')
+    assert run_script('--list-partitions', tmp_path / 'disk.img') == \
+        run_script('-m', 'csv', '--list-partitions', tmp_path / 'disk.img')
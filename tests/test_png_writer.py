@@ -0,0 +1,55 @@
+# SPDX-License-Identifier: MIT
+
+import io
+import pytest
+from PIL import Image
+from histograms import np
+from png_writer import PNGWriter
+from test_analysis import mixed_sectors
+
+
+def decoded(data):
+    with Image.open(io.BytesIO(data)) as image:
+        return image.mode, np.array(image)
+
+
+@pytest.mark.parametrize('mode', ['RGB', 'RGBA'])
+@pytest.mark.parametrize('width, height', [(1, 1), (37, 23), (300, 257)])
+def test_rows_are_decoded_by_pillow(mode, width, height):
+    rows = np.random.default_rng(width).integers(0, 256, (height, width, len(mode)), dtype=np.uint8)
+    rows[height // 2:] = rows[height // 2]  # rows the same as the one above them
+    f = io.BytesIO()
+    writer = PNGWriter(f, width, height, mode)
+    for start in range(0, height, 10):
+        writer.write_rows(rows[start:start + 10])
+    writer.close()
+    decoded_mode, pixels = decoded(f.getvalue())
+    assert decoded_mode == mode
+    assert np.array_equal(pixels, rows)
+
+
+def test_row_count_is_checked():
+    writer = PNGWriter(io.BytesIO(), 4, 2, 'RGB')
+    writer.write_rows(np.zeros((1, 4, 3), dtype=np.uint8))
+    with pytest.raises(ValueError):
+        writer.close()
+    with pytest.raises(ValueError):
+        writer.write_rows(np.zeros((2, 4, 3), dtype=np.uint8))
+
+
+# the width is odd or the sectors do not fill the last row of blocks
+@pytest.mark.parametrize('layout', [['-m', 'sweeping', '--width', 37],
+                                    ['-m', 'sweeping-blocks', '--width', 48, '--sweeping-block-size', 16],
+                                    ['-m', 'sweeping-blocks']],
+                         ids=['sweeping', 'sweeping-blocks', 'automatic'])
+@pytest.mark.parametrize('legend', [['--no-legend'], []], ids=['no-legend', 'legend'])
+def test_streamed_image_matches_image(tmp_path, run_script, layout, legend):
+    image = tmp_path / 'disk.img'
+    image.write_bytes(mixed_sectors(512, 3001))
+    options = [*layout, *legend, '--font', '-']
+    run_script(*options, '--output-file', tmp_path / 'image.png', image)
+    run_script(*options, '--stream', '--output-file', tmp_path / 'streamed.png', image)
+    expected_mode, expected = decoded((tmp_path / 'image.png').read_bytes())
+    mode, pixels = decoded((tmp_path / 'streamed.png').read_bytes())
+    assert mode == expected_mode
+    assert np.array_equal(pixels, expected)
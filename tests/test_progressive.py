@@ -0,0 +1,15 @@
+# SPDX-License-Identifier: MIT
+
+import pytest
+from test_analysis import mixed_sectors
+
+
+@pytest.mark.parametrize('method', ['sweeping', 'sweeping-blocks', 'hilbert-curve'])
+@pytest.mark.parametrize('legend', [[], ['--no-legend']])
+def test_progressive_scan_ends_with_the_image_of_the_serial_scan(tmp_path, run_script, method, legend):
+    image = tmp_path / 'disk.img'
+    image.write_bytes(mixed_sectors(512, 9000))  # more than two sectors of the coarsest level
+    options = ['-m', method, *legend, '--font', '-', '-a', 'chi2-3', '--batch-size', 64]
+    run_script(*options, '--output-file', tmp_path / 'serial.png', image)
+    run_script(*options, '--progressive', '--output-file', tmp_path / 'progressive.png', image)
+    assert (tmp_path / 'progressive.png').read_bytes() == (tmp_path / 'serial.png').read_bytes()
@@ -0,0 +1,88 @@
+# SPDX-License-Identifier: MIT
+
+import pytest
+from histograms import np
+from qcow2 import Qcow2File
+from qcow2_writer import write_qcow2, cluster_kinds, UNALLOCATED, ZERO, ZERO_ALLOCATED, DATA, COMPRESSED
+from test_analysis import mixed_sectors
+
+FORMATS = [(2, 9), (3, 9), (3, 12)]  # (version, cluster_bits)
+
+
+def guest_disk(seed=0):
+    """Runs of zeroed sectors between mixed ones, with a zeroed range longer than an L2 table
+    of 512 byte clusters covers and a size which is not a multiple of the cluster size"""
+    rng = np.random.default_rng(seed)
+    sectors = np.frombuffer(mixed_sectors(512, 700, seed), dtype=np.uint8).reshape(-1, 512).copy()
+    position = 0
+    while position < len(sectors):
+        run = int(rng.integers(1, 40))
+        if rng.random() < 0.5:
+            sectors[position:position + run] = 0
+        position += run
+    sectors[200:400] = 0
+    return sectors.tobytes()
+
+
+@pytest.fixture(params=FORMATS, ids=[f'v{version}-{1 << bits}' for version, bits in FORMATS])
+def images(request, tmp_path):
+    """The raw guest disk and the same disk as a qcow2 image using every kind of cluster its version supports"""
+    version, cluster_bits = request.param
+    raw = guest_disk()
+    kinds = cluster_kinds(raw, cluster_bits, version)
+    cluster_sectors = 1 << (cluster_bits - 9)
+    # leave the long zeroed range unallocated, so that an L1 entry of 512 byte clusters has no L2 table
+    kinds[-(-200 // cluster_sectors):400 // cluster_sectors] = \
+        [UNALLOCATED] * len(kinds[-(-200 // cluster_sectors):400 // cluster_sectors])
+    expected_kinds = {UNALLOCATED, ZERO, ZERO_ALLOCATED, DATA, COMPRESSED} if version == 3 else \
+        {UNALLOCATED, DATA, COMPRESSED}
+    assert set(kinds) == expected_kinds
+    raw_path = tmp_path / 'disk.raw'
+    raw_path.write_bytes(raw)
+    qcow2_path = tmp_path / 'disk.qcow2'
+    garbage = write_qcow2(qcow2_path, raw, kinds, cluster_bits, version)
+    return raw_path, qcow2_path, kinds, cluster_bits, garbage
+
+
+def test_guest_disk_is_read(images):
+    raw_path, qcow2_path, _, _, _ = images
+    raw = raw_path.read_bytes()
+    with open(qcow2_path, 'rb') as f:
+        qcow2 = Qcow2File(f)
+        assert qcow2.size == len(raw)
+        rng = np.random.default_rng(5)
+        for offset, length in [(0, len(raw)), *zip(rng.integers(0, len(raw), 50).tolist(),
+                                                   rng.integers(1, 8192, 50).tolist())]:
+            view = bytearray(length)
+            qcow2.read_into(memoryview(view), offset)
+            assert view == raw[offset:offset + length] + bytes(max(offset + length - len(raw), 0))
+
+
+def test_holes_are_the_zero_clusters(images):
+    _, qcow2_path, kinds, cluster_bits, garbage = images
+    with open(qcow2_path, 'rb') as f:
+        qcow2 = Qcow2File(f)
+        in_holes = np.zeros(len(kinds), dtype=bool)
+        for start, end in qcow2.holes():
+            assert start % (1 << cluster_bits) == 0
+            in_holes[start >> cluster_bits:-(-end >> cluster_bits)] = True
+        assert in_holes.tolist() == [kind in (UNALLOCATED, ZERO, ZERO_ALLOCATED) for kind in kinds]
+
+        # the holes are never read, not even the host clusters of the allocated zero clusters
+        qcow2.read_into(memoryview(bytearray(qcow2.size)), 0)
+        assert qcow2.read_ranges
+        cluster_size = 1 << cluster_bits
+        assert not [(offset, length) for offset, length in qcow2.read_ranges
+                    for start in garbage if offset < start + cluster_size and start < offset + length]
+
+
+@pytest.mark.parametrize('options', [[], ['--jobs', 2], ['--pipeline']], ids=['serial', 'jobs', 'pipeline'])
+def test_results_match_raw_image(images, run_script, tmp_path, options):
+    raw_path, qcow2_path, _, _, _ = images
+    analysis = ['-a', 'shannon,chi2-8,chi2-3']
+    assert run_script('-m', 'csv', *analysis, *options, qcow2_path) == \
+        run_script('-m', 'csv', *analysis, *options, raw_path)
+
+    for path in (raw_path, qcow2_path):
+        run_script('-m', 'binary', *analysis, *options, '--output-file', tmp_path / f'{path.name}.bin', path)
+    assert (tmp_path / 'disk.qcow2.bin').read_bytes() == (tmp_path / 'disk.raw.bin').read_bytes()
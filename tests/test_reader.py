@@ -0,0 +1,100 @@
+# SPDX-License-Identifier: MIT
+
+import os
+import pytest
+from histograms import np
+from analysis import analysis_methods, MultiAnalysis
+from reader import MappedImage, StreamImage, holes, hole_extents
+from script import iterate, iterate_stream
+from test_analysis import mixed_sectors
+
+SPARSE_BLOCK = 1 << 16  # larger than the allocation unit of the usual file systems
+
+
+def test_hole_extents_only_contain_whole_sectors():
+    holes_ = [(100, 2048), (4096, 5000), (6144, 10240)]
+    assert list(hole_extents(holes_, 10240, 512)) == [
+        (0, 1, False), (1, 4, True), (4, 8, False), (8, 9, True), (9, 12, False), (12, 20, True)
+    ]
+    assert list(hole_extents([], 1000, 512)) == [(0, 1, False)]
+
+
+@pytest.fixture
+def sparse_image(tmp_path):
+    """A sparse file of data blocks between holes and its copy without holes"""
+    data = mixed_sectors(512, SPARSE_BLOCK // 512 * 3)
+    sparse = tmp_path / 'sparse.img'
+    with open(sparse, 'wb') as f:
+        f.truncate(SPARSE_BLOCK * 16)
+        for block, offset in enumerate((0, 5, 11)):
+            f.seek(offset * SPARSE_BLOCK)
+            f.write(data[block * SPARSE_BLOCK:(block + 1) * SPARSE_BLOCK])
+    dense = tmp_path / 'dense.img'
+    dense.write_bytes(sparse.read_bytes())
+    with open(sparse, 'rb') as f:
+        if not list(holes(f.fileno(), os.path.getsize(sparse))):
+            pytest.skip('the file system does not report the holes of sparse files')
+    return sparse, dense
+
+
+def test_holes_are_reported(sparse_image):
+    sparse, _ = sparse_image
+    with open(sparse, 'rb') as f:
+        found = list(holes(f.fileno(), os.path.getsize(sparse)))
+    # the file system may allocate more than was written, but never less
+    covered = sum(end - start for start, end in found)
+    assert 0 < covered <= 13 * SPARSE_BLOCK
+    for start, end in found:
+        assert not any(start < (offset + 1) * SPARSE_BLOCK and offset * SPARSE_BLOCK < end for offset in (0, 5, 11))
+
+
+@pytest.mark.parametrize('options', [[], ['--jobs', 2], ['--pipeline'], ['-a', 'chi2-3,shannon']])
+def test_sparse_scan_matches_dense_copy(sparse_image, run_script, options):
+    sparse, dense = sparse_image
+    assert run_script('-m', 'csv', *options, sparse) == run_script('-m', 'csv', *options, dense)
+
+
+class CollectingOutput:
+    def __init__(self):
+        self.batches = []
+
+    def output_batch(self, first_sector, sector_size, results):
+        self.batches.append((first_sector, results.randomness.copy(), results.flag.copy(), results.pattern.copy()))
+        return True
+
+    def error(self, message):
+        raise AssertionError(message)
+
+    def results(self):
+        first_sectors, randomness, flags, patterns = zip(*sorted(self.batches, key=lambda batch: batch[0]))
+        return (first_sectors[0], np.concatenate(randomness).tolist(),
+                np.concatenate(flags).tolist(), np.concatenate(patterns).tolist())
+
+
+@pytest.fixture
+def image_file(tmp_path):
+    path = tmp_path / 'disk.img'
+    path.write_bytes(mixed_sectors(512, 1500))
+    return path
+
+
+def test_stream_reads_match_mapping(image_file):
+    with open(image_file, 'rb') as f, MappedImage(f) as mapped, open(image_file, 'rb') as g, StreamImage(g) as stream:
+        assert stream.size == mapped.size
+        for offset, length in ((0, 512), (1000, 70000), (700 * 512, 512 * 800), (mapped.size - 100, 100)):
+            assert bytes(stream.read(offset, length)) == bytes(mapped.read(offset, length))
+        sector_numbers = np.array([1499, 3, 700, 3, 0])
+        assert np.array_equal(stream.gather(sector_numbers, 512), mapped.gather(sector_numbers, 512))
+
+
+@pytest.mark.parametrize('extents', [None, [(100, 1300, False)]])
+@pytest.mark.parametrize('batch_size', [512, 48 * 1024, 1 << 20])
+def test_stream_scan_matches_mapped_scan(image_file, extents, batch_size):
+    analysis_method = MultiAnalysis([analysis_methods['chi2-4'](512)])
+    mapped_output = CollectingOutput()
+    with open(image_file, 'rb') as f, MappedImage(f) as image:
+        iterate(image, 512, analysis_method, mapped_output, extents, batch_size)
+    stream_output = CollectingOutput()
+    with open(image_file, 'rb') as f, StreamImage(f) as image:
+        iterate_stream(image, 512, analysis_method, stream_output, extents, batch_size)
+    assert stream_output.results() == mapped_output.results()
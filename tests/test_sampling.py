@@ -0,0 +1,12 @@
+# SPDX-License-Identifier: MIT
+
+from test_analysis import mixed_sectors
+
+
+def test_sample_does_not_use_the_output_method(tmp_path, run_script):
+    image = tmp_path / 'disk.img'
+    image.write_bytes(mixed_sectors(512, 2000))
+    # the default image output method would need a font
+    report = run_script('--sample', 300, '--seed', 1, image)
+    assert report.startswith(b'# 300 of 2000 sectors sampled (seed 1)')
+    assert report == run_script('-m', 'csv', '--sample', 300, '--seed', 1, image)
@@ -0,0 +1,50 @@
+# SPDX-License-Identifier: MIT
+
+import pytest
+from PIL import Image
+from histograms import np
+from test_analysis import mixed_sectors
+
+TILE_SIZE = 16
+
+
+def stitched(tiles_dir, level, width, height):
+    """The image of a zoom level put together from its tiles"""
+    pixels = None
+    for row in range(-(-height // TILE_SIZE)):
+        for column in range(-(-width // TILE_SIZE)):
+            with Image.open(tiles_dir / str(level) / f'{column}_{row}.png') as tile:
+                tile_pixels = np.asarray(tile)
+            if pixels is None:
+                pixels = np.zeros((height, width, tile_pixels.shape[2]), dtype=np.uint8)
+            pixels[row * TILE_SIZE:(row + 1) * TILE_SIZE, column * TILE_SIZE:(column + 1) * TILE_SIZE] = tile_pixels
+    return pixels
+
+
+def halved(pixels):
+    """Averages every 2x2 square of pixels, the odd last column and row with themselves"""
+    height, width = pixels.shape[:2]
+    padded = np.pad(pixels, ((0, height % 2), (0, width % 2), (0, 0)), mode='edge').astype(np.float64)
+    return padded.reshape(-(-height // 2), 2, -(-width // 2), 2, -1).mean(axis=(1, 3)).round().astype(np.uint8)
+
+
+@pytest.mark.parametrize('method', ['sweeping', 'sweeping-blocks', 'hilbert-curve'])
+def test_tiles_match_image_of_the_layout(tmp_path, run_script, method):
+    image = tmp_path / 'disk.img'
+    image.write_bytes(mixed_sectors(512, 3000))
+    options = ['--no-legend', '--font', '-', '-a', 'chi2-3']
+    run_script('-m', method, *options, '--output-file', tmp_path / 'disk.png', image)
+    run_script('-m', f'deep-zoom-{method}', *options, '--tile-size', TILE_SIZE,
+               '--output-file', tmp_path / 'disk.dzi', image)
+
+    with Image.open(tmp_path / 'disk.png') as full:
+        expected = np.asarray(full)
+    height, width = expected.shape[:2]
+    assert f'Width="{width}" Height="{height}"' in (tmp_path / 'disk.dzi').read_text()
+    max_level = (max(width, height) - 1).bit_length()
+    for level in range(max_level, -1, -1):
+        pixels = stitched(tmp_path / 'disk_files', level, width, height)
+        assert np.array_equal(pixels, expected), f'level {level}'
+        expected = halved(expected)
+        height, width = expected.shape[:2]
+    assert height == width == 1